@@ -4,146 +4,436 @@
 # rewritten by Thomas Nagy 2009
 
 """
-Start a new build as soon as something changes in the build directory.
+Resident build server: the build context (scripts, task generators, tasks, node tree and
+signatures) is kept in memory between the builds, and the files are watched for changes::
 
-PyInotify, Fam, Gamin or time-threshold are used for the detection
+	$ waf configure
+	$ waf daemon                   # start the server, the first build is executed immediately
+	$ python wafc.py               # build through the server (thin client, waf is not loaded)
+	$ python wafc.py stop          # stop the server
+	$ waf daemon --daemon-auto     # rebuild as soon as something changes
 
-For now only PyInotify and time threshold are supported
-Watching for new svn revisions could be added too
+The server listens on 127.0.0.1, and the port is written to the file .wafdaemon in the project directory
+with a random token, the requests without the token are rejected. The file is only readable by its owner.
+
+The changes are detected through pyinotify if available, or by polling the files and the folders
+(:py:class:`PollWatch`). When a script, a configuration file or a folder changes (new files may
+be found by ant_glob), the build context is created again without restarting the process.
+The files matching IGNORE (editor backups and swap files, hidden files) are not considered,
+and the changes to the other files of the watched folders are ignored unless files are added or removed.
+Otherwise the signatures of the files that changed are computed again and the tasks from
+the previous build are scheduled again, so that a build with no change returns immediately.
+
+The outputs removed or modified by other processes in the build directory are not detected.
 """
 
-import select, errno, os, time
-from waflib import Utils, Scripting, Logs, Build, Node, Context, Options
+import os, sys, time, socket, threading, fnmatch, binascii
+from waflib import Utils, Logs, Build, Context, Options, Scripting, Task, Errors
+
+PORTFILE = '.wafdaemon'
+"""File containing the port of the server and the token of the clients, in the project directory"""
+
+IGNORE = ['.*', '*~', '*.swp', '*.swx', '#*#']
+"""Patterns of the file names for which the changes are not considered (hidden files, editor backups)"""
 
-w_pyinotify = w_fam = w_gamin = None
+POLL = 0.5
+"""Interval in seconds between two checks of the files (polling)"""
+
+w_pyinotify = None
 def check_support():
-	global w_pyinotify, w_fam, w_gamin
+	global w_pyinotify
 	try:
 		import pyinotify as w_pyinotify
 	except ImportError:
 		w_pyinotify = None
-	else:
-		try:
-			wm = w_pyinotify.WatchManager()
-			wm = w_pyinotify.Notifier(wm)
-			wm = None
-		except:
-			raise
-			w_pyinotify = None
 
+def options(opt):
+	opt.add_option('--daemon-auto', action='store_true', default=False, dest='daemon_auto',
+		help='rebuild as soon as something changes (waf daemon)')
+	Context.g_module.__dict__['daemon'] = daemon
+
+def daemon(ctx):
+	"""waf command: build server keeping the build data in memory"""
+	srv = Server()
 	try:
-		import gamin as w_gamin
-	except ImportError:
-		w_gamin = None
-	else:
-		try:
-			test = w_gamin.WatchMonitor()
-			test.disconnect()
-			test = None
-		except:
-			w_gamin = None
+		srv.serve()
+	finally:
+		srv.close()
+
+def ignored(path):
+	"""Return True if the changes to a path must not be considered, see :py:const:`IGNORE`"""
+	name = os.path.basename(path)
+	for x in IGNORE:
+		if fnmatch.fnmatchcase(name, x):
+			return True
+	return False
 
+def stat_key(path):
 	try:
-		import _fam as w_fam
-	except ImportError:
-		w_fam = None
-	else:
-		try:
-			test = w_fam.open()
-			test.close()
-			test = None
-		except:
-			w_fam = None
+		st = os.stat(path)
+	except OSError:
+		return None
+	if os.path.isdir(path):
+		# the folders change when files are added or removed, the temporary files are ignored
+		return [x for x in sorted(Utils.listdir(path)) if not ignored(x)]
+	return (st.st_ino, st.st_size, st.st_mtime)
 
-def daemon(ctx):
-	"""waf command: rebuild as soon as something changes"""
-	bld = None
-	while True:
-		bld = Context.create_context('build')
-		try:
-			bld.options = Options.options
-			bld.cmd = 'build'
-			bld.execute()
-		except ctx.errors.WafError as e:
-			print(e)
-		except KeyboardInterrupt:
-			Utils.pprint('RED', 'interrupted')
-			break
+class PollWatch(object):
+	"""Detect the changes by checking the files and the folders periodically (stand-in for inotify)"""
+	def __init__(self, notify):
+		self.notify = notify
+		self.stats = {}
+		self.stopped = False
+		self.thread = threading.Thread(target=self.loop)
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	def set_paths(self, paths):
+		# keep the previous values, the files may have changed since the build started
+		old = self.stats
+		self.stats = dict([(x, x in old and old[x] or stat_key(x)) for x in paths])
+
+	def loop(self):
+		while not self.stopped:
+			time.sleep(POLL)
+			stats = self.stats
+			lst = []
+			for (k, v) in list(stats.items()):
+				n = stat_key(k)
+				if n != v:
+					stats[k] = n
+					lst.append(k)
+			if lst:
+				self.notify(lst)
+
+	def stop(self):
+		self.stopped = True
+
+class InotifyWatch(object):
+	"""
+	Detect the changes through pyinotify, the folders containing the files are watched.
+	The events are reported for the files watched, and for the files added or removed in the folders
+	"""
+	def __init__(self, notify):
+		self.notify = notify
+		self.dirs = set()
+		self.paths = set()
+		self.wm = w_pyinotify.WatchManager()
+		m = w_pyinotify
+		added_removed = m.IN_CREATE | m.IN_DELETE | m.IN_MOVED_TO | m.IN_MOVED_FROM
+		watch = self
+		class handler(w_pyinotify.ProcessEvent):
+			def process_default(self, event):
+				path = event.pathname
+				if path in watch.paths or (event.mask & added_removed and not ignored(path)):
+					notify([path])
+		self.notifier = w_pyinotify.ThreadedNotifier(self.wm, handler())
+		self.notifier.setDaemon(True)
+		self.notifier.start()
+
+	def set_paths(self, paths):
+		m = w_pyinotify
+		mask = m.IN_CLOSE_WRITE | m.IN_DELETE | m.IN_CREATE | m.IN_MOVED_TO | m.IN_MOVED_FROM | m.IN_ATTRIB
+		self.paths = set(paths)
+		for x in paths:
+			d = os.path.isdir(x) and x or os.path.dirname(x)
+			if not d in self.dirs:
+				self.dirs.add(d)
+				self.wm.add_watch(d, mask)
+
+	def stop(self):
+		self.notifier.stop()
+
+class Tee(object):
+	"""Send the output of a build to a client, in addition to the console"""
+	def __init__(self, stream, conn):
+		self.stream = stream
+		self.conn = conn
+		self.lock = threading.Lock()
 
+	def write(self, data):
+		self.stream.write(data)
+		if not self.conn:
+			return
+		if not isinstance(data, bytes):
+			data = data.encode('utf-8', 'replace')
+		self.lock.acquire()
 		try:
-			x = ctx.state
-		except AttributeError:
-			setattr(ctx, 'state', DirWatch())
-			x = ctx.state
+			try:
+				self.conn.sendall(data)
+			except socket.error:
+				# the client is gone, the build continues
+				self.conn = None
+		finally:
+			self.lock.release()
 
-		x.wait(bld)
+	def flush(self):
+		self.stream.flush()
 
-def options(opt):
-	"""So this shows how to add new commands from tools"""
-	Context.g_module.__dict__['daemon'] = daemon
+	def isatty(self):
+		return False
 
-class DirWatch(object):
+	def fileno(self):
+		return self.stream.fileno()
+
+def exec_command(self, cmd, **kw):
+	# capture the output of the processes when a client is connected
+	if isinstance(sys.stderr, Tee) and not 'stdout' in kw and not 'stderr' in kw and not self.logger:
+		kw['stdout'] = Utils.subprocess.PIPE
+		kw['stderr'] = Utils.subprocess.STDOUT
+		kw['shell'] = isinstance(cmd, str)
+		Logs.debug('runner: %r' % cmd)
+		try:
+			p = Utils.subprocess.Popen(cmd, **kw)
+			out = p.communicate()[0]
+		except OSError:
+			return -1
+		if out:
+			sys.stderr.write(out.decode(getattr(sys.stdout, 'encoding', None) or 'iso8859-1', 'replace'))
+		return p.returncode
+	return self.exec_command_daemon(cmd, **kw)
+Context.Context.exec_command_daemon = Context.Context.exec_command
+Context.Context.exec_command = exec_command
+
+class Server(object):
+	"""Keep a build context in memory and execute the builds requested by the clients"""
 	def __init__(self):
+		self.bld = None
+		self.failed = False
+		self.changed = set()
+		self.files = {}
+		"""Absolute paths of the source files used by the tasks, mapped to their nodes"""
+		self.reload_paths = set()
+		"""Scripts and configuration files, a change requires a new build context"""
+		self.lock = threading.Lock()
+		self.event = threading.Event()
+
 		check_support()
 		if w_pyinotify:
-			self.sup = 'pyinotify'
-		elif w_gamin:
-			self.sup = 'gamin'
-		elif w_fam:
-			self.sup = 'fam'
+			self.watch = InotifyWatch(self.notify)
 		else:
-			self.sup = 'dumb'
-		#self.sup = 'dumb'
+			self.watch = PollWatch(self.notify)
 
-	def wait(self, bld):
-		return getattr(self.__class__, 'wait_' + self.sup)(self, bld)
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.sock.bind(('127.0.0.1', 0))
+		self.sock.listen(5)
+		self.sock.settimeout(0.2)
+		self.token = binascii.hexlify(os.urandom(16)).decode()
+		self.portfile = os.path.join(Context.top_dir, PORTFILE)
+		self.write_portfile()
 
-	def enumerate(self, node):
-		if os.path.exists(node.abspath()):
-			yield node.abspath()
+	def write_portfile(self):
+		"""Write the port and the token, the file is created with the permissions 0600"""
 		try:
-			for x in node.children.values():
-				for k in self.enumerate(x):
-					yield k
-		except AttributeError:
+			os.remove(self.portfile)
+		except OSError:
 			pass
-		raise StopIteration
-
-	def wait_pyinotify(self, bld):
+		fd = os.open(self.portfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 384)
+		try:
+			os.write(fd, ('%d %s' % (self.sock.getsockname()[1], self.token)).encode())
+		finally:
+			os.close(fd)
 
-		class PE(w_pyinotify.ProcessEvent):
-			def stop(self, event):
-				self.notif.ev = True
-				self.notif.stop()
-				raise ValueError("stop for delete")
+	def close(self):
+		self.watch.stop()
+		self.sock.close()
+		try:
+			os.remove(self.portfile)
+		except OSError:
+			pass
 
-			process_IN_DELETE = stop
-			process_IN_CLOSE = stop
-			process_default = stop
+	def notify(self, paths):
+		"""Called by the watchers when files change"""
+		self.lock.acquire()
+		try:
+			self.changed.update(paths)
+		finally:
+			self.lock.release()
+		self.event.set()
 
-		proc = PE()
-		wm = w_pyinotify.WatchManager()
-		notif = w_pyinotify.Notifier(wm, proc)
-		proc.notif = notif
+	def serve(self):
+		Logs.info('Build server listening on port %d (%s)' % (self.sock.getsockname()[1], self.watch.__class__.__name__))
+		self.build()
+		while 1:
+			try:
+				conn = self.sock.accept()[0]
+			except socket.timeout:
+				if Options.options.daemon_auto and self.event.isSet():
+					# wait for the editors to save all the files
+					time.sleep(POLL)
+					self.build()
+				continue
+			try:
+				if not self.handle(conn):
+					break
+			finally:
+				conn.close()
 
-		# well, we should add all the folders to watch here
-		for x in self.enumerate(bld.srcnode):
-			wm.add_watch(x, w_pyinotify.IN_DELETE | w_pyinotify.IN_CLOSE_WRITE)
+	def handle(self, conn):
+		"""Process a client request, return False to stop the server"""
+		conn.settimeout(None)
+		buf = conn.recv(1024)
+		lst = buf.decode('utf-8', 'replace').split()
+		if len(lst) != 2 or lst[0] != self.token:
+			Logs.warn('Build server: rejected a request without a valid token')
+			conn.sendall(b'invalid token\n\x002')
+			return True
+		cmd = lst[1]
+		if cmd == 'stop':
+			conn.sendall(b'stopping the build server\n\x000')
+			return False
+		if cmd == 'status':
+			msg = '%d files watched, %d changes pending, last build %s\n' % (len(self.files), len(self.changed), self.failed and 'failed' or 'successful')
+			conn.sendall(msg.encode() + b'\x000')
+			return True
 
+		# build: send the output to the client
+		old = (sys.stdout, sys.stderr)
+		handlers = Logs.log.handlers
+		sys.stdout = Tee(sys.stdout, conn)
+		sys.stderr = Tee(sys.stderr, conn)
+		streams = [getattr(h, 'stream', None) for h in handlers]
+		for h in handlers:
+			if getattr(h, 'stream', None) in old:
+				h.stream = sys.stderr
+		try:
+			ret = self.build()
+		finally:
+			for (h, s) in zip(handlers, streams):
+				if s is not None:
+					h.stream = s
+			(sys.stdout, sys.stderr) = old
 		try:
-			# pyinotify uses an infinite loop ... not too nice, so we have to use an exception
-			notif.loop()
-		except ValueError:
+			conn.sendall(('\0%d' % ret).encode())
+		except socket.error:
 			pass
-		if not hasattr(notif, 'ev'):
-			raise KeyboardInterrupt
+		return True
+
+	def build(self):
+		"""Execute a build, return the exit status"""
+		timer = Utils.Timer()
+		self.lock.acquire()
+		try:
+			changed = self.changed
+			self.changed = set()
+			self.event.clear()
+		finally:
+			self.lock.release()
+
+		try:
+			if self.bld is None or [x for x in changed if not x in self.files or x in self.reload_paths]:
+				self.load()
+			elif changed or self.failed:
+				self.update(changed)
+			else:
+				Logs.info('Waf: no change (%s)' % timer)
+				return 0
+		except Errors.WafError as e:
+			self.failed = True
+			Logs.error(str(e))
+			Logs.error('Build failed (%s)' % timer)
+			return 1
+		except Exception:
+			# the build context may be in an inconsistent state
+			self.bld = None
+			self.failed = True
+			Logs.error(Utils.ex_stack())
+			return 2
+		finally:
+			if self.bld:
+				self.set_watched()
+			else:
+				# watch the scripts read so far
+				self.watch.set_paths(list(self.files.keys()) + list(self.reload_paths) + list(Context.cache_modules.keys()))
+		self.failed = False
+		Logs.info('Waf: build finished successfully (%s)' % timer)
+		return 0
+
+	def load(self):
+		"""Create a new build context, read the scripts and execute the build"""
+		Logs.info('Waf: reading the scripts')
+		self.bld = None
+		for k in list(Context.cache_modules.keys()):
+			if k.endswith(Context.WSCRIPT_FILE):
+				del Context.cache_modules[k]
+		Scripting.set_main_module(Context.g_module.root_path)
+		bld = Context.create_context('build')
+		bld.options = Options.options
+		bld.cmd = 'build'
+		try:
+			bld.execute()
+		except Errors.BuildError:
+			# the tasks are kept when only the build fails
+			self.bld = bld
+			raise
+		self.bld = bld
+
+	def update(self, changed):
+		"""Reset the state of the tasks and execute the build from the data in memory"""
+		bld = self.bld
+		nodes = set([self.files[x] for x in changed])
+
+		# the signatures of the source files that did not change are kept
+		cache = getattr(bld, 'hash_cache', {})
+		keep = {}
+		for x in self.files.values():
+			if not x in nodes and id(x) in cache:
+				keep[id(x)] = cache[id(x)]
+		bld.hash_cache = keep
+
+		for i in range(len(bld.groups)):
+			for tsk in bld.get_tasks_group(i):
+				tsk.hasrun = Task.NOT_RUN
+				for x in ('cache_sig', 'cached', 'err_msg'):
+					try:
+						delattr(tsk, x)
+					except AttributeError:
+						pass
+
+		# the scripts are not executed again (Context.recurse_cache)
+		bld.execute_build()
+
+	def set_watched(self):
+		"""Compute the list of files and folders to watch from the build context"""
+		bld = self.bld
+		files = {}
+		def add(x):
+			if bld.srcnode is bld.bldnode or not x.is_child_of(bld.bldnode):
+				files[x.abspath()] = x
+		for x in bld.file_stats:
+			add(x)
+		for i in range(len(bld.groups)):
+			for tsk in bld.get_tasks_group(i):
+				for x in getattr(tsk, 'inputs', []) + getattr(tsk, 'dep_nodes', []):
+					add(x)
+				try:
+					deps = bld.node_deps.get(tsk.uid(), [])
+				except AttributeError:
+					deps = []
+				for x in deps:
+					add(x)
 
-	def wait_dumb(self, bld):
-		time.sleep(5)
+		reload_paths = set([x.abspath() for x in getattr(bld, 'recurse_cache', {})])
+		for x in Context.cache_modules:
+			reload_paths.add(x)
+		for x in Utils.listdir(bld.cache_dir):
+			if x.endswith(Build.CACHE_SUFFIX):
+				reload_paths.add(os.path.join(bld.cache_dir, x))
+		for env in bld.all_envs.values():
+			for x in env[Build.CFG_FILES]:
+				reload_paths.add(x)
 
-	def wait_gamin(self, bld):
-		time.sleep(5)
+		# the folders are watched for the new files
+		dirs = set()
+		if bld.srcnode is not bld.bldnode:
+			bpath = bld.bldnode.abspath()
+			for x in files:
+				d = os.path.dirname(x)
+				if not Utils.is_win32 and (d + os.sep).startswith(bpath + os.sep):
+					continue
+				dirs.add(d)
 
-	def wait_fam(self, bld):
-		time.sleep(5)
+		self.files = files
+		self.reload_paths = reload_paths
+		self.watch.set_paths(list(files.keys()) + list(reload_paths) + list(dirs))
 
@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Thin client for the build server (daemon.py), waf is not loaded::
+
+	$ python wafc.py            # build
+	$ python wafc.py status
+	$ python wafc.py stop
+
+The port of the server and the token sent with the requests are read from the file .wafdaemon
+in the current folder or in its parents.
+The exit status is the one of the build.
+"""
+
+import os, sys, socket
+
+PORTFILE = '.wafdaemon'
+
+def find_server():
+	"""Return the port and the token of the server"""
+	cur = os.getcwd()
+	while 1:
+		path = os.path.join(cur, PORTFILE)
+		if os.path.isfile(path):
+			f = open(path)
+			try:
+				(port, token) = f.read().split()
+			finally:
+				f.close()
+			return (int(port), token)
+		nxt = os.path.dirname(cur)
+		if nxt == cur:
+			return (None, None)
+		cur = nxt
+
+def main():
+	cmd = sys.argv[1:] and sys.argv[1] or 'build'
+	(port, token) = find_server()
+	if port is None:
+		sys.stderr.write('No build server found, run "waf daemon" first\n')
+		return 2
+	try:
+		conn = socket.create_connection(('127.0.0.1', port))
+	except socket.error:
+		sys.stderr.write('Could not connect to the build server on port %d\n' % port)
+		return 2
+
+	out = getattr(sys.stdout, 'buffer', sys.stdout)
+	conn.sendall(('%s %s\n' % (token, cmd)).encode())
+	status = None
+	while 1:
+		data = conn.recv(8192)
+		if not data:
+			break
+		if status is not None:
+			status += data
+			continue
+		pos = data.find(b'\0')
+		if pos >= 0:
+			status = data[pos + 1:]
+			data = data[:pos]
+		out.write(data)
+		out.flush()
+	conn.close()
+	try:
+		return int(status)
+	except (TypeError, ValueError):
+		sys.stderr.write('The build server did not return a status\n')
+		return 2
+
+if __name__ == '__main__':
+	sys.exit(main())
+
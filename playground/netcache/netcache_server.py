@@ -9,6 +9,22 @@ The client is located in waflib/extras/netcache_client.py
 This server uses a LRU cache policy (remove least recently used files), which means
 that there is no risk of filling up the entire filesystem.
 
+Architecture:
+-------------
+The listening socket is shared by several worker processes (PROCESSES) which serve the
+connections in threads, so that the server is not limited to one CPU core. The main process
+removes the least recently used entries in the background (every CLEAN_INTERVAL seconds,
+or when a client sends CLN).
+
+The sizes and the access times of the cache entries are kept in an index file (CACHEDIR/index.log)
+to which the workers append records (file stored, entry used, cache reset). The folders are
+only listed and the files only read when the index is missing (remove it to rebuild it).
+The main process reads the new records incrementally, and rewrites the index when it becomes large.
+
+The files are sent with os.sendfile when available (Python >= 3.3). The files received may
+be compressed (COMPRESS), in which case they are stored with the extension .z and decompressed
+when they are sent. The compressed and the uncompressed files may be present in the same cache.
+
 Security:
 ---------
 + the LRU cache policy will prevent filesystem saturation
@@ -17,19 +33,24 @@ Security:
 
 Performance:
 ------------
-The server seems to work pretty well (for me) at the moment. cPython is limited to only
-one CPU core, but there is a Java version of this server (Netcache.java). Send your
+There is also a Java version of this server (Netcache.java). Send your
 performance results to the Waf mailing-list!
 
 Future ideas:
 -------------
 - File transfer integrity
 - Use servers on different ports (eg: get->1200, put->51201) to enable firewall filtering
-- Use different processes for get/put (performance improvement)
 """
 
-import os, re, tempfile, socket, threading, shutil
-import SocketServer
+import os, re, tempfile, socket, threading, shutil, time, signal, struct, zlib
+try:
+	import socketserver
+except ImportError:
+	import SocketServer as socketserver
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
 
 CACHEDIR = '/tmp/wafcache'
 CONN = (socket.gethostname(), 51200)
@@ -38,79 +59,225 @@ BUF = 8192*16
 MAX = 50*1024*1024*1024 # in bytes
 CLEANRATIO = 0.85
 CHARS = '0123456789abcdef'
+DIRSIZE = 4096 # each entry takes 4kB
+
+PROCESSES = 4 # worker processes, 1 to serve the requests from the main process
+CLEAN_INTERVAL = 30 # seconds between two cache trims
+COMPACT = 4 # rewrite the index when it has more than COMPACT records per file
+COMPRESS = 0 # zlib compression level for the files received (0 to store them uncompressed)
+
+INDEX = 'index.log'
+LOCK = 'index.lock'
 
 GET = 'GET'
 PUT = 'PUT'
 LST = 'LST'
+BAT = 'BAT'
 BYE = 'BYE'
 CLEAN = 'CLN'
 RESET = 'RST'
 
 re_valid_query = re.compile('^[a-zA-Z0-9_, ]+$')
 
-flist = {}
-def init_flist():
-	"""map the cache folder names to the timestamps and sizes"""
-	global flist
+index_lock = threading.Lock()
+lock_file = [None, None]
+
+def lock_index(mode):
+	"""
+	Lock the index, the workers take shared locks to append records and the
+	main process takes an exclusive lock when the index is rewritten
+	"""
+	if not fcntl:
+		return None
+	if lock_file[0] != os.getpid():
+		lock_file[:] = [os.getpid(), open(os.path.join(CACHEDIR, LOCK), 'a')]
+	fcntl.flock(lock_file[1].fileno(), mode)
+	return lock_file[1]
+
+def unlock_index(f):
+	if f:
+		fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def append_index(line):
+	"""Append a record to the index, the records are small enough to be written at once"""
+	index_lock.acquire()
+	try:
+		f = lock_index(fcntl and fcntl.LOCK_SH)
+		try:
+			fd = os.open(os.path.join(CACHEDIR, INDEX), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 420)
+			try:
+				os.write(fd, line.encode())
+			finally:
+				os.close(fd)
+		finally:
+			unlock_index(f)
+	finally:
+		index_lock.release()
+
+class cache_index(object):
+	"""Sizes and access times of the cache entries, maintained by the main process"""
+	def __init__(self):
+		self.entries = {} # key -> [access time, {file number: size}]
+		self.total = 0
+		self.pos = 0
+		self.lines = 0
+
+	def apply(self, line):
+		lst = line.split()
+		if not lst:
+			return
+		if lst[0] == 'p':
+			(key, num, size, t) = (lst[1], lst[2], int(lst[3]), int(lst[4]))
+			try:
+				v = self.entries[key]
+			except KeyError:
+				v = self.entries[key] = [t, {}]
+				self.total += DIRSIZE
+			self.total += size - v[1].get(num, 0)
+			v[1][num] = size
+			v[0] = max(v[0], t)
+		elif lst[0] == 'h':
+			try:
+				v = self.entries[lst[1]]
+			except KeyError:
+				pass
+			else:
+				v[0] = max(v[0], int(lst[2]))
+		elif lst[0] == 'd':
+			try:
+				v = self.entries.pop(lst[1])
+			except KeyError:
+				pass
+			else:
+				self.total -= DIRSIZE + sum(v[1].values())
+		elif lst[0] == 'r':
+			self.entries = {}
+			self.total = 0
+
+	def load(self):
+		"""Read the records appended since the last call"""
+		try:
+			f = open(os.path.join(CACHEDIR, INDEX), 'rb')
+		except (OSError, IOError):
+			return
+		try:
+			f.seek(self.pos)
+			data = f.read().decode()
+		finally:
+			f.close()
+		# the last record may be incomplete
+		end = data.rfind('\n') + 1
+		for line in data[:end].splitlines():
+			try:
+				self.apply(line)
+			except (IndexError, ValueError):
+				print("Invalid record in the index %r" % line)
+			self.lines += 1
+		self.pos += len(data[:end].encode())
+
+	def write(self):
+		"""Rewrite the index with the current entries"""
+		index_lock.acquire()
+		f = lock_index(fcntl and fcntl.LOCK_EX)
+		try:
+			self.load()
+			lst = []
+			for (key, v) in self.entries.items():
+				for (num, size) in v[1].items():
+					lst.append('p %s %s %d %d\n' % (key, num, size, v[0]))
+			data = ''.join(lst).encode()
+			tmp = os.path.join(CACHEDIR, INDEX + '.tmp')
+			g = open(tmp, 'wb')
+			try:
+				g.write(data)
+			finally:
+				g.close()
+			os.rename(tmp, os.path.join(CACHEDIR, INDEX))
+			self.pos = len(data)
+			self.lines = len(lst)
+		finally:
+			unlock_index(f)
+			index_lock.release()
+
+	def scan(self):
+		"""Create the index from the contents of the cache folder"""
+		for x in os.listdir(CACHEDIR):
+			if len(x) != 2:
+				continue
+			for y in os.listdir(os.path.join(CACHEDIR, x)):
+				path = os.path.join(CACHEDIR, x, y)
+				t = int(os.stat(path).st_mtime)
+				for z in os.listdir(path):
+					self.apply('p %s %s %d %d' % (y, z, os.stat(os.path.join(path, z)).st_size, t))
+		self.write()
+
+	def clean(self):
+		"""Remove the least recently used entries if the cache is too large"""
+		self.load()
+		total = self.total
+		if total >= MAX:
+			print("Trimming the cache since %r > %r" % (total, MAX))
+			lst = [(k, v[0]) for (k, v) in self.entries.items()]
+			lst.sort(key=lambda x: x[1]) # sort by timestamp
+			lst.reverse()
+
+			while self.total >= MAX * CLEANRATIO and lst:
+				(k, t) = lst.pop()
+				path = os.path.join(CACHEDIR, k[:2], k)
+				try:
+					os.rename(path, path + '_rm')
+				except OSError:
+					pass
+				else:
+					shutil.rmtree(path + '_rm', ignore_errors=True)
+				self.apply('d %s' % k)
+
+		# the removed entries are written by rewriting the index
+		if self.total != total or self.lines > COMPACT * (len(self.entries) + 100):
+			self.write()
+
+def init_index():
+	"""Read the index of the cache, or create it if it is missing"""
 	try:
 		os.makedirs(CACHEDIR)
-	except:
+	except OSError:
 		pass
-	flist = {}
-	for x in os.listdir(CACHEDIR):
-		if len(x) != 2:
-			continue
-		for y in os.listdir(os.path.join(CACHEDIR, x)):
-			path = os.path.join(CACHEDIR, x, y)
-			size = 0
-			for z in os.listdir(path):
-				size += os.stat(os.path.join(path, z)).st_size
-				flist[y] = [os.stat(path).st_mtime, size]
-
-lock = threading.Lock()
+	idx = cache_index()
+	if os.path.exists(os.path.join(CACHEDIR, INDEX)):
+		idx.load()
+	else:
+		idx.scan()
+	return idx
+
+clean_event = threading.Event()
 def make_clean():
-	global lock
-	# there is no need to spend a lot of time cleaning
-	# so one thread cleans and the others return immediately
-
-	if lock.acquire(0):
+	"""Ask the main process to trim the cache now"""
+	if server_pid != os.getpid():
 		try:
-			make_clean_unsafe()
-		finally:
-			lock.release()
-
-def make_clean_unsafe():
-	global MAX, flist
-	# and do some cleanup if necessary
-	total = sum([x[1] for x in flist.values()])
-
-	#print("and the total is %d" % total)
-	if total >= MAX:
-		print("Trimming the cache since %r > %r" % (total, MAX))
-		lst = [(p, v[0], v[1]) for (p, v) in flist.items()]
-		lst.sort(key=lambda x: x[1]) # sort by timestamp
-		lst.reverse()
-
-		while total >= MAX * CLEANRATIO:
-			(k, t, s) = lst.pop()
-			shutil.rmtree(os.path.join(CACHEDIR, k[:2], k))
-			total -= s
-			del flist[k]
+			os.kill(server_pid, signal.SIGUSR1)
+		except (OSError, AttributeError):
+			pass
+	else:
+		clean_event.set()
+
+def clean_loop(idx):
+	"""Trim the cache in the background, in the main process"""
+	while 1:
+		clean_event.wait(CLEAN_INTERVAL)
+		clean_event.clear()
+		try:
+			idx.clean()
+		except Exception as e:
+			print("Could not trim the cache %r" % e)
 
 def reset():
-	global MAX, flist
-	tmp = list(flist.keys())
-	lock.acquire()
-	try:
-		flist = {}
-	finally:
-		lock.release()
 	for x in CHARS:
 		for y in CHARS:
 			try:
 				os.rename(os.path.join(CACHEDIR, x+y), os.path.join(CACHEDIR, x+y+'_rm'))
 			except:
 				pass
+	append_index('r\n')
 	for x in CHARS:
 		for y in CHARS:
 			try:
@@ -118,25 +285,45 @@ def reset():
 			except:
 				pass
 
-
-def update(ssig):
-	"""update the cache folder and make some space if necessary"""
-	global flist
-	# D, T, S : directory, timestamp, size
-
-	# update the contents with the last folder created
+if hasattr(os, 'sendfile'):
+	def send_file(sock, f, size):
+		cnt = 0
+		while cnt < size:
+			k = os.sendfile(sock.fileno(), f.fileno(), cnt, size - cnt)
+			if not k:
+				raise ValueError('File truncated')
+			cnt += k
+else:
+	def send_file(sock, f, size):
+		cnt = 0
+		while cnt < size:
+			r = f.read(min(BUF, size - cnt))
+			if not r:
+				raise ValueError('File truncated')
+			sock.sendall(r)
+			cnt += len(r)
+
+def send_compressed(sock, f, size):
+	obj = zlib.decompressobj()
 	cnt = 0
-	d = os.path.join(CACHEDIR, ssig[:2], ssig)
-	for k in os.listdir(d):
-		cnt += os.stat(os.path.join(d, k)).st_size
-
-	# the same thread will usually push the next files
-	try:
-		flist[ssig][1] = cnt
-	except:
-		flist[ssig] = [os.stat(d).st_mtime, cnt]
+	while 1:
+		r = f.read(BUF)
+		if r:
+			r = obj.decompress(r)
+		else:
+			r = obj.flush()
+		sock.sendall(r)
+		cnt += len(r)
+		if not r:
+			break
+	if cnt != size:
+		raise ValueError('File truncated')
+
+class req(socketserver.StreamRequestHandler):
+	def setup(self):
+		self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		socketserver.StreamRequestHandler.setup(self)
 
-class req(SocketServer.StreamRequestHandler):
 	def handle(self):
 		while 1:
 			try:
@@ -145,8 +332,11 @@ class req(SocketServer.StreamRequestHandler):
 				print(e)
 				break
 
+	def send_response(self, params, data=''):
+		self.wfile.write((','.join(params).ljust(HEADER_SIZE) + data).encode())
+
 	def process_command(self):
-		query = self.rfile.read(HEADER_SIZE).strip()
+		query = self.rfile.read(HEADER_SIZE).decode().strip()
 		#print "%r" % query
 		if not re_valid_query.match(query):
 			raise ValueError('Invalid query %r' % query)
@@ -159,6 +349,8 @@ class req(SocketServer.StreamRequestHandler):
 			self.put_file(query[1:])
 		elif query[0] == LST:
 			self.lst_file(query[1:])
+		elif query[0] == BAT:
+			self.bat_file(query[1:])
 		elif query[0] == CLEAN:
 			make_clean()
 		elif query[0] == RESET:
@@ -169,38 +361,59 @@ class req(SocketServer.StreamRequestHandler):
 			raise ValueError('Invalid query %r' % query)
 
 	def lst_file(self, query):
-		response = '\n'.join(flist.keys())
-		params = [str(len(response)),'']
-		self.wfile.write(','.join(params).ljust(HEADER_SIZE))
-		self.wfile.write(response)
+		lst = []
+		for x in CHARS:
+			for y in CHARS:
+				try:
+					lst.extend(os.listdir(os.path.join(CACHEDIR, x+y)))
+				except OSError:
+					pass
+		response = '\n'.join(lst)
+		self.send_response([str(len(response)), ''], response)
+
+	def bat_file(self, query):
+		# return the amount of files for each cache entry requested
+		size = int(query[0])
+		keys = self.rfile.read(size).decode().split('\n')
+		lst = []
+		for x in keys:
+			if not re_valid_query.match(x):
+				raise ValueError('Invalid query %r' % x)
+			try:
+				lst.append(str(len(os.listdir(os.path.join(CACHEDIR, x[:2], x)))))
+			except OSError:
+				lst.append('0')
+		response = '\n'.join(lst)
+		self.send_response([str(len(response)), ''], response)
 
 	def get_file(self, query):
 		# get a file from the cache if it exists, else return 0
 		tmp = os.path.join(CACHEDIR, query[0][:2], query[0], query[1])
-		fsize = -1
+		compressed = False
 		try:
-			fsize = os.stat(tmp).st_size
-		except Exception:
-			#print(e)
-			pass
-		else:
-			# cache was useful, update the last access for LRU
-			d = os.path.join(CACHEDIR, query[0][:2], query[0])
-			os.utime(d, None)
-			flist[query[0]][0] = os.stat(d).st_mtime
-		params = [str(fsize)]
-		self.wfile.write(','.join(params).ljust(HEADER_SIZE))
-
-		if fsize < 0:
-			#print("file not found in cache %s" % query[0])
-			return
-		f = open(tmp, 'rb')
+			f = open(tmp, 'rb')
+		except (OSError, IOError):
+			try:
+				f = open(tmp + '.z', 'rb')
+			except (OSError, IOError):
+				#print("file not found in cache %s" % query[0])
+				self.send_response(['-1'])
+				return
+			compressed = True
+
 		try:
-			cnt = 0
-			while cnt < fsize:
-				r = f.read(BUF)
-				self.wfile.write(r)
-				cnt += len(r)
+			if compressed:
+				fsize = struct.unpack('>Q', f.read(8))[0]
+			else:
+				fsize = os.fstat(f.fileno()).st_size
+			self.send_response([str(fsize)])
+			if query[1] == '0':
+				# cache was useful, update the last access for LRU
+				append_index('h %s %d\n' % (query[0], int(time.time())))
+			if compressed:
+				send_compressed(self.request, f, fsize)
+			else:
+				send_file(self.request, f, fsize)
 		finally:
 			f.close()
 
@@ -209,16 +422,29 @@ class req(SocketServer.StreamRequestHandler):
 		(fd, filename) = tempfile.mkstemp(dir=CACHEDIR)
 		try:
 			size = int(query[2])
+			if COMPRESS:
+				obj = zlib.compressobj(COMPRESS)
+				os.write(fd, struct.pack('>Q', size))
 			cnt = 0
 			while cnt < size:
 				r = self.rfile.read(min(BUF, size-cnt))
 				if not r:
 					raise ValueError('Connection closed')
-				os.write(fd, r)
 				cnt += len(r)
+				if COMPRESS:
+					r = obj.compress(r)
+				os.write(fd, r)
+			if COMPRESS:
+				os.write(fd, obj.flush())
 		finally:
 			os.close(fd)
 
+		# the files are stored either compressed or not
+		name = query[1]
+		other = name + '.z'
+		if COMPRESS:
+			(name, other) = (other, name)
+		size = os.stat(filename).st_size
 
 		d = os.path.join(CACHEDIR, query[0][:2], query[0])
 		try:
@@ -230,33 +456,82 @@ class req(SocketServer.StreamRequestHandler):
 			except OSError:
 				pass
 		try:
-			os.rename(filename, os.path.join(d, query[1]))
+			os.rename(filename, os.path.join(d, name))
 		except OSError:
-			pass # folder removed by the user, or another thread is pushing the same file
-		try:
-			update(query[0])
-		except OSError:
-			pass
-		make_clean()
+			# folder removed by the user, or another thread is pushing the same file
+			try:
+				os.unlink(filename)
+			except OSError:
+				pass
+		else:
+			append_index('p %s %s %d %d\n' % (query[0], name, size, int(time.time())))
+			try:
+				os.unlink(os.path.join(d, other))
+			except OSError:
+				pass
+			else:
+				append_index('p %s %s 0 %d\n' % (query[0], other, int(time.time())))
 
 class req_only_get(req):
 	def put_file(self, query):
-		self.wfile.write('ERROR,'.ljust(HEADER_SIZE))
+		self.send_response(['ERROR'])
 		raise ValueError('Put is forbidden')
 
 class req_only_put(req):
 	def get_file(self, query):
-		self.wfile.write('ERROR,'.ljust(HEADER_SIZE))
+		self.send_response(['ERROR'])
 		raise ValueError('Get is forbidden')
 
+class server_cls(socketserver.ThreadingTCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+	request_queue_size = 64
+
+server_pid = os.getpid()
+
 def create_server(conn, cls):
-	SocketServer.ThreadingTCPServer.allow_reuse_address = True
-	server = SocketServer.ThreadingTCPServer(CONN, req)
+	global server_pid
+	server_pid = os.getpid()
+	idx = init_index()
+	print("ready (%r entries)" % len(idx.entries))
+
+	server = server_cls(conn, cls)
 	server.timeout = 60 # seconds
-	server.serve_forever()
+
+	if PROCESSES < 2 or not hasattr(os, 'fork'):
+		t = threading.Thread(target=clean_loop, args=(idx,))
+		t.setDaemon(True)
+		t.start()
+		server.serve_forever()
+		return
+
+	pids = []
+	for x in range(PROCESSES):
+		pid = os.fork()
+		if not pid:
+			signal.signal(signal.SIGINT, signal.SIG_DFL)
+			try:
+				server.serve_forever()
+			finally:
+				os._exit(0)
+		pids.append(pid)
+
+	signal.signal(signal.SIGUSR1, lambda *k: clean_event.set())
+	def stop(*k):
+		raise KeyboardInterrupt
+	signal.signal(signal.SIGTERM, stop)
+	try:
+		try:
+			clean_loop(idx)
+		except KeyboardInterrupt:
+			pass
+	finally:
+		for pid in pids:
+			try:
+				os.kill(pid, signal.SIGTERM)
+			except OSError:
+				pass
 
 if __name__ == '__main__':
-	init_flist()
-	print("ready (%r dirs)" % len(flist.keys()))
 	create_server(CONN, req)
 
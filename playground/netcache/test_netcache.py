@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Check the network cache end-to-end:
+
+	$ python playground/netcache/test_netcache.py
+
+The server (netcache_server.py) is started on a temporary CACHEDIR and on a free port,
+a small c project is built with the client (waflib/extras/netcache_client.py) to push
+the files, then the outputs are removed with "waf clean", and the project is built
+again: all the files must be pulled from the cache, and no compiler must be executed.
+
+A c compiler is required, and the server uses os.fork (posix systems).
+"""
+
+import os, sys, time, shutil, socket, tempfile, subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WAF = os.path.join(HERE, '..', '..', 'waf-light')
+
+WSCRIPT = '''
+top = '.'
+out = 'build'
+def options(opt):
+	opt.load('compiler_c')
+	opt.load('netcache_client')
+def configure(conf):
+	conf.load('compiler_c')
+def build(bld):
+	bld.stlib(source='a.c', target='a')
+	bld.program(source='main.c', target='app', use='a')
+'''
+
+SOURCES = {
+	'wscript': WSCRIPT,
+	'a.c': 'int a(void) { return 0; }\n',
+	'main.c': 'int a(void);\nint main(void) { return a(); }\n',
+}
+
+SERVER = '''
+import sys
+sys.path.insert(0, %r)
+import netcache_server as s
+s.CACHEDIR = %r
+s.PROCESSES = 2
+s.create_server(('127.0.0.1', %d), s.req)
+'''
+
+def free_port():
+	s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	try:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+	finally:
+		s.close()
+
+def wait_port(port, proc):
+	for x in range(100):
+		if proc.poll() is not None:
+			raise ValueError('the server exited with the status %r' % proc.returncode)
+		s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		try:
+			try:
+				s.connect(('127.0.0.1', port))
+				return
+			except socket.error:
+				time.sleep(0.1)
+		finally:
+			s.close()
+	raise ValueError('the server is not listening on %r' % port)
+
+def waf(folder, env, *k):
+	"""run waf in the project folder, return the compiler commands executed"""
+	cmd = [sys.executable, WAF] + list(k) + ['-v', '--zones=runner']
+	proc = subprocess.Popen(cmd, cwd=folder, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	out = proc.communicate()[0].decode('utf-8', 'replace')
+	if proc.returncode:
+		raise ValueError('%r failed:\n%s' % (cmd, out))
+	return [x for x in out.splitlines() if ' runner [' in x]
+
+def main():
+	tmp = tempfile.mkdtemp()
+	cachedir = os.path.join(tmp, 'cache')
+	folder = os.path.join(tmp, 'project')
+	os.makedirs(folder)
+	for (name, txt) in SOURCES.items():
+		f = open(os.path.join(folder, name), 'w')
+		try:
+			f.write(txt)
+		finally:
+			f.close()
+
+	port = free_port()
+	server = subprocess.Popen([sys.executable, '-c', SERVER % (HERE, cachedir, port)])
+	try:
+		wait_port(port, server)
+
+		env = dict(os.environ)
+		env['NETCACHE'] = '127.0.0.1:%d@PUSH_PULL' % port
+		waf(folder, env, 'configure')
+
+		pushed = waf(folder, env, 'build')
+		if not pushed:
+			raise ValueError('nothing was compiled by the first build')
+
+		waf(folder, env, 'clean')
+		pulled = waf(folder, env, 'build')
+		if pulled:
+			raise ValueError('the following commands were executed after the clean:\n%s' % '\n'.join(pulled))
+		if not os.path.exists(os.path.join(folder, 'build', 'app')):
+			raise ValueError('the program was not retrieved from the cache')
+	finally:
+		server.terminate()
+		server.wait()
+		shutil.rmtree(tmp)
+	print('ok: %d commands executed by the first build, none after the clean' % len(pushed))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Measure the startup time of waf files, for example to compare the packaging modes:
+
+	$ ./waf-light --make-waf && mv waf /tmp/waf-bz2
+	$ ./waf-light --make-waf --zip-type=zip && mv waf /tmp/waf-zip
+	$ python utils/coldstart.py /tmp/waf-bz2 /tmp/waf-zip
+
+Each waf file is copied into an empty temporary folder and "waf --version" is executed:
+the first run is the cold start (the waf library is unpacked in .waf-* for the tar modes),
+the next runs are the warm starts. The same python interpreter is used for all runs.
+"""
+
+import os, sys, time, shutil, tempfile, subprocess
+
+RUNS = 10
+
+def run(folder):
+	t0 = time.time()
+	null = open(os.devnull, 'w')
+	try:
+		ret = subprocess.call([sys.executable, 'waf', '--version'], cwd=folder, stdout=null, stderr=null)
+	finally:
+		null.close()
+	if ret:
+		raise ValueError('waf --version failed in %r' % folder)
+	return time.time() - t0
+
+def measure(path):
+	folder = tempfile.mkdtemp()
+	try:
+		shutil.copy(path, os.path.join(folder, 'waf'))
+		cold = run(folder)
+		warm = min([run(folder) for x in range(RUNS)])
+	finally:
+		shutil.rmtree(folder)
+	return (cold, warm)
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print(__doc__)
+		sys.exit(1)
+	print('%-40s %10s %10s' % ('waf file', 'cold', 'warm'))
+	for x in sys.argv[1:]:
+		(cold, warm) = measure(x)
+		print('%-40s %9.3fs %9.3fs' % (x, cold, warm))
@@ -27,8 +27,11 @@ INSTALL = 1337
 UNINSTALL = -1337
 """Negative value '<-' uninstall, see :py:attr:`waflib.Build.BuildContext.is_install`"""
 
-SAVED_ATTRS = 'root node_deps raw_deps task_sigs'.split()
-"""Build class members to save between the runs (root, node_deps, raw_deps, task_sigs)"""
+SAVED_ATTRS = 'root node_deps raw_deps task_sigs task_stats file_stats hash_name'.split()
+"""Build class members to save between the runs (root, node_deps, raw_deps, task_sigs, task_stats, file_stats, hash_name)"""
+
+STATS_WEIGHT = 0.3
+"""Weight of the last duration in the average duration of the tasks (:py:attr:`waflib.Build.BuildContext.task_stats`)"""
 
 CFG_FILES = 'cfg_files'
 """Files from the build directory to hash before starting the build (``config.h`` written during the configuration)"""
@@ -83,6 +86,16 @@ class BuildContext(Context.Context):
 		self.raw_deps = {}
 		"""Dict of custom data returned by :py:meth:`waflib.Task.Task.scan` (persists between build executions)"""
 
+		self.task_stats = {}
+		"""Dict mapping the task ids to the amount of executions, the average duration, the last duration and the previous duration
+		of the tasks, see :py:meth:`waflib.Build.BuildContext.add_duration` (persists between build executions)"""
+
+		self.file_stats = {}
+		"""Dict mapping the source nodes to (inode, size, modification time) and to their hash, the files are hashed again only when these values change (persists between build executions)"""
+
+		self.hash_name = Utils.HASH
+		"""Hash algorithm used for the signatures (:py:func:`waflib.Utils.set_hash`), the data from the previous builds is discarded when it changes"""
+
 		# list of folders that are already scanned
 		# so that we do not need to stat them one more time
 		self.cache_dir_contents = {}
@@ -97,6 +110,21 @@ class BuildContext(Context.Context):
 		self.cache_global = Options.cache_global
 		self.nocache = Options.options.nocache
 		self.progress_bar = Options.options.progress_bar
+		self.critical_path = Options.options.critical_path
+		self.track_deps = Options.options.track_deps
+		self.parallel_scan = Options.options.parallel_scan
+
+		self.resource_pools = {}
+		"""Resource pools limiting the tasks executed concurrently, mapped to their capacity (see :py:meth:`waflib.Runner.Parallel.acquire`)::
+
+			def build(bld):
+				bld.resource_pools = {'memory': 32, 'link': 2}
+				for x in ('cprogram', 'cxxprogram', 'cshlib', 'cxxshlib'):
+					Task.classes[x].resources = {'memory': 8, 'link': 1}
+		"""
+
+		self.trace = None
+		"""Task timings collected when the build is executed with ``waf --trace=file.json`` (see :py:class:`waflib.Runner.Trace`)"""
 
 		############ stuff below has not been reviewed
 
@@ -243,9 +271,14 @@ class BuildContext(Context.Context):
 
 		if self.progress_bar:
 			sys.stderr.write(Logs.colors.cursor_off)
+		if Options.options.trace:
+			self.trace = Runner.Trace()
 		try:
 			self.compile()
 		finally:
+			if self.trace:
+				self.trace.write(os.path.join(self.launch_dir, Options.options.trace))
+				self.trace = None
 			if self.progress_bar == 1:
 				c = len(self.returned_tasks) or 1
 				self.to_log(self.progress_line(c, c, Logs.colors.BLUE, Logs.colors.NORMAL))
@@ -268,6 +301,8 @@ class BuildContext(Context.Context):
 				raise Errors.WafError('Version mismatch! reconfigure the project')
 			for t in env['tools']:
 				self.setup(**t)
+			Utils.set_hash(env['hash'] or 'md5')
+		self.hash_name = Utils.HASH
 
 		f = None
 		try:
@@ -286,8 +321,13 @@ class BuildContext(Context.Context):
 					except Exception as e:
 						Logs.debug('build: could not pickle the build cache %s: %r' % (dbfn, e))
 					else:
-						for x in SAVED_ATTRS:
-							setattr(self, x, data[x])
+						if data['hash_name'] != Utils.HASH:
+							# the signatures must be computed again
+							Logs.debug('build: the hash algorithm changed, ignoring the build cache %s' % dbfn)
+						else:
+							for x in SAVED_ATTRS:
+								if x in data:
+									setattr(self, x, data[x])
 				finally:
 					waflib.Node.pickle_lock.release()
 		finally:
@@ -482,9 +522,28 @@ class BuildContext(Context.Context):
 		except KeyError:
 			raise Errors.WafError('Could not find a task generator for the name %r' % name)
 
+	def add_duration(self, uid, duration):
+		"""
+		Record the duration of a task executed, called by :py:meth:`waflib.Task.Task.post_run`.
+		The statistics in :py:attr:`waflib.Build.BuildContext.task_stats` are used for the estimate of the remaining
+		time in the progress bar, and by the scheduler (:py:meth:`waflib.Runner.Parallel.get_cost`)
+
+		:param uid: task id (:py:meth:`waflib.Task.Task.uid`)
+		:type uid: hash value
+		:param duration: duration in seconds
+		:type duration: float
+		"""
+		try:
+			(cnt, avg, last, prev) = self.task_stats[uid]
+		except (KeyError, ValueError, TypeError):
+			self.task_stats[uid] = (1, duration, duration, duration)
+		else:
+			self.task_stats[uid] = (cnt + 1, avg + STATS_WEIGHT * (duration - avg), duration, last)
+
 	def progress_line(self, state, total, col1, col2):
 		"""
-		Compute the progress bar used by ``waf -p``
+		Compute the progress bar used by ``waf -p``, the remaining time is estimated from the
+		durations of the tasks in the previous builds (:py:meth:`waflib.Runner.Parallel.remaining_time`)
 		"""
 		n = len(str(total))
 
@@ -493,6 +552,12 @@ class BuildContext(Context.Context):
 
 		pc = (100.*state)/total
 		eta = str(self.timer)
+		try:
+			left = self.producer.remaining_time()
+		except AttributeError:
+			left = None
+		if left is not None:
+			eta = '%s<%s' % (eta, Utils.fmt_duration(left))
 		fs = "[%%%dd/%%%dd][%%s%%2d%%%%%%s][%s][" % (n, n, ind)
 		left = fs % (state, total, col1, pc, col2)
 		right = '][%s%s%s]' % (col1, eta, col2)
@@ -1168,7 +1233,7 @@ class CleanContext(BuildContext):
 				n.delete()
 		self.root.children = {}
 
-		for v in 'node_deps task_sigs raw_deps'.split():
+		for v in 'node_deps task_sigs raw_deps file_stats'.split():
 			setattr(self, v, {})
 
 class ListContext(BuildContext):
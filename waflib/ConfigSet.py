@@ -9,7 +9,7 @@ ConfigSet: a special dict
 The values put in :py:class:`ConfigSet` must be lists
 """
 
-import copy, re
+import copy, re, weakref
 from waflib import Logs, Utils
 re_imp = re.compile('^(#)*?([^#=]*?)\ =\ (.*?)$', re.M)
 
@@ -25,10 +25,23 @@ class ConfigSet(object):
 		env = ConfigSet()
 		env.FOO = 'test'
 		env['FOO'] = 'test'
+
+	The values of the object and of its parents are merged in a flattened view, so that
+	the lookups do not have to walk the parent chain. The view is updated by the methods
+	modifying the values, and dropped for the objects deriving from the one modified.
+	An object having no value of its own shares the view of its parent. The values must
+	therefore be changed through the methods of this class and not by modifying the
+	attribute *table* directly.
+
+	The views cost memory: an object having a single value of its own still copies the whole
+	view of its parent, so a project deriving one object per task generator holds one full
+	copy of the configuration per task generator.
 	"""
-	__slots__ = ('table', 'parent')
+	__slots__ = ('table', 'parent', '_flat', '_children', '__weakref__')
 	def __init__(self, filename=None):
-		self.table = {}
+		object.__setattr__(self, '_flat', None)
+		object.__setattr__(self, '_children', None)
+		object.__setattr__(self, 'table', {})
 		"""
 		Internal dict holding the object values
 		"""
@@ -44,18 +57,11 @@ class ConfigSet(object):
 			if 'foo' in env:
 				print env['foo']
 		"""
-		if key in self.table: return True
-		try: return self.parent.__contains__(key)
-		except AttributeError: return False # parent may not exist
+		return key in (self._flat or self._get_flat_table())
 
 	def keys(self):
 		"""Dict interface (unknown purpose)"""
-		keys = set()
-		cur = self
-		while cur:
-			keys.update(cur.table.keys())
-			cur = getattr(cur, 'parent', None)
-		keys = list(keys)
+		keys = list((self._flat or self._get_flat_table()).keys())
 		keys.sort()
 		return keys
 
@@ -71,20 +77,16 @@ class ConfigSet(object):
 				conf.env['foo'] = {}
 				print(env['foo'])
 		"""
-		try:
-			while 1:
-				x = self.table.get(key, None)
-				if not x is None:
-					return x
-				self = self.parent
-		except AttributeError:
+		x = (self._flat or self._get_flat_table()).get(key, None)
+		if x is None:
 			return []
+		return x
 
 	def __setitem__(self, key, value):
 		"""
 		Dictionary interface: get value from key
 		"""
-		self.table[key] = value
+		self._set_table_value(key, value)
 
 	def __delitem__(self, key):
 		"""
@@ -115,6 +117,13 @@ class ConfigSet(object):
 		"""
 		if name in self.__slots__:
 			object.__setattr__(self, name, value)
+			if name == 'table':
+				self._drop_flat()
+			elif name == 'parent':
+				self._drop_flat()
+				if value._children is None:
+					object.__setattr__(value, '_children', weakref.WeakKeyDictionary())
+				value._children[self] = True
 		else:
 			self[name] = value
 
@@ -128,6 +137,8 @@ class ConfigSet(object):
 		"""
 		if name in self.__slots__:
 			object.__delattr__(self, name)
+			if name == 'parent':
+				self._drop_flat()
 		else:
 			del self[name]
 
@@ -168,6 +179,58 @@ class ConfigSet(object):
 				tbl[x] = copy.deepcopy(tbl[x])
 			self.table = tbl
 
+	def _get_flat_table(self):
+		"""
+		Return the dict merging the values of self and of its parents, the values set to None
+		do not hide the values of the parents. The dict must not be modified by the caller.
+
+		:rtype: dict
+		"""
+		try:
+			parent = self.parent
+		except AttributeError:
+			flat = self.table
+		else:
+			flat = parent._flat or parent._get_flat_table()
+			if self.table:
+				flat = flat.copy()
+				for (k, v) in self.table.items():
+					if v is not None:
+						flat[k] = v
+					elif not k in flat:
+						flat[k] = None
+		object.__setattr__(self, '_flat', flat)
+		return flat
+
+	def _set_table_value(self, key, value):
+		"""
+		Set a value in the table of self, update the flattened view and drop the views
+		of the objects deriving from self
+		"""
+		self.table[key] = value
+		flat = self._flat
+		if flat is None:
+			# the objects deriving from self have no view either
+			return
+		if not flat is self.table:
+			if value is None or flat is self.parent._flat:
+				# the view of the parent is shared, or the value of the parent must be looked up
+				object.__setattr__(self, '_flat', None)
+			else:
+				flat[key] = value
+		self._drop_children()
+
+	def _drop_flat(self):
+		"""Drop the flattened views of self and of the objects deriving from it"""
+		if self._flat is not None:
+			object.__setattr__(self, '_flat', None)
+			self._drop_children()
+
+	def _drop_children(self):
+		if self._children:
+			for x in list(self._children.keys()):
+				x._drop_flat()
+
 	def get_flat(self, key):
 		"""
 		Return a value as a string. If the input is a list, the value returned is space-separated.
@@ -197,9 +260,10 @@ class ConfigSet(object):
 			else:
 				value = [value]
 		else:
-			if not isinstance(value, list):
-				value = [value]
-		self.table[key] = value
+			if isinstance(value, list):
+				return value
+			value = [value]
+		self._set_table_value(key, value)
 		return value
 
 	def append_value(self, var, val):
@@ -227,7 +291,7 @@ class ConfigSet(object):
 		"""
 		if isinstance(val, str):
 			val = [val]
-		self.table[var] =  val + self._get_list_value_for_modification(var)
+		self._set_table_value(var, val + self._get_list_value_for_modification(var))
 
 	def append_unique(self, var, val):
 		"""
@@ -295,6 +359,7 @@ class ConfigSet(object):
 		for m in re_imp.finditer(code):
 			g = m.group
 			tbl[g(2)] = eval(g(3))
+		self._drop_flat()
 		Logs.debug('env: %s' % str(self.table))
 
 	def update(self, d):
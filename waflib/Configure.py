@@ -51,6 +51,8 @@ def download_tool(tool, force=False, ctx=None):
 
 		$ waf configure --download
 	"""
+	if Context.waf_files() is not None:
+		raise Errors.WafError('The tool %r cannot be downloaded into a waf file created with --zip-type=zip' % tool)
 	for x in Utils.to_list(Context.remote_repo):
 		for sub in Utils.to_list(Context.remote_locs):
 			url = '/'.join((x, sub, tool + '.py'))
@@ -183,6 +185,7 @@ class ConfigurationContext(Context.Context):
 		See :py:func:`waflib.Context.Context.execute`
 		"""
 		self.init_dirs()
+		Utils.set_hash(Options.options.hash)
 
 		self.cachedir = self.bldnode.make_node(Build.CACHE_DIR)
 		self.cachedir.mkdir()
@@ -261,7 +264,7 @@ class ConfigurationContext(Context.Context):
 	def store(self):
 		"""Save the config results into the cache file"""
 		n = self.cachedir.make_node('build.config.py')
-		n.write('version = 0x%x\ntools = %r\n' % (Context.HEXVERSION, self.tools))
+		n.write('version = 0x%x\ntools = %r\nhash = %r\n' % (Context.HEXVERSION, self.tools, Utils.HASH))
 
 		if not self.all_envs:
 			self.fatal('nothing to store in the configuration context!')
@@ -6,7 +6,7 @@
 Classes and functions required for waf commands
 """
 
-import os, imp, sys
+import os, imp, sys, time, marshal, fnmatch
 from waflib import Utils, Errors, Logs
 import waflib.Node
 
@@ -20,12 +20,15 @@ WAFVERSION="1.6.8"
 WAFREVISION="11517"
 """Constant updated on new releases"""
 
-ABI = 98
+ABI = 102
 """Version of the build data cache file format (used in :py:const:`waflib.Context.DBFILE`)"""
 
 DBFILE = '.wafpickle-%d' % ABI
 """Name of the pickle file for storing the build data"""
 
+CODEFILE = '.wafcode-%d' % ABI
+"""Name of the file storing the compiled wscript files in the build directory (see :py:func:`waflib.Context.compile_file`)"""
+
 APPNAME = 'APPNAME'
 """Default application name (used by ``waf dist``)"""
 
@@ -223,6 +226,8 @@ class Context(ctx):
 		:param node: script
 		:type node: :py:class:`waflib.Node.Node`
 		"""
+		if not self.stack_path:
+			self.recurse_start = time.time()
 		self.stack_path.append(self.cur_script)
 
 		self.cur_script = node
@@ -238,6 +243,8 @@ class Context(ctx):
 		self.cur_script = self.stack_path.pop()
 		if self.cur_script:
 			self.path = self.cur_script.parent
+		if not self.stack_path:
+			startup['recurse'] += time.time() - self.recurse_start
 
 	def recurse(self, dirs, name=None, mandatory=True, once=True):
 		"""
@@ -274,8 +281,7 @@ class Context(ctx):
 				cache[node] = True
 				self.pre_recurse(node)
 				try:
-					function_code = node.read('rU')
-					exec(compile(function_code, node.abspath(), 'exec'), self.exec_dict)
+					exec(compile_file(node.abspath()), self.exec_dict)
 				finally:
 					self.post_recurse(node)
 			elif not node:
@@ -515,10 +521,15 @@ class Context(ctx):
 
 	def load_special_tools(self, var, ban=[]):
 		global waf_dir
-		lst = self.root.find_node(waf_dir).find_node('waflib/extras').ant_glob(var)
+		names = waf_files()
+		if names is None:
+			lst = [x.name for x in self.root.find_node(waf_dir).find_node('waflib/extras').ant_glob(var)]
+		else:
+			lst = [x[14:] for x in names if x.startswith('waflib/extras/') and fnmatch.fnmatchcase(x[14:], var)]
+			lst.sort()
 		for x in lst:
-			if not x.name in ban:
-				load_tool(x.name.replace('.py', ''))
+			if not x in ban:
+				load_tool(x.replace('.py', ''))
 
 cache_modules = {}
 """
@@ -526,6 +537,110 @@ Dictionary holding already loaded modules, keyed by their absolute path.
 The modules are added automatically by :py:func:`waflib.Context.load_module`
 """
 
+code_cache = None
+"""
+Compiled scripts keyed by their absolute path, with the size and the modification time of the files: path -> (size, mtime, code).
+Read from :py:const:`waflib.Context.CODEFILE` by :py:func:`waflib.Context.compile_file`
+"""
+
+code_cache_modified = False
+"""Set when :py:const:`waflib.Context.code_cache` must be written by :py:func:`waflib.Context.store_code_cache`"""
+
+startup = {'init': 0.0, 'scripts': 0, 'cached': 0, 'load': 0.0, 'tools': 0, 'tools_time': 0.0, 'recurse': 0.0}
+"""
+Counters displayed by ``waf --startup-report``: time spent before executing the commands, amount of scripts
+loaded (and read from the bytecode cache), time spent reading and compiling them, amount of tools imported and time spent importing them, time spent in
+:py:meth:`waflib.Context.Context.recurse` (user functions and scripts loading)
+"""
+
+def get_code_cache_path():
+	if out_dir and os.path.isdir(out_dir):
+		return os.path.join(out_dir, CODEFILE)
+	return None
+
+def compile_file(path):
+	"""
+	Compile a script file into a code object. The code objects are kept in the build directory
+	(:py:const:`waflib.Context.CODEFILE`) and reused when the size and the modification time of the file
+	have not changed. The files modified recently are compiled again in the next runs, since the timestamps
+	may not detect the changes made in the same tick.
+
+	:param path: file path
+	:type path: string
+	:return: code object
+	"""
+	global code_cache, code_cache_modified
+	t0 = time.time()
+	if code_cache is None:
+		code_cache = read_code_cache()
+
+	try:
+		st = os.stat(path)
+	except OSError:
+		raise Errors.WafError('Could not read the file %r' % path)
+
+	startup['scripts'] += 1
+	try:
+		(size, mtime, code) = code_cache[path]
+	except KeyError:
+		pass
+	else:
+		if size == st.st_size and mtime == st.st_mtime:
+			startup['cached'] += 1
+			startup['load'] += time.time() - t0
+			return code
+
+	try:
+		txt = Utils.readf(path, m='rU')
+	except (IOError, OSError):
+		raise Errors.WafError('Could not read the file %r' % path)
+	code = compile(txt, path, 'exec')
+
+	if t0 - st.st_mtime > 2:
+		code_cache[path] = (st.st_size, st.st_mtime, code)
+		code_cache_modified = True
+	elif code_cache.pop(path, None):
+		code_cache_modified = True
+	startup['load'] += time.time() - t0
+	return code
+
+def read_code_cache():
+	"""Read the compiled scripts from :py:const:`waflib.Context.CODEFILE`, return an empty dict if the file is invalid"""
+	path = get_code_cache_path()
+	if path:
+		try:
+			f = open(path, 'rb')
+			try:
+				(magic, dct) = marshal.load(f)
+			finally:
+				f.close()
+			if magic == imp.get_magic():
+				return dct
+		except Exception:
+			Logs.debug('ctx: could not read the compiled scripts from %r' % path)
+	return {}
+
+def store_code_cache():
+	"""Write :py:const:`waflib.Context.code_cache` if scripts were compiled (called when waf terminates)"""
+	global code_cache_modified
+	path = get_code_cache_path()
+	if not code_cache_modified or not path:
+		return
+	f = None
+	try:
+		try:
+			f = open(path + '.tmp', 'wb')
+			marshal.dump((imp.get_magic(), code_cache), f)
+		finally:
+			if f:
+				f.close()
+		if Utils.is_win32 and os.path.exists(path):
+			os.unlink(path)
+		os.rename(path + '.tmp', path)
+	except (IOError, OSError):
+		Logs.debug('ctx: could not write the compiled scripts to %r' % path)
+	code_cache_modified = False
+
 def load_module(path):
 	"""
 	Load a source file as a python module.
@@ -541,15 +656,12 @@ def load_module(path):
 		pass
 
 	module = imp.new_module(WSCRIPT_FILE)
-	try:
-		code = Utils.readf(path, m='rU')
-	except (IOError, OSError):
-		raise Errors.WafError('Could not read the file %r' % path)
+	code = compile_file(path)
 
 	module_dir = os.path.dirname(path)
 	sys.path.insert(0, module_dir)
 
-	exec(compile(code, path, 'exec'), module.__dict__)
+	exec(code, module.__dict__)
 	sys.path.remove(module_dir)
 
 	cache_modules[path] = module
@@ -573,7 +685,7 @@ def load_tool(tool, tooldir=None):
 		assert isinstance(tooldir, list)
 		sys.path = tooldir + sys.path
 		try:
-			__import__(tool)
+			import_tool(tool)
 			ret = sys.modules[tool]
 			Context.tools[tool] = ret
 			return ret
@@ -581,19 +693,59 @@ def load_tool(tool, tooldir=None):
 			for d in tooldir:
 				sys.path.remove(d)
 	else:
-		global waf_dir
-		try:
-			os.stat(os.path.join(waf_dir, 'waflib', 'extras', tool + '.py'))
+		if in_waflib('extras', tool + '.py'):
 			d = 'waflib.extras.%s' % tool
-		except:
-			try:
-				os.stat(os.path.join(waf_dir, 'waflib', 'Tools', tool + '.py'))
-				d = 'waflib.Tools.%s' % tool
-			except:
-				d = tool # user has messed with sys.path
+		elif in_waflib('Tools', tool + '.py'):
+			d = 'waflib.Tools.%s' % tool
+		else:
+			d = tool # user has messed with sys.path
 
-		__import__(d)
+		import_tool(d)
 		ret = sys.modules[d]
 		Context.tools[tool] = ret
 		return ret
 
+zip_names = None
+"""Names of the files in the waf file, see :py:func:`waflib.Context.waf_files`"""
+
+def waf_files():
+	"""
+	Return the names of the files contained in the waf file when the waf library is imported from it directly
+	(waf file created by ``./waf-light --make-waf --zip-type=zip``), or None when the waf library is a folder
+
+	:rtype: set of strings or None
+	"""
+	global zip_names
+	if zip_names is None:
+		if not os.path.isfile(waf_dir):
+			return None
+		import zipfile
+		z = zipfile.ZipFile(waf_dir)
+		try:
+			zip_names = set(z.namelist())
+		finally:
+			z.close()
+	return zip_names
+
+def in_waflib(*k):
+	"""
+	Return True if the file given by its path components relative to the folder *waflib* is part of the waf library::
+
+		from waflib import Context
+		Context.in_waflib('Tools', 'gcc.py')
+	"""
+	names = waf_files()
+	if names is None:
+		return os.path.isfile(os.path.join(waf_dir, 'waflib', *k))
+	return '/'.join(('waflib',) + k) in names
+
+def import_tool(name):
+	"""Import a module, count the time spent in :py:const:`waflib.Context.startup` if it was not imported yet"""
+	if name in sys.modules:
+		__import__(name)
+		return
+	t0 = time.time()
+	__import__(name)
+	startup['tools'] += 1
+	startup['tools_time'] += time.time() - t0
+
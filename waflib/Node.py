@@ -20,7 +20,7 @@ Node: filesystem structure, contains lists of nodes
    (:py:class:`waflib.Node.Nod3`, see the :py:class:`waflib.Context.Context` initializer). A reference to the context owning a node is held as self.ctx
 """
 
-import os, re, sys, shutil
+import os, re, sys, shutil, time
 from waflib import Utils, Errors
 
 exclude_regs = '''
@@ -822,10 +822,48 @@ class Node(object):
 			return ret
 
 		if not self.is_bld() or self.ctx.bldnode is self.ctx.srcnode:
-			self.sig = Utils.h_file(self.abspath())
+			self.sig = self.h_file()
 		self.ctx.hash_cache[id(self)] = ret = self.sig
 		return ret
 
+	def h_file(self):
+		"""
+		Hash the file contents by calling :py:func:`waflib.Utils.h_file`, unless the inode, the size and the modification
+		time are the same as in the previous builds (:py:attr:`waflib.Build.BuildContext.file_stats`). The files modified
+		recently are hashed again in the next build, since the timestamps may not detect the changes made in the same tick.
+
+		:return: hash of the file contents
+		"""
+		filename = self.abspath()
+		stats = getattr(self.ctx, 'file_stats', None)
+		if stats is None:
+			return Utils.h_file(filename)
+
+		try:
+			st = os.stat(filename)
+		except OSError:
+			stats.pop(self, None)
+			raise IOError('could not stat %r' % filename)
+		try:
+			key = (st.st_ino, st.st_size, st.st_mtime_ns)
+		except AttributeError:
+			key = (st.st_ino, st.st_size, st.st_mtime)
+
+		try:
+			(prev, sig) = stats[self]
+		except KeyError:
+			pass
+		else:
+			if prev == key:
+				return sig
+
+		sig = Utils.h_file(filename)
+		if time.time() - st.st_mtime > 2:
+			stats[self] = (key, sig)
+		else:
+			stats.pop(self, None)
+		return sig
+
 pickle_lock = Utils.threading.Lock()
 """Lock mandatory for thread-safe node serialization"""
 
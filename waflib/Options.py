@@ -58,12 +58,14 @@ class opt_parser(optparse.OptionParser):
 		p('-v', '--verbose',  dest='verbose', default=0,     action='count', help='verbosity level -v -vv or -vvv [default: 0]')
 		p('--nocache',        dest='nocache', default=False, action='store_true', help='ignore the WAFCACHE (if set)')
 		p('--zones',          dest='zones',   default='',    action='store', help='debugging zones (task_gen, deps, tasks, etc)')
+		p('--startup-report', dest='startup_report', default=False, action='store_true', help='display the time spent loading the scripts and the tools')
 
 		gr = optparse.OptionGroup(self, 'configure options')
 		self.add_option_group(gr)
 
 		gr.add_option('-o', '--out', action='store', default='', help='build dir for the project', dest='out')
 		gr.add_option('-t', '--top', action='store', default='', help='src dir for the project', dest='top')
+		gr.add_option('--hash', action='store', default='md5', help='hash algorithm for the signatures (%s) [default: md5]' % ', '.join(sorted(Utils.hash_algorithms.keys())), dest='hash')
 
 		default_prefix = os.environ.get('PREFIX')
 		if not default_prefix:
@@ -82,6 +84,10 @@ class opt_parser(optparse.OptionParser):
 
 		gr.add_option('-p', '--progress', dest='progress_bar', default=0, action='count', help= '-p: progress bar; -pp: ide output')
 		gr.add_option('--targets',        dest='targets', default='', action='store', help='task generators, e.g. "target1,target2"')
+		gr.add_option('--critical-path',  dest='critical_path', default=False, action='store_true', help='execute the tasks on the longest dependency chains first')
+		gr.add_option('--track-deps',     dest='track_deps', default=False, action='store_true', help='release the tasks when their predecessors are complete instead of polling them')
+		gr.add_option('--parallel-scan',  dest='parallel_scan', default=False, action='store_true', help='run the dependency scanners in parallel before executing the tasks')
+		gr.add_option('--trace',          dest='trace', default='', action='store', help='write the task timings to a file in the chrome trace-event format, e.g. "--trace=trace.json"')
 
 		gr = optparse.OptionGroup(self, 'step options')
 		self.add_option_group(gr)
@@ -7,18 +7,200 @@ Runner.py: Task scheduling and execution
 
 """
 
-import random, atexit
+import random, atexit, heapq, time, sys
 try:
 	from queue import Queue
 except:
 	from Queue import Queue
-from waflib import Utils, Task, Errors
+try:
+	import json
+except ImportError:
+	json = None
+from waflib import Utils, Task, Errors, Logs
 
 GAP = 10
 """
 Wait for free tasks if there are at least ``GAP * njobs`` in queue
 """
 
+class PriorityTasks(object):
+	"""
+	Replacement for the list :py:attr:`waflib.Runner.Parallel.outstanding` used when the tasks
+	on the longest dependency chains must be executed first (``waf --critical-path``). The tasks
+	are kept in a heap sorted by the attribute ``tree_weight`` computed in
+	:py:meth:`waflib.Runner.Parallel.compute_weights`.
+
+	The list methods used by the tools (``insert(0, tsk)``, ``append``, ``extend``, ``remove``)
+	are provided, tasks inserted in front obtain the highest priority.
+	"""
+	def __init__(self):
+		self.lst = []
+		self.seq = 0
+
+	def __len__(self):
+		return len(self.lst)
+
+	def __nonzero__(self):
+		return len(self.lst) > 0
+	__bool__ = __nonzero__
+
+	def __iter__(self):
+		return iter([x[2] for x in self.lst])
+
+	def __contains__(self, tsk):
+		for x in self.lst:
+			if x[2] is tsk:
+				return True
+		return False
+
+	def __iadd__(self, lst):
+		self.extend(lst)
+		return self
+
+	def push(self, tsk, weight):
+		"""
+		Add a task with the given priority
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		:param weight: priority, the highest values are returned first
+		:type weight: float
+		"""
+		self.seq += 1
+		heapq.heappush(self.lst, (-weight, self.seq, tsk))
+
+	def append(self, tsk):
+		self.push(tsk, getattr(tsk, 'tree_weight', 0))
+
+	def extend(self, lst):
+		for tsk in lst:
+			self.append(tsk)
+
+	def insert(self, idx, tsk):
+		if idx == 0:
+			self.push(tsk, float('inf'))
+		else:
+			self.append(tsk)
+
+	def remove(self, tsk):
+		for x in self.lst:
+			if x[2] is tsk:
+				self.lst.remove(x)
+				heapq.heapify(self.lst)
+				return
+		raise ValueError('task not found %r' % tsk)
+
+	def pop(self, idx=0):
+		"""
+		Return the task having the highest priority (the index is ignored)
+
+		:rtype: :py:class:`waflib.Task.TaskBase`
+		"""
+		return heapq.heappop(self.lst)[2]
+
+class Trace(object):
+	"""
+	Timings collected during a build (``waf --trace=trace.json``) and written in the Chrome
+	trace-event format, to be opened in chrome://tracing or in another trace viewer:
+
+	* the execution of the tasks in the task consumers, with the time spent waiting in the queue
+	* the calls to ``runnable_status`` in the main thread
+	* the computation of the task signatures, and the calls to the scanners
+
+	The instance is set on the build context as ``bld.trace``, and nothing is collected
+	if it is None.
+	"""
+	def __init__(self):
+		self.events = []
+		"""Trace events (complete events)"""
+
+		self.threads = {}
+		"""Thread identifiers mapped to small integers"""
+
+		self.lock = Utils.threading.Lock()
+		self.t0 = time.time()
+		self.tid() # the main thread is the first one
+
+	def tid(self):
+		"""Return a small integer representing the current thread"""
+		try:
+			cur = Utils.threading.current_thread()
+		except AttributeError:
+			cur = Utils.threading.currentThread()
+		try:
+			return self.threads[cur]
+		except KeyError:
+			self.lock.acquire()
+			try:
+				ret = self.threads[cur] = len(self.threads)
+			finally:
+				self.lock.release()
+			return ret
+
+	def task_name(self, tsk):
+		"""Return a short description of a task"""
+		lst = getattr(tsk, 'outputs', None) or getattr(tsk, 'inputs', None)
+		if lst:
+			return '%s %s' % (tsk.__class__.__name__, ' '.join([x.name for x in lst]))
+		return tsk.__class__.__name__
+
+	def add(self, name, cat, start, end, tsk=None, **args):
+		"""
+		Add an event to the trace
+
+		:param name: event name
+		:type name: string
+		:param cat: event category
+		:type cat: string
+		:param start: start time (time.time())
+		:type start: float
+		:param end: end time (time.time())
+		:type end: float
+		:param tsk: task the event relates to
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		"""
+		if tsk is not None:
+			args['task'] = self.task_name(tsk)
+		ev = {'name': name, 'cat': cat, 'ph': 'X', 'pid': 1, 'tid': self.tid(),
+			'ts': int((start - self.t0) * 1000000), 'dur': int((end - start) * 1000000)}
+		if args:
+			ev['args'] = args
+		self.events.append(ev)
+
+	def call(self, name, fun, tsk, cat='sched'):
+		"""Call a function and add an event for the time spent in it"""
+		t0 = time.time()
+		try:
+			return fun()
+		finally:
+			self.add(name, cat, t0, time.time(), tsk)
+
+	def process(self, tsk):
+		"""Execute a task by calling :py:meth:`waflib.Task.TaskBase.process` and add an event for it"""
+		t0 = time.time()
+		try:
+			tsk.process()
+		finally:
+			args = {'status': tsk.hasrun}
+			queued = getattr(tsk, 'trace_queued', None)
+			if queued is not None:
+				args['queue_wait_ms'] = (t0 - queued) * 1000
+			self.add(self.task_name(tsk), 'task', t0, time.time(), None, **args)
+
+	def write(self, path):
+		"""Write the trace file"""
+		if not json:
+			Logs.warn('The json module is required for writing the trace %r' % path)
+			return
+		lst = []
+		for (cur, num) in self.threads.items():
+			lst.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': num, 'args': {'name': cur.getName()}})
+		f = open(path, 'w')
+		try:
+			json.dump({'traceEvents': lst + self.events, 'displayTimeUnit': 'ms'}, f)
+		finally:
+			f.close()
+
 class TaskConsumer(Utils.threading.Thread):
 	"""
 	Task consumers belong to a pool of workers
@@ -52,6 +234,8 @@ class TaskConsumer(Utils.threading.Thread):
 			tsk = self.ready.get()
 			if not isinstance(tsk, Task.TaskBase):
 				tsk(self)
+			elif tsk.master.trace:
+				tsk.master.trace.process(tsk)
 			else:
 				tsk.process()
 
@@ -114,12 +298,61 @@ class Parallel(object):
 		Instance of :py:class:`waflib.Build.BuildContext`
 		"""
 
+		self.critical_path = getattr(bld, 'critical_path', False)
+		"""Execute the tasks on the longest dependency chains first (see :py:class:`waflib.Runner.PriorityTasks`)"""
+
+		self.track_deps = getattr(bld, 'track_deps', False)
+		"""Release the tasks when their last predecessor is returned instead of polling them (see :py:meth:`waflib.Runner.Parallel.filter_ready`)"""
+
+		self.parallel_scan = getattr(bld, 'parallel_scan', False)
+		"""Run the scanner methods in the task consumers before the tasks are scheduled (see :py:meth:`waflib.Runner.Parallel.scan_tasks`)"""
+
+		self.trace = getattr(bld, 'trace', None)
+		"""Collect the task timings (:py:class:`waflib.Runner.Trace`) if set"""
+
+		self.estimate = getattr(bld, 'progress_bar', 0) == 1
+		"""Estimate the remaining build time for the progress bar (see :py:meth:`waflib.Runner.Parallel.remaining_time`)"""
+
+		self.costs = {}
+		"""Expected durations of the tasks not processed yet, used by :py:meth:`waflib.Runner.Parallel.remaining_time`"""
+
+		self.cost_left = 0.0
+		"""Sum of the expected durations of the tasks not processed yet"""
+
+		self.cost_done = 0.0
+		"""Sum of the expected durations of the tasks executed"""
+
+		self.start_time = time.time()
+
+		self.pools = dict(getattr(bld, 'resource_pools', None) or {})
+		"""Capacities of the resource pools (:py:attr:`waflib.Build.BuildContext.resource_pools`)"""
+
+		self.tokens = dict(self.pools)
+		"""Tokens available in the resource pools"""
+
+		self.held = {}
+		"""Tasks mapped to the tokens they hold"""
+
+		self.waiting = []
+		"""Tasks ready to be executed, waiting for tokens (see :py:meth:`waflib.Runner.Parallel.acquire`)"""
+
+		self.granted = set()
+		"""Tasks from :py:attr:`waflib.Runner.Parallel.waiting` that obtained their tokens"""
+
 		self.outstanding = []
 		"""List of :py:class:`waflib.Task.TaskBase` that may be ready to be executed"""
+		if self.critical_path:
+			self.outstanding = PriorityTasks()
 
 		self.frozen = []
 		"""List of :py:class:`waflib.Task.TaskBase` that cannot be executed immediately"""
 
+		self.blocked = {}
+		"""Tasks waiting for their predecessors to complete, mapped to the amount of unfinished predecessors"""
+
+		self.revdeps = Utils.defaultdict(set)
+		"""Tasks mapped to the set of blocked tasks waiting for them (reverse edges of :py:attr:`waflib.Task.Task.run_after`)"""
+
 		self.out = Queue(0)
 		"""List of :py:class:`waflib.Task.TaskBase` returned by the task consumers"""
 
@@ -194,10 +427,235 @@ class Parallel(object):
 			if self.frozen:
 				self.outstanding += self.frozen
 				self.frozen = []
-			elif not self.count:
-				self.outstanding.extend(next(self.biter))
+			elif not self.count and not self.outstanding:
+				if self.blocked:
+					lst = []
+					for tsk in self.blocked:
+						lst.append('%s\t-> %r' % (repr(tsk), [id(x) for x in tsk.run_after if not x.hasrun]))
+					raise Errors.WafError('Deadlock detected: check the build order for the tasks%s' % ''.join(lst))
+				tasks = next(self.biter)
+				if self.parallel_scan:
+					self.scan_tasks(tasks)
+				if self.critical_path:
+					self.compute_weights(tasks)
+				if self.estimate:
+					self.add_costs(tasks)
+				if self.track_deps:
+					tasks = self.filter_ready(tasks)
+				self.outstanding.extend(tasks)
 				self.total = self.bld.total()
-				break
+				if not self.blocked:
+					break
+
+	def filter_ready(self, tasks):
+		"""
+		Return the tasks from the list given which have no unfinished predecessor in
+		:py:attr:`waflib.Task.Task.run_after`. The other tasks are kept in :py:attr:`waflib.Runner.Parallel.blocked`
+		until their last predecessor is returned (see :py:meth:`waflib.Runner.Parallel.release`), so that
+		they are not polled by calling ``runnable_status`` over and over again.
+
+		:param tasks: tasks
+		:type tasks: list of :py:class:`waflib.Task.TaskBase`
+		:rtype: list of :py:class:`waflib.Task.TaskBase`
+		"""
+		ready = []
+		for tsk in tasks:
+			cnt = 0
+			for x in getattr(tsk, 'run_after', []):
+				if not x.hasrun:
+					self.revdeps[x].add(tsk)
+					cnt += 1
+			if cnt:
+				self.blocked[tsk] = cnt
+			else:
+				ready.append(tsk)
+		return ready
+
+	def release(self, tsk):
+		"""
+		Called when a task is complete, move the blocked tasks for which it was the last unfinished
+		predecessor to :py:attr:`waflib.Runner.Parallel.outstanding`
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		"""
+		if self.estimate:
+			self.remove_cost(tsk)
+		for x in self.revdeps.pop(tsk, ()):
+			self.blocked[x] -= 1
+			if not self.blocked[x]:
+				del self.blocked[x]
+				self.outstanding.append(x)
+
+	def scan_tasks(self, tasks):
+		"""
+		Compute the signatures of the tasks having a thread-safe scanner method (:py:meth:`waflib.Task.Task.scan`
+		and :py:attr:`waflib.Task.Task.scan_threadsafe`) in the task consumers, and wait until they are all processed.
+		The dependencies are then stored in :py:attr:`waflib.Build.BuildContext.node_deps`
+		and :py:attr:`waflib.Build.BuildContext.raw_deps` before the tasks are scheduled, instead of being
+		obtained one task at a time from :py:meth:`waflib.Task.Task.runnable_status`.
+
+		Only the tasks for which the predecessors are complete are considered, so the signatures computed
+		are kept. The errors are logged (debug zone *runner*) and raised again when the tasks are scheduled.
+
+		:param tasks: tasks
+		:type tasks: list of :py:class:`waflib.Task.TaskBase`
+		"""
+		lst = []
+		for tsk in tasks:
+			if getattr(tsk, 'scan_threadsafe', False) and getattr(tsk, 'scan', None) and not tsk.hasrun:
+				for x in tsk.run_after:
+					if not x.hasrun:
+						break
+				else:
+					lst.append(tsk)
+		if self.numjobs < 2 or len(lst) < 2:
+			return
+
+		try:
+			self.pool
+		except AttributeError:
+			self.init_task_pool()
+
+		done = Queue(0)
+		def make_job(tsk):
+			def job(consumer):
+				try:
+					try:
+						tsk.signature()
+					except Exception:
+						e = sys.exc_info()[1]
+						Logs.debug('runner: could not scan %r: %r' % (tsk, e))
+				finally:
+					done.put(tsk)
+			return job
+		for tsk in lst:
+			self.ready.put(make_job(tsk))
+		for tsk in lst:
+			done.get()
+
+	def get_cost(self, tsk):
+		"""
+		Return the expected duration of a task: the average duration from :py:attr:`waflib.Build.BuildContext.task_stats`
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		:return: duration in seconds, or None if the task was never executed
+		:rtype: float
+		"""
+		cached = hasattr(tsk, 'uid_')
+		try:
+			uid = tsk.uid()
+		except AttributeError:
+			return None
+		if not cached:
+			# the inputs may be set later (javac), so the uid must be computed again
+			try:
+				del tsk.uid_
+			except AttributeError:
+				pass
+		try:
+			return getattr(self.bld, 'task_stats', {})[uid][1]
+		except (KeyError, IndexError, TypeError):
+			return None
+
+	def add_costs(self, tasks):
+		"""
+		Add the expected durations of the tasks given to :py:attr:`waflib.Runner.Parallel.costs`,
+		the tasks that were never executed have the average cost
+
+		:param tasks: tasks
+		:type tasks: list of :py:class:`waflib.Task.TaskBase`
+		"""
+		unknown = []
+		for tsk in tasks:
+			c = self.get_cost(tsk)
+			if c is None:
+				unknown.append(tsk)
+			else:
+				self.costs[tsk] = c
+				self.cost_left += c
+		if unknown and self.costs:
+			default = sum(self.costs.values()) / len(self.costs)
+			for tsk in unknown:
+				self.costs[tsk] = default
+				self.cost_left += default
+
+	def remove_cost(self, tsk):
+		"""
+		Called when a task is processed, update the sums of the expected durations
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		"""
+		c = self.costs.pop(tsk, None)
+		if c is not None:
+			self.cost_left -= c
+			if tsk.hasrun == Task.SUCCESS and not getattr(tsk, 'cached', None):
+				self.cost_done += c
+
+	def remaining_time(self):
+		"""
+		Estimate the remaining build time from the expected durations of the tasks not processed yet,
+		and from the rate at which the tasks are executed in this build (the amount of jobs before the
+		first task completes). The tasks from the groups that are not posted yet are not counted.
+
+		:return: duration in seconds, or None if the tasks were never executed
+		:rtype: float
+		"""
+		if not self.estimate or self.cost_left <= 0:
+			return None
+		rate = self.numjobs
+		elapsed = time.time() - self.start_time
+		if self.cost_done and elapsed > 0:
+			rate = self.cost_done / elapsed
+		return self.cost_left / rate
+
+	def compute_weights(self, tasks):
+		"""
+		Set the attribute ``tree_weight`` on the tasks given, it represents the length of the
+		longest chain of tasks depending on it (:py:attr:`waflib.Task.Task.run_after`). The duration of the
+		tasks from the previous builds (:py:meth:`waflib.Runner.Parallel.get_cost`) is used
+		as a cost, and the tasks that were never executed have the average cost.
+
+		:param tasks: tasks
+		:type tasks: list of :py:class:`waflib.Task.TaskBase`
+		"""
+		cost = {}
+		for tsk in tasks:
+			c = self.get_cost(tsk)
+			if c is not None:
+				cost[tsk] = c
+		if cost:
+			default = sum(cost.values()) / len(cost)
+		else:
+			default = 1.0
+
+		# reverse the edges, only the tasks in the list are considered
+		succ = Utils.defaultdict(list)
+		for tsk in tasks:
+			cost.setdefault(tsk, default)
+		for tsk in tasks:
+			for x in getattr(tsk, 'run_after', []):
+				if x in cost:
+					succ[x].append(tsk)
+
+		# process the tasks from the end of the chains (no recursion, the chains may be long)
+		left = dict([(tsk, len(succ[tsk])) for tsk in tasks])
+		ready = [tsk for tsk in tasks if not left[tsk]]
+		while ready:
+			tsk = ready.pop()
+			tsk.tree_weight = cost[tsk] + max([0] + [x.tree_weight for x in succ[tsk]])
+			for x in getattr(tsk, 'run_after', []):
+				if x in left:
+					left[x] -= 1
+					if not left[x]:
+						ready.append(x)
+
+		# cycles are reported by the deadlock detection
+		for tsk in tasks:
+			if left[tsk]:
+				tsk.tree_weight = cost[tsk]
 
 	def add_more_tasks(self, tsk):
 		"""
@@ -207,7 +665,14 @@ class Parallel(object):
 		:type tsk: :py:attr:`waflib.Task.TaskBase`
 		"""
 		if getattr(tsk, 'more_tasks', None):
-			self.outstanding += tsk.more_tasks
+			if self.critical_path:
+				self.compute_weights(tsk.more_tasks)
+			if self.estimate:
+				self.add_costs(tsk.more_tasks)
+			if self.track_deps:
+				self.outstanding += self.filter_ready(tsk.more_tasks)
+			else:
+				self.outstanding += tsk.more_tasks
 			self.total += len(tsk.more_tasks)
 
 	def get_out(self):
@@ -218,11 +683,62 @@ class Parallel(object):
 		:rtype: :py:attr:`waflib.Task.TaskBase`
 		"""
 		tsk = self.out.get()
+		if self.pools:
+			self.release_tokens(tsk)
 		if not self.stop:
 			self.add_more_tasks(tsk)
+		self.release(tsk)
 		self.count -= 1
 		self.dirty = True
 
+	def acquire(self, tsk):
+		"""
+		Take the tokens required by a task (:py:attr:`waflib.Task.TaskBase.resources`) from the resource pools.
+		The tasks requiring more tokens than the capacity of a pool take the whole pool, and the pools
+		that are not declared in :py:attr:`waflib.Build.BuildContext.resource_pools` are not limited.
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		:return: True if the task may be executed
+		:rtype: bool
+		"""
+		res = getattr(tsk, 'resources', None)
+		if not res:
+			return True
+		need = {}
+		for (k, v) in res.items():
+			try:
+				v = min(v, self.pools[k])
+			except KeyError:
+				continue
+			if self.tokens[k] < v:
+				return False
+			need[k] = v
+		for (k, v) in need.items():
+			self.tokens[k] -= v
+		self.held[tsk] = need
+		return True
+
+	def release_tokens(self, tsk):
+		"""
+		Return the tokens held by a task to the resource pools, and give them to the tasks in
+		:py:attr:`waflib.Runner.Parallel.waiting`: all the waiting tasks that fit in the tokens available are
+		put in front of :py:attr:`waflib.Runner.Parallel.outstanding`, not only the first one.
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		"""
+		for (k, v) in self.held.pop(tsk, {}).items():
+			self.tokens[k] += v
+		lst = []
+		for x in self.waiting:
+			if self.acquire(x):
+				self.granted.add(x)
+				self.outstanding.insert(0, x)
+			else:
+				lst.append(x)
+		self.waiting = lst
+
 	def error_handler(self, tsk):
 		"""
 		Called when a task cannot be executed. The flag :py:attr:`waflib.Runner.Parallel.stop` is set, unless
@@ -248,6 +764,8 @@ class Parallel(object):
 			self.pool
 		except AttributeError:
 			self.init_task_pool()
+		if self.trace:
+			tsk.trace_queued = time.time()
 		self.ready.put(tsk)
 
 	def init_task_pool(self):
@@ -278,6 +796,26 @@ class Parallel(object):
 				put_pool(x)
 			self.pool = []
 
+	def run_task(self, tsk):
+		"""
+		Execute a task, or put it in the ready queue for the task consumers
+
+		:param tsk: task
+		:type tsk: :py:class:`waflib.Task.TaskBase`
+		"""
+		tsk.position = (self.processed, self.total)
+		self.count += 1
+		tsk.master = self
+		self.processed += 1
+
+		if self.numjobs == 1:
+			if self.trace:
+				self.trace.process(tsk)
+			else:
+				tsk.process()
+		else:
+			self.add_task(tsk)
+
 	def start(self):
 		"""
 		Give tasks to :py:class:`waflib.Runner.TaskConsumer` instances until the build finishes or the ``stop`` flag is set.
@@ -303,17 +841,28 @@ class Parallel(object):
 			if tsk.hasrun:
 				# if the task is marked as "run", just skip it
 				self.processed += 1
+				self.release(tsk)
 				continue
 
 			if self.stop: # stop immediately after a failure was detected
 				break
 
+			if self.granted and tsk in self.granted:
+				# runnable_status was called already
+				self.granted.remove(tsk)
+				self.run_task(tsk)
+				continue
+
 			try:
-				st = tsk.runnable_status()
+				if self.trace:
+					st = self.trace.call('runnable_status', tsk.runnable_status, tsk)
+				else:
+					st = tsk.runnable_status()
 			except Exception:
 				self.processed += 1
 				if not self.stop and self.bld.keep:
 					tsk.hasrun = Task.SKIPPED
+					self.release(tsk)
 					if self.bld.keep == 1:
 						# if -k stop at the first exception, if -kk try to go as far as possible
 						self.stop = True
@@ -321,31 +870,29 @@ class Parallel(object):
 				tsk.err_msg = Utils.ex_stack()
 				tsk.hasrun = Task.EXCEPTION
 				self.error_handler(tsk)
+				self.release(tsk)
 				continue
 
 			if st == Task.ASK_LATER:
-				self.postpone(tsk)
-				# TODO optimize this
-				if self.outstanding:
-					for x in tsk.run_after:
-						if x in self.outstanding:
-							self.outstanding.remove(x)
-							self.outstanding.insert(0, x)
+				# with track_deps, the tasks waiting for other tasks are released by Parallel.release
+				if not self.track_deps or self.filter_ready([tsk]):
+					self.postpone(tsk)
+					# TODO optimize this
+					if self.outstanding and not self.critical_path:
+						for x in tsk.run_after:
+							if x in self.outstanding:
+								self.outstanding.remove(x)
+								self.outstanding.insert(0, x)
 			elif st == Task.SKIP_ME:
 				self.processed += 1
 				tsk.hasrun = Task.SKIPPED
 				self.add_more_tasks(tsk)
+				self.release(tsk)
+			elif self.pools and not self.acquire(tsk):
+				# the task is executed when enough tokens are returned (Parallel.release_tokens)
+				self.waiting.append(tsk)
 			else:
-				# run me: put the task in ready queue
-				tsk.position = (self.processed, self.total)
-				self.count += 1
-				tsk.master = self
-				self.processed += 1
-
-				if self.numjobs == 1:
-					tsk.process()
-				else:
-					self.add_task(tsk)
+				self.run_task(tsk)
 
 		# self.count represents the tasks that have been made available to the consumer threads
 		# collect all the tasks after an error else the message may be incomplete
@@ -4,7 +4,7 @@
 
 "Module called for configuring, compiling and installing targets"
 
-import os, shutil, traceback, errno, sys, stat
+import os, shutil, traceback, errno, sys, stat, time
 from waflib import Utils, Configure, Logs, Options, ConfigSet, Context, Errors, Build, Node
 
 build_dir_override = None
@@ -26,6 +26,7 @@ def waf_entry_point(current_directory, version, wafdir):
 	"""
 
 	Logs.init_log()
+	t0 = time.time()
 
 	if Context.WAFVERSION != version:
 		Logs.error('Waf script %r and library %r do not match (directory %r)' % (version, Context.WAFVERSION, wafdir))
@@ -127,6 +128,7 @@ def waf_entry_point(current_directory, version, wafdir):
 		sys.exit(2)
 
 	parse_options()
+	Context.startup['init'] = time.time() - t0
 
 	"""
 	import cProfile, pstats
@@ -147,8 +149,30 @@ def waf_entry_point(current_directory, version, wafdir):
 	except KeyboardInterrupt:
 		Logs.pprint('RED', 'Interrupted')
 		sys.exit(68)
+	finally:
+		Context.store_code_cache()
 	#"""
 
+	if Options.options.startup_report:
+		startup_report(t0)
+
+def startup_report(t0):
+	"""
+	Display the time spent loading waf, the scripts and the tools (``waf --startup-report``),
+	see :py:const:`waflib.Context.startup`
+	"""
+	st = Context.startup
+	lst = [
+		('initialization and options', st['init']),
+		('%d scripts loaded, %d compiled' % (st['scripts'], st['scripts'] - st['cached']), st['load']),
+		('%d tools imported' % st['tools'], st['tools_time']),
+		('scripts executed (recurse)', st['recurse']),
+		('total', time.time() - t0),
+	]
+	Logs.pprint('NORMAL', 'Startup report:')
+	for (k, v) in lst:
+		Logs.pprint('NORMAL', '  %-34s: %s' % (k, Utils.fmt_duration(v)))
+
 def set_main_module(file_path):
 	"""
 	Read the main wscript file into :py:const:`waflib.Context.Context.g_module` and
@@ -259,7 +283,7 @@ def distclean_dir(dirname):
 				except:
 					Logs.warn('could not remove %r' % fname)
 
-	for x in [Context.DBFILE, 'config.log']:
+	for x in [Context.DBFILE, Context.CODEFILE, 'config.log']:
 		try:
 			os.unlink(x)
 		except:
@@ -516,6 +540,8 @@ def distcheck(ctx):
 
 def update(ctx):
 	'''updates the plugins from the *waflib/extras* directory'''
+	if Context.waf_files() is not None:
+		ctx.fatal('The tools cannot be updated in a waf file created with --zip-type=zip')
 	lst = Options.options.files.split(',')
 	if not lst:
 		lst = [x for x in Utils.listdir(Context.waf_dir + '/waflib/extras') if x.endswith('.py')]
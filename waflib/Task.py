@@ -6,7 +6,7 @@
 Tasks represent atomic operations such as processes.
 """
 
-import os, shutil, re, tempfile
+import os, shutil, re, tempfile, time
 from waflib import Utils, Logs, Errors
 
 # task states
@@ -63,6 +63,23 @@ def f(tsk):
 	return tsk.exec_command(lst, cwd=wd, env=env.env or None)
 '''
 
+CACHE_INDEX = 'index'
+"""Name of the index file in the cache folders, see :py:meth:`waflib.Task.Task.can_retrieve_cache`"""
+
+CACHE_LINKS = os.environ.get('WAFCACHE_LINKS', '') == '1'
+"""
+Share the files with the cache through hard links when the reflinks are not supported (WAFCACHE_LINKS=1).
+False by default: the build outputs and the cache entries then have the same data, so a tool or a rule
+modifying an output in place (appending, signing) also modifies the cache entry for all the builds using the cache.
+The outputs are copied otherwise.
+"""
+
+CACHE_COMPRESSION = os.environ.get('WAFCACHE_COMPRESSION', '')
+"""Compress the files stored in the cache with a codec from :py:const:`waflib.Utils.codecs` (zlib, bz2, lzma)"""
+
+cache_errors = set()
+"""Errors reported by :py:meth:`waflib.Task.Task.put_files_cache`, to display the warnings once"""
+
 def cache_outputs(cls):
 	"""
 	Task class decorator applied to all task classes by default unless they define the attribute 'nocache'::
@@ -82,6 +99,8 @@ def cache_outputs(cls):
 		if bld.cache_global and not bld.nocache:
 			if self.can_retrieve_cache():
 				return 0
+			if CACHE_LINKS:
+				self.unlink_outputs()
 		return m1(self)
 	cls.run = run
 
@@ -168,6 +187,12 @@ class TaskBase(evil):
 	hcode = ''
 	"""String representing an additional hash for the class representation"""
 
+	process_pool = False
+	"""Execute the functions given to :py:meth:`waflib.Task.TaskBase.exec_function` in a pool of processes if available (see :py:mod:`waflib.extras.process_pool`)"""
+
+	resources = {}
+	"""Amount of tokens to take from the resource pools while the task is executed, for example {'memory': 8, 'link': 1} (see :py:attr:`waflib.Build.BuildContext.resource_pools`)"""
+
 	def __init__(self, *k, **kw):
 		"""
 		The base task class requires a task generator, which will be itself if missing
@@ -207,6 +232,25 @@ class TaskBase(evil):
 			bld.cwd = kw['cwd'] = bld.variant_dir
 		return bld.exec_command(cmd, **kw)
 
+	def exec_function(self, fun, *k):
+		"""
+		Execute a python function for the task and return its result. The function and its arguments
+		must be picklable (module-level function, strings, lists, dicts) so that the execution can take place in
+		another process when the class attribute :py:attr:`waflib.Task.TaskBase.process_pool` is set::
+
+			def process_file(src, tgt):
+				...
+			class foo(Task.Task):
+				process_pool = True
+				def run(self):
+					return self.exec_function(process_file, self.inputs[0].abspath(), self.outputs[0].abspath())
+
+		:param fun: function to execute
+		:type fun: function
+		:return: the value returned by the function
+		"""
+		return fun(*k)
+
 	def runnable_status(self):
 		"""
 		State of the task
@@ -236,7 +280,9 @@ class TaskBase(evil):
 		try:
 			self.generator.bld.returned_tasks.append(self)
 			self.log_display(self.generator.bld)
+			t0 = time.time()
 			ret = self.run()
+			self.duration = time.time() - t0
 		except Exception:
 			self.err_msg = Utils.ex_stack()
 			self.hasrun = EXCEPTION
@@ -404,6 +450,12 @@ class Task(TaskBase):
 	shell = False
 	"""Execute the command with the shell (class attribute)"""
 
+	scan_threadsafe = False
+	"""
+	The scanner method may be executed in the task consumers (class attribute, see :py:meth:`waflib.Runner.Parallel.scan_tasks`).
+	The scanner must then create the nodes under a lock, and the inputs must not change in :py:meth:`waflib.Task.Task.runnable_status`
+	"""
+
 	def __init__(self, *k, **kw):
 		TaskBase.__init__(self, *k, **kw)
 
@@ -519,6 +571,10 @@ class Task(TaskBase):
 		try: return self.cache_sig
 		except AttributeError: pass
 
+		trace = getattr(self.generator.bld, 'trace', None)
+		if trace:
+			t0 = time.time()
+
 		self.m = Utils.md5()
 		self.m.update(self.hcode.encode())
 
@@ -536,6 +592,8 @@ class Task(TaskBase):
 				return self.signature()
 
 		ret = self.cache_sig = self.m.digest()
+		if trace:
+			trace.add('signature', 'sig', t0, time.time(), self)
 		return ret
 
 	def runnable_status(self):
@@ -603,6 +661,13 @@ class Task(TaskBase):
 
 		bld.task_sigs[self.uid()] = self.cache_sig
 
+		# the durations are used for scheduling the next builds (waf --critical-path) and for the progress bar
+		if not getattr(self, 'cached', None):
+			try:
+				bld.add_duration(self.uid(), self.duration)
+			except AttributeError:
+				pass
+
 	def sig_explicit_deps(self):
 		"""
 		Used by :py:meth:`waflib.Task.Task.signature`, hash :py:attr:`waflib.Task.Task.inputs`
@@ -720,7 +785,10 @@ class Task(TaskBase):
 			raise Errors.TaskRescan('rescan')
 
 		# no previous run or the signature of the dependencies has changed, rescan the dependencies
-		(nodes, names) = self.scan()
+		if getattr(bld, 'trace', None):
+			(nodes, names) = bld.trace.call('scan', self.scan, self, 'scan')
+		else:
+			(nodes, names) = self.scan()
 		if Logs.verbose:
 			Logs.debug('deps: scanner for %s returned %s %s' % (str(self), str(nodes), str(names)))
 
@@ -799,18 +867,37 @@ class Task(TaskBase):
 					#print "task is not ready..."
 					raise Errors.TaskNotReady('not ready')
 
+	def cache_path(self):
+		"""
+		Used by :py:meth:`waflib.Task.Task.can_retrieve_cache` and :py:meth:`waflib.Task.Task.put_files_cache`
+
+		The cache folders are spread in sub-folders named after the first two characters of the keys,
+		so that the folders do not become too large::
+
+			$WAFCACHE/3f/0c12...e4/index
+			$WAFCACHE/3f/0c12...e4/0
+			$WAFCACHE/3f/0c12...e4/1
+
+		:return: path to the cache folder for the task
+		:rtype: string
+		"""
+		ssig = Utils.to_hex(self.uid()) + Utils.to_hex(self.signature())
+		return os.path.join(self.generator.bld.cache_global, ssig[:2], ssig[2:])
+
 	def can_retrieve_cache(self):
 		"""
 		Used by :py:meth:`waflib.Task.cache_outputs`
 
 		Retrieve build nodes from the cache
-		update the file timestamps to help cleaning the least used entries from the cache
+		update the timestamp of the index file to help cleaning the least used entries from the cache
 		additionally, set an attribute 'cached' to avoid re-creating the same cache files
 
-		Suppose there are files in `cache/dir1/file1` and `cache/dir2/file2`:
+		The cache folder contains the files in the order of the outputs (0, 1, ..) and an index file
+		written last, listing the sizes and the names of the files. The files may be compressed,
+		in which case the codec follows the size (see :py:const:`waflib.Task.CACHE_COMPRESSION`):
 
-		#. read the timestamp of dir1
-		#. try to copy the files
+		#. read the timestamp of the index file (a single stat for the cache misses)
+		#. read the index and install the files (see :py:func:`waflib.Utils.copy_file`)
 		#. look at the timestamp again, if it has changed, the data may have been corrupt (cache update by another process)
 		#. should an exception occur, ignore the data
 		"""
@@ -818,35 +905,44 @@ class Task(TaskBase):
 		if not getattr(self, 'outputs', None):
 			return None
 
-		sig = self.signature()
-		ssig = Utils.to_hex(self.uid()) + Utils.to_hex(sig)
-
-		# first try to access the cache folder for the task
-		dname = os.path.join(self.generator.bld.cache_global, ssig)
+		dname = self.cache_path()
+		index = os.path.join(dname, CACHE_INDEX)
 		try:
-			t1 = os.stat(dname).st_mtime
-		except OSError:
+			st1 = os.stat(index)
+			lines = Utils.readf(index).splitlines()
+		except (OSError, IOError):
 			return None
 
-		for node in self.outputs:
-			orig = os.path.join(dname, node.name)
+		if len(lines) != len(self.outputs):
+			return None
+
+		for (i, node) in enumerate(self.outputs):
 			try:
-				shutil.copy2(orig, node.abspath())
-				# mark the cache file as used recently (modified)
-				os.utime(orig, None)
+				codec = lines[i].split(' ', 1)[0].partition(':')[2]
+				if codec:
+					Utils.decompress_file(os.path.join(dname, str(i)), node.abspath(), codec)
+				else:
+					Utils.copy_file(os.path.join(dname, str(i)), node.abspath(), CACHE_LINKS)
 			except (OSError, IOError):
 				Logs.debug('task: failed retrieving file')
 				return None
 
 		# is it the same folder?
 		try:
-			t2 = os.stat(dname).st_mtime
+			st2 = os.stat(index)
 		except OSError:
 			return None
 
-		if t1 != t2:
+		if st1.st_mtime != st2.st_mtime or st1.st_ino != st2.st_ino:
 			return None
 
+		try:
+			# mark the cache entry as used recently (modified)
+			os.utime(index, None)
+		except OSError:
+			pass
+
+		sig = self.signature()
 		for node in self.outputs:
 			node.sig = sig
 			if self.generator.bld.progress_bar < 1:
@@ -867,9 +963,7 @@ class Task(TaskBase):
 		if not getattr(self, 'outputs', None):
 			return None
 
-		sig = self.signature()
-		ssig = Utils.to_hex(self.uid()) + Utils.to_hex(sig)
-		dname = os.path.join(self.generator.bld.cache_global, ssig)
+		dname = self.cache_path()
 		tmpdir = tempfile.mkdtemp(prefix=self.generator.bld.cache_global + os.sep + 'waf')
 
 		try:
@@ -878,10 +972,27 @@ class Task(TaskBase):
 			pass
 
 		try:
-			for node in self.outputs:
-				dest = os.path.join(tmpdir, node.name)
-				shutil.copy2(node.abspath(), dest)
-		except (OSError, IOError):
+			lst = []
+			for (i, node) in enumerate(self.outputs):
+				dest = os.path.join(tmpdir, str(i))
+				if CACHE_COMPRESSION:
+					Utils.compress_file(node.abspath(), dest, CACHE_COMPRESSION)
+					lst.append('%d:%s %s\n' % (os.stat(dest).st_size, CACHE_COMPRESSION, node.name))
+				else:
+					Utils.copy_file(node.abspath(), dest, CACHE_LINKS)
+					lst.append('%d %s\n' % (os.stat(dest).st_size, node.name))
+			# the index is written last
+			f = open(os.path.join(tmpdir, CACHE_INDEX), 'w')
+			try:
+				f.write(''.join(lst))
+			finally:
+				f.close()
+			Utils.check_dir(os.path.dirname(dname))
+		except (OSError, IOError, Errors.WafError) as e:
+			if isinstance(e, Errors.WafError) and not e.msg in cache_errors:
+				# an invalid WAFCACHE_COMPRESSION disables the cache, report it once
+				cache_errors.add(e.msg)
+				Logs.warn('The files are not stored in the cache: %s' % e.msg)
 			try:
 				shutil.rmtree(tmpdir)
 			except:
@@ -900,6 +1011,20 @@ class Task(TaskBase):
 				except:
 					pass
 
+	def unlink_outputs(self):
+		"""
+		Used by :py:func:`waflib.Task.cache_outputs` before executing a task.
+		The outputs hard linked to files from the cache are removed, so that the
+		cache files are not modified by the commands updating their outputs in place.
+		"""
+		for node in self.outputs:
+			path = node.abspath()
+			try:
+				if os.stat(path).st_nlink > 1:
+					os.unlink(path)
+			except OSError:
+				pass
+
 def is_before(t1, t2):
 	"""
 	Return a non-zero value if task t1 is to be executed before task t2::
@@ -621,39 +621,62 @@ def sequence_order(self):
 
 re_m4 = re.compile('@(\w+)@', re.M)
 
+def subst_file(src, tgt, dct):
+	"""
+	Substitute the variables of the form *@VAR@* from the file *src* and write the result to *tgt*.
+	This function may be executed in another process (see :py:meth:`waflib.Task.TaskBase.exec_function`).
+
+	:param src: input file path
+	:type src: string
+	:param tgt: output file path
+	:type tgt: string
+	:param dct: values of the variables
+	:type dct: dict
+	:return: the names of the variables found
+	:rtype: list of string
+	"""
+	code = Utils.readf(src)
+
+	# replace all % by %% to prevent errors by % signs
+	code = code.replace('%', '%%')
+
+	# extract the vars foo into lst and replace @foo@ by %(foo)s
+	lst = []
+	def repl(match):
+		g = match.group
+		if g(1):
+			lst.append(g(1))
+			return "%%(%s)s" % g(1)
+		return ''
+	code = re_m4.sub(repl, code)
+
+	f = open(tgt, 'w')
+	try:
+		f.write(code % dct)
+	finally:
+		f.close()
+	return lst
+
 class subst_pc(Task.Task):
 	"""
 	Create *.pc* files from *.pc.in*. The task is executed whenever an input variable used
 	in the substitution changes.
 	"""
 
+	process_pool = True
+
 	def run(self):
 		"Substitutes variables in a .in file"
-
-		code = self.inputs[0].read()
-
-		# replace all % by %% to prevent errors by % signs
-		code = code.replace('%', '%%')
-
-		# extract the vars foo into lst and replace @foo@ by %(foo)s
-		lst = []
-		def repl(match):
-			g = match.group
-			if g(1):
-				lst.append(g(1))
-				return "%%(%s)s" % g(1)
-			return ''
-		code = re_m4.sub(repl, code)
-
 		try:
 			d = self.generator.dct
 		except AttributeError:
+			# resolve the variables used in the file here, only the strings are sent to subst_file
 			d = {}
-			for x in lst:
+			for x in re_m4.findall(self.inputs[0].read()):
 				tmp = getattr(self.generator, x, '') or self.env.get_flat(x) or self.env.get_flat(x.upper())
 				d[x] = str(tmp)
 
-		self.outputs[0].write(code % d)
+		lst = self.exec_function(subst_file, self.inputs[0].abspath(), self.outputs[0].abspath(), d)
 		self.generator.bld.raw_deps[self.uid()] = self.dep_vars = lst
 
 		# make sure the signature is updated
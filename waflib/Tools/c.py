@@ -19,6 +19,7 @@ class c(Task.Task):
 	vars    = ['CCDEPS'] # unused variable to depend on, just in case
 	ext_in  = ['.h'] # set the build order easily by using ext_out=['.h']
 	scan    = c_preproc.scan
+	scan_threadsafe = True
 
 Task.classes['cc'] = cc = c # compat, remove in waf 1.7
 
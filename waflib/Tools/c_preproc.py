@@ -26,8 +26,12 @@ A dumb preprocessor is also available in the tool *c_dumbpreproc*
 """
 # TODO: more varargs, pragma once
 
-import re, sys, os, string, traceback
-from waflib import Logs, Build, Utils, Errors
+import re, sys, os, string, time, traceback
+try:
+	import cPickle
+except:
+	import pickle as cPickle
+from waflib import Logs, Build, Utils, Errors, Context
 from waflib.Logs import debug, error
 
 class PreprocError(Errors.WafError):
@@ -52,6 +56,28 @@ use_trigraphs = 0
 strict_quotes = 0
 """Reserve the "#include <>" quotes for system includes (do not search for those includes). False by default."""
 
+lock = Utils.threading.Lock()
+"""Lock used when looking up the headers in the filesystem (:py:meth:`waflib.Tools.c_preproc.c_parser.cached_find_resource`)"""
+
+persistent_cache = True
+"""
+Keep the preprocessor lines of the files read in a file next to the build data (:py:const:`waflib.Context.DBFILE`),
+so that the unchanged files (same modification time and size) are not read and filtered again in the next builds.
+The files modified less than 2 seconds before they are read are not kept, as their timestamps may not change on the next edit.
+"""
+
+PERSISTENT_CACHE_FILE = Context.DBFILE + '_preproc'
+"""Name of the file containing the persistent parse cache, in the build directory"""
+
+memoize_includes = False
+"""
+Record the macros read and the includes found for each header, and reuse the results for the next source files
+when the macros have the same values (see :py:class:`waflib.Tools.c_preproc.header_record`). False by default.
+"""
+
+MAX_RECORDS = 8
+"""Amount of results kept for each header when :py:attr:`waflib.Tools.c_preproc.memoize_includes` is set"""
+
 g_optrans = {
 'not':'!',
 'and':'&&',
@@ -766,6 +792,87 @@ def define_name(line):
 	"""
 	return re_mac.match(line).group(0)
 
+MISSING = ()
+"Value representing an undefined macro in :py:class:`waflib.Tools.c_preproc.header_record`"
+
+class header_record(object):
+	"""
+	Result of the processing of a header, used when :py:attr:`waflib.Tools.c_preproc.memoize_includes` is set. The
+	result may be reused for another source file if the macros read (and the headers banned by #pragma once) have the same values.
+	"""
+	def __init__(self, node, level, depth):
+		self.node = node
+		"""Header"""
+
+		self.level = level
+		"""Value of :py:attr:`waflib.Tools.c_preproc.c_parser.count_files` when the header is read"""
+
+		self.depth = depth
+		"""Depth of the preprocessor state stack when the header is read"""
+
+		self.valid = True
+		"""Set to False if an error occurs while processing the header"""
+
+		self.reads = {}
+		"""Macros read before being redefined, mapped to their values or to :py:const:`waflib.Tools.c_preproc.MISSING`"""
+
+		self.writes = {}
+		"""Macros defined or undefined, mapped to their definitions or to :py:const:`waflib.Tools.c_preproc.MISSING`"""
+
+		self.bans = {}
+		"""Include names checked against :py:attr:`waflib.Tools.c_preproc.c_parser.ban_includes`, mapped to the result"""
+
+		self.new_bans = set([])
+		"""Include names added to :py:attr:`waflib.Tools.c_preproc.c_parser.ban_includes`"""
+
+		self.nodes = []
+		"""Headers found"""
+
+		self.names = []
+		"""Headers not found"""
+
+		self.curfile = ''
+		"""Last include name processed"""
+
+class tracked_defs(dict):
+	"""
+	Macro definitions notifying the parser of the macros read and written, used when
+	:py:attr:`waflib.Tools.c_preproc.memoize_includes` is set. The macros parsed by
+	:py:func:`waflib.Tools.c_preproc.reduce_tokens` are kept aside so that the definitions can be compared.
+	"""
+	def __init__(self, parser, defs):
+		dict.__init__(self, defs)
+		self.parser = parser
+		self.parsed = {}
+
+	def __contains__(self, k):
+		self.parser.note_read(k)
+		return dict.__contains__(self, k)
+
+	def __getitem__(self, k):
+		self.parser.note_read(k)
+		v = dict.__getitem__(self, k)
+		try:
+			(raw, parsed) = self.parsed[k]
+		except KeyError:
+			return v
+		if raw is v:
+			return parsed
+		return v
+
+	def __setitem__(self, k, v):
+		cur = dict.get(self, k)
+		if isinstance(cur, str) and not isinstance(v, str):
+			# macro definition parsed by reduce_tokens
+			self.parsed[k] = (cur, v)
+			return
+		self.parser.note_write(k, v)
+		dict.__setitem__(self, k, v)
+
+	def __delitem__(self, k):
+		self.parser.note_write(k, MISSING)
+		dict.__delitem__(self, k)
+
 class c_parser(object):
 	"""
 	Used by :py:func:`waflib.Tools.c_preproc.scan` to parse c/h files. Note that by default,
@@ -799,6 +906,15 @@ class c_parser(object):
 		self.ban_includes = set([])
 		"""Includes that must not be read (#pragma once)"""
 
+		self.records = []
+		"""Stack of :py:class:`waflib.Tools.c_preproc.header_record` for the headers being processed"""
+
+		self.memo = None
+		"""Header results shared by the parsers of the build (:py:attr:`waflib.Tools.c_preproc.memoize_includes`)"""
+
+		if memoize_includes:
+			self.defs = tracked_defs(self, self.defs)
+
 	def cached_find_resource(self, node, filename):
 		"""
 		Find a file from the input directory
@@ -819,6 +935,11 @@ class c_parser(object):
 		try:
 			return nd[tup]
 		except KeyError:
+			pass
+
+		# the scanners may run in several threads (waf --parallel-scan), do not create the same nodes twice
+		lock.acquire()
+		try:
 			ret = node.find_resource(filename)
 			if ret:
 				if getattr(ret, 'children', None):
@@ -828,7 +949,9 @@ class c_parser(object):
 					if tmp and getattr(tmp, 'children', None):
 						ret = None
 			nd[tup] = ret
-			return ret
+		finally:
+			lock.release()
+		return ret
 
 	def tryfind(self, filename):
 		"""
@@ -854,14 +977,115 @@ class c_parser(object):
 
 		if found:
 			# TODO the duplicates do not increase the no-op build times too much, but they may be worth removing
-			self.nodes.append(found)
+			self.add_node(found)
 			if filename[-4:] != '.moc':
-				self.addlines(found)
+				if self.memo is None:
+					self.addlines(found)
+				elif not self.replay(found):
+					count = len(self.lines)
+					self.addlines(found)
+					if len(self.lines) > count:
+						self.records.append(header_record(found, self.count_files, len(self.state)))
 		else:
-			if not filename in self.names:
-				self.names.append(filename)
+			self.add_name(filename)
 		return found
 
+	def add_node(self, node):
+		"""Add a header found to :py:attr:`waflib.Tools.c_preproc.c_parser.nodes`"""
+		self.nodes.append(node)
+		for r in self.records:
+			r.nodes.append(node)
+
+	def add_name(self, name):
+		"""Add a header name which could not be found to :py:attr:`waflib.Tools.c_preproc.c_parser.names`"""
+		if not name in self.names:
+			self.names.append(name)
+		for r in self.records:
+			if not name in r.names:
+				r.names.append(name)
+
+	def is_banned(self, name):
+		"""Return True if the include must not be read (#pragma once or #import)"""
+		ret = name in self.ban_includes
+		for r in self.records:
+			if not name in r.new_bans and not name in r.bans:
+				r.bans[name] = ret
+		return ret
+
+	def ban(self, name):
+		"""Prevent the include from being read again"""
+		self.ban_includes.add(name)
+		for r in self.records:
+			r.new_bans.add(name)
+
+	def note_read(self, name):
+		"""Called by :py:class:`waflib.Tools.c_preproc.tracked_defs` when a macro is read"""
+		for r in self.records:
+			if not name in r.writes and not name in r.reads:
+				r.reads[name] = dict.get(self.defs, name, MISSING)
+
+	def note_write(self, name, value):
+		"""Called by :py:class:`waflib.Tools.c_preproc.tracked_defs` when a macro is defined or undefined"""
+		for r in self.records:
+			r.writes[name] = value
+
+	def end_record(self):
+		"""
+		Called when the lines of a header are processed, store the :py:class:`waflib.Tools.c_preproc.header_record`
+		so that it may be reused
+		"""
+		r = self.records.pop()
+		if r.valid and r.depth == len(self.state):
+			r.curfile = self.curfile
+			key = (r.node, tuple(self.nodepaths))
+			lst = self.memo.setdefault(key, [])
+			if len(lst) < MAX_RECORDS:
+				lst.append(r)
+
+	def replay(self, node):
+		"""
+		Apply the result of a previous processing of a header if the macros it depends on have the same values
+
+		:param node: header
+		:type node: :py:class:`waflib.Node.Node`
+		:return: True if a result was applied
+		:rtype: bool
+		"""
+		defs = self.defs
+		for r in self.memo.get((node, tuple(self.nodepaths)), ()):
+			for (k, v) in r.reads.items():
+				if dict.get(defs, k, MISSING) != v:
+					break
+			else:
+				for (k, v) in r.bans.items():
+					if (k in self.ban_includes) != v:
+						break
+				else:
+					break
+		else:
+			return False
+
+		for k in r.reads:
+			self.note_read(k)
+		for k in r.bans:
+			self.is_banned(k)
+		for (k, v) in r.writes.items():
+			if v is MISSING:
+				if dict.__contains__(defs, k):
+					del defs[k]
+				else:
+					self.note_write(k, v)
+			else:
+				defs[k] = v
+		for k in r.new_bans:
+			self.ban(k)
+		for x in r.nodes:
+			self.add_node(x)
+		for x in r.names:
+			self.add_name(x)
+		self.curfile = r.curfile
+		return True
+
 	def addlines(self, node):
 		"""
 		Add the lines from a header in the list of preprocessor lines to parse
@@ -888,18 +1112,51 @@ class c_parser(object):
 			return
 
 		try:
-			lines = filter_comments(filepath)
-			lines.append((POPFILE, ''))
+			lines = self.filter_comments(node) + [(POPFILE, '')]
 			lines.reverse()
 			pc[filepath] = lines # cache the lines filtered
 			self.lines.extend(lines)
-		except IOError:
+		except (IOError, OSError):
 			raise PreprocError("could not read the file %s" % filepath)
 		except Exception:
 			if Logs.verbose > 0:
 				error("parsing %s failed" % filepath)
 				traceback.print_exc()
 
+	def filter_comments(self, node):
+		"""
+		Obtain the preprocessor lines of a file by calling :py:func:`waflib.Tools.c_preproc.filter_comments`, unless
+		the file is unchanged since a previous build (see :py:attr:`waflib.Tools.c_preproc.persistent_cache`)
+
+		:param node: file to read
+		:type node: :py:class:`waflib.Node.Node`
+		:return: the preprocessor directives as a list of (keyword, line)
+		:rtype: a list of string pairs
+		"""
+		filepath = node.abspath()
+		if not persistent_cache:
+			return filter_comments(filepath)
+
+		st = os.stat(filepath)
+		key = (st.st_mtime, st.st_size, use_trigraphs)
+		cache = get_persistent_cache(node.ctx)
+		try:
+			(k, lines) = cache[filepath]
+		except KeyError:
+			pass
+		else:
+			if k == key:
+				return lines
+
+		lines = filter_comments(filepath)
+		if time.time() - st.st_mtime > 2:
+			cache[filepath] = (key, lines)
+			node.ctx.preproc_cache_modified = True
+		elif cache.pop(filepath, None):
+			# the file may change again with the same timestamp and size
+			node.ctx.preproc_cache_modified = True
+		return lines
+
 	def start(self, node, env):
 		"""
 		Preprocess a source file to obtain the dependencies, which are accumulated to :py:attr:`waflib.Tools.c_preproc.c_parser.nodes`
@@ -920,6 +1177,12 @@ class c_parser(object):
 			bld.parse_cache = {}
 			self.parse_cache = bld.parse_cache
 
+		if memoize_includes:
+			try:
+				self.memo = bld.preproc_memo
+			except AttributeError:
+				self.memo = bld.preproc_memo = {}
+
 		self.addlines(node)
 
 		# macros may be defined on the command-line, so they must be parsed as if they were part of the file
@@ -935,6 +1198,8 @@ class c_parser(object):
 		while self.lines:
 			(token, line) = self.lines.pop()
 			if token == POPFILE:
+				if self.records and self.records[-1].level == self.count_files:
+					self.end_record()
 				self.count_files -= 1
 				self.currentnode_stack.pop()
 				continue
@@ -969,9 +1234,9 @@ class c_parser(object):
 					else: state[-1] = accepted
 				elif token == 'include' or token == 'import':
 					(kind, inc) = extract_include(line, self.defs)
-					if inc in self.ban_includes:
+					if self.is_banned(inc):
 						continue
-					if token == 'import': self.ban_includes.add(inc)
+					if token == 'import': self.ban(inc)
 					if ve: debug('preproc: include found %s    (%s) ', inc, kind)
 					if kind == '"' or not strict_quotes:
 						self.tryfind(inc)
@@ -996,11 +1261,94 @@ class c_parser(object):
 						#print "undef %s" % name
 				elif token == 'pragma':
 					if re_pragma_once.match(line.lower()):
-						self.ban_includes.add(self.curfile)
+						self.ban(self.curfile)
 			except Exception as e:
+				for r in self.records:
+					r.valid = False
 				if Logs.verbose:
 					debug('preproc: line parsing failed (%s): %s %s', e, line, Utils.ex_stack())
 
+def get_persistent_cache(bld):
+	"""
+	Load the persistent parse cache from the build directory when it is first used
+
+	:param bld: build context
+	:type bld: :py:class:`waflib.Build.BuildContext`
+	:return: file paths mapped to a key (modification time, size) and to the preprocessor lines
+	:rtype: dict
+	"""
+	try:
+		return bld.preproc_cache
+	except AttributeError:
+		pass
+
+	lock.acquire()
+	try:
+		try:
+			return bld.preproc_cache
+		except AttributeError:
+			pass
+
+		cache = {}
+		try:
+			f = open(os.path.join(bld.variant_dir, PERSISTENT_CACHE_FILE), 'rb')
+			try:
+				cache = cPickle.load(f)
+			finally:
+				f.close()
+		except Exception:
+			debug('preproc: could not load the persistent parse cache')
+
+		bld.preproc_cache = cache
+		bld.preproc_cache_modified = False
+		return cache
+	finally:
+		lock.release()
+
+def store_persistent_cache(bld):
+	"""
+	Write the persistent parse cache if new files were read during the build, and drop the entries
+	of the files which no longer exist. This is called after :py:meth:`waflib.Build.BuildContext.compile`,
+	so the files parsed are also kept when the build fails or is interrupted.
+
+	:param bld: build context
+	:type bld: :py:class:`waflib.Build.BuildContext`
+	"""
+	if not getattr(bld, 'preproc_cache_modified', False):
+		return
+
+	# the scanners may still be running if the build was interrupted
+	cache = dict(bld.preproc_cache)
+	for x in list(cache.keys()):
+		if not os.path.isfile(x):
+			del cache[x]
+			bld.preproc_cache.pop(x, None)
+
+	db = os.path.join(bld.variant_dir, PERSISTENT_CACHE_FILE)
+	f = None
+	try:
+		try:
+			f = open(db + '.tmp', 'wb')
+			cPickle.dump(cache, f, -1)
+		finally:
+			if f:
+				f.close()
+		if Utils.is_win32 and os.path.exists(db):
+			os.unlink(db)
+		os.rename(db + '.tmp', db)
+	except (IOError, OSError):
+		Logs.warn('Could not write the parse cache %r' % db)
+	bld.preproc_cache_modified = False
+
+def compile_and_store(self):
+	# BuildContext.store is replaced by build_db, and build_journal does not always call it
+	try:
+		self.compile_preproc()
+	finally:
+		store_persistent_cache(self)
+Build.BuildContext.compile_preproc = Build.BuildContext.compile
+Build.BuildContext.compile = compile_and_store
+
 def scan(task):
 	"""
 	Get the dependencies using a c/c++ preprocessor, this is required for finding dependencies of the kind::
@@ -22,6 +22,7 @@ class cxx(Task.Task):
 	vars    = ['CXXDEPS'] # unused variable to depend on, just in case
 	ext_in  = ['.h'] # set the build order easily by using ext_out=['.h']
 	scan    = c_preproc.scan
+	scan_threadsafe = True
 
 class cxxprogram(link_task):
 	"Link object files into a c++ program"
@@ -358,18 +358,30 @@ class ts2qm(Task.Task):
 	color   = 'BLUE'
 	run_str = '${QT_LRELEASE} ${QT_LRELEASE_FLAGS} ${SRC} -qm ${TGT}'
 
+def write_qrc(tgt, paths):
+	"""
+	Write a qrc file including the paths given (may be executed in another process)
+	"""
+	txt = '\n'.join(['<file>%s</file>' % k for k in paths])
+	code = '<!DOCTYPE RCC><RCC version="1.0">\n<qresource>\n%s\n</qresource>\n</RCC>' % txt
+	f = open(tgt, 'w')
+	try:
+		f.write(code)
+	finally:
+		f.close()
+
 class qm2rcc(Task.Task):
 	"""
 	Transform *.qm* files into *.rc* files
 	"""
 	color = 'BLUE'
 	after = 'ts2qm'
+	process_pool = True
 
 	def run(self):
 		"""Create a qrc file including the inputs"""
-		txt = '\n'.join(['<file>%s</file>' % k.path_from(self.outputs[0].parent) for k in self.inputs])
-		code = '<!DOCTYPE RCC><RCC version="1.0">\n<qresource>\n%s\n</qresource>\n</RCC>' % txt
-		self.outputs[0].write(code)
+		paths = [k.path_from(self.outputs[0].parent) for k in self.inputs]
+		self.exec_function(write_qrc, self.outputs[0].abspath(), paths)
 
 def configure(self):
 	"""
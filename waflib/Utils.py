@@ -25,6 +25,11 @@ except ImportError:
 		"""A deque for Python 2.3 which does not have one"""
 		def popleft(self):
 			return self.pop(0)
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
 try:
 	import _winreg as winreg
 except:
@@ -79,6 +84,53 @@ else:
 SIG_NIL = 'iluvcuteoverload'.encode()
 """Arbitrary null value for a md5 hash. This value must be changed when the hash value is replaced (size)"""
 
+HASH = 'md5'
+"""Name of the hash algorithm bound to ``Utils.md5``, see :py:func:`waflib.Utils.set_hash`"""
+
+hash_algorithms = {}
+"""Hash algorithms available, mapped to functions returning hash objects, see :py:func:`waflib.Utils.set_hash`"""
+try:
+	hash_algorithms['md5'] = md5
+except NameError:
+	pass
+try:
+	import hashlib
+except ImportError:
+	pass
+else:
+	hash_algorithms['sha1'] = hashlib.sha1
+	if hasattr(hashlib, 'blake2b'):
+		def blake2b(data=''.encode()):
+			return hashlib.blake2b(data, digest_size=16)
+		hash_algorithms['blake2b'] = blake2b
+try:
+	import xxhash
+except ImportError:
+	pass
+else:
+	for x in ('xxh64', 'xxh128', 'xxh3_64', 'xxh3_128'):
+		if hasattr(xxhash, x):
+			hash_algorithms[x] = getattr(xxhash, x)
+
+def set_hash(name):
+	"""
+	Select the hash algorithm used by :py:func:`waflib.Utils.h_file`, :py:func:`waflib.Utils.h_list`
+	and by the task signatures. The algorithm is chosen during the configuration (``waf configure --hash=blake2b``),
+	it is recorded in the build data, so the signatures are computed again when it changes.
+	The value of :py:const:`waflib.Utils.SIG_NIL` is adjusted to the size of the hash values.
+
+	:param name: algorithm name, a key from :py:const:`waflib.Utils.hash_algorithms`
+	:type name: string
+	"""
+	global md5, HASH, SIG_NIL
+	try:
+		fun = hash_algorithms[name]
+	except KeyError:
+		raise Errors.WafError('Unknown hash algorithm %r (use one of %s)' % (name, ', '.join(sorted(hash_algorithms.keys()))))
+	md5 = fun
+	HASH = name
+	SIG_NIL = ('iluvcuteoverload' * 4).encode()[:len(fun().digest())]
+
 O644 = 420
 """Constant representing the permissions for regular files (0644 raises a syntax error on python 3)"""
 
@@ -343,6 +395,189 @@ def check_dir(path):
 			if not os.path.isdir(path):
 				raise Errors.WafError('Cannot create the folder %r' % path, ex=e)
 
+FICLONE = 0x40049409
+"""ioctl creating a copy-on-write clone of a file (btrfs, xfs), see :py:func:`waflib.Utils.reflink`"""
+
+reflink_ok = fcntl is not None and sys.platform.startswith('linux')
+"""Set to False when the filesystem does not support the reflinks"""
+
+def reflink(src, dst):
+	"""
+	Create a copy-on-write clone of a file. The file data is shared
+	until one of the files is modified, so it is safe to alter either file.
+
+	:type  src: string
+	:param src: Path to the file to clone
+	:type  dst: string
+	:param dst: Path to the new file, which must not exist
+	:return: True if the clone was created
+	"""
+	global reflink_ok
+	if not reflink_ok:
+		return False
+	fs = open(src, 'rb')
+	try:
+		fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, O644)
+		try:
+			fcntl.ioctl(fd, FICLONE, fs.fileno())
+		except (IOError, OSError) as e:
+			os.close(fd)
+			os.unlink(dst)
+			if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.ENOSYS):
+				reflink_ok = False
+			return False
+		os.close(fd)
+	finally:
+		fs.close()
+	shutil.copystat(src, dst)
+	return True
+
+def copy_file(src, dst, link=False):
+	"""
+	Copy a file, replacing the destination file if it exists. A reflink is created if the filesystem
+	supports it, then a hard link if *link* is True, then a regular copy is made (metadata included).
+	The destination is removed first, so that the files hard linked to it are not modified.
+
+	:type  src: string
+	:param src: Path to the file to copy
+	:type  dst: string
+	:param dst: Path to the copy
+	:type  link: bool
+	:param link: Allow hard links; the files sharing the data must then be replaced instead of being modified
+	"""
+	try:
+		os.unlink(dst)
+	except OSError:
+		pass
+	if reflink(src, dst):
+		return
+	if link:
+		try:
+			os.link(src, dst)
+		except (OSError, AttributeError):
+			pass
+		else:
+			return
+	shutil.copy2(src, dst)
+
+codecs = {}
+"""Compression codecs available, mapped to the functions creating the compressor and the decompressor objects"""
+try:
+	import zlib
+except ImportError:
+	pass
+else:
+	codecs['zlib'] = (zlib.compressobj, zlib.decompressobj)
+try:
+	import bz2
+except ImportError:
+	pass
+else:
+	codecs['bz2'] = (bz2.BZ2Compressor, bz2.BZ2Decompressor)
+try:
+	import lzma
+except ImportError:
+	pass
+else:
+	codecs['lzma'] = (lzma.LZMACompressor, lzma.LZMADecompressor)
+
+def compress_file(src, dst, codec):
+	"""
+	Compress a file by chunks, the permissions and the timestamps are copied as with :py:func:`shutil.copy2`
+
+	:type  src: string
+	:param src: Path to the file to compress
+	:type  dst: string
+	:param dst: Path to the compressed file
+	:type  codec: string
+	:param codec: a key from :py:const:`waflib.Utils.codecs`
+	"""
+	try:
+		obj = codecs[codec][0]()
+	except KeyError:
+		raise Errors.WafError('Unknown codec %r (use one of %s)' % (codec, ', '.join(sorted(codecs.keys()))))
+	f = open(src, 'rb')
+	try:
+		g = open(dst, 'wb')
+		try:
+			while 1:
+				data = f.read(100000)
+				if not data:
+					break
+				g.write(obj.compress(data))
+			g.write(obj.flush())
+		finally:
+			g.close()
+	finally:
+		f.close()
+	shutil.copystat(src, dst)
+
+def decompress_file(src, dst, codec):
+	"""
+	Decompress a file created by :py:func:`waflib.Utils.compress_file`, replacing the destination file if it exists.
+	The errors caused by corrupt or truncated data are raised as IOError.
+
+	:type  src: string
+	:param src: Path to the compressed file
+	:type  dst: string
+	:param dst: Path to the file to create
+	:type  codec: string
+	:param codec: a key from :py:const:`waflib.Utils.codecs`
+	"""
+	try:
+		obj = codecs[codec][1]()
+	except KeyError:
+		raise IOError('Unknown codec %r' % codec)
+	try:
+		os.unlink(dst)
+	except OSError:
+		pass
+	f = open(src, 'rb')
+	try:
+		g = open(dst, 'wb')
+		try:
+			while 1:
+				data = f.read(100000)
+				if not data:
+					break
+				try:
+					g.write(obj.decompress(data))
+				except (IOError, OSError):
+					raise
+				except Exception as e:
+					raise IOError('Could not decompress %r: %r' % (src, e))
+			# the decompressors accept truncated data, so the end of the stream is checked
+			if not end_of_stream(obj):
+				raise IOError('Could not decompress %r: unexpected end of data' % src)
+			if hasattr(obj, 'flush'):
+				g.write(obj.flush())
+		finally:
+			g.close()
+	finally:
+		f.close()
+	shutil.copystat(src, dst)
+
+def end_of_stream(obj):
+	"""
+	Return True if a decompressor object from :py:const:`waflib.Utils.codecs` has reached the end of the compressed stream
+
+	:param obj: decompressor object
+	:rtype: bool
+	"""
+	try:
+		return obj.eof
+	except AttributeError:
+		# zlib before python 3.3 and bz2 on python 2: once the stream has ended, the
+		# data is stored in unused_data (zlib) or an EOFError is raised (bz2)
+		n = len(obj.unused_data)
+		try:
+			obj.decompress('\0'.encode())
+		except EOFError:
+			return True
+		except Exception:
+			return False
+		return len(obj.unused_data) > n
+
 def def_attrs(cls, **kw):
 	"""
 	Set default attributes on a class instance
@@ -494,18 +729,29 @@ class Timer(object):
 
 	def __str__(self):
 		delta = datetime.datetime.utcnow() - self.start_time
-		days = int(delta.days)
-		hours = delta.seconds // 3600
-		minutes = (delta.seconds - hours * 3600) // 60
-		seconds = delta.seconds - hours * 3600 - minutes * 60 + float(delta.microseconds) / 1000 / 1000
-		result = ''
-		if days:
-			result += '%dd' % days
-		if days or hours:
-			result += '%dh' % hours
-		if days or hours or minutes:
-			result += '%dm' % minutes
-		return '%s%.3fs' % (result, seconds)
+		return fmt_duration(delta.days * 86400 + delta.seconds + float(delta.microseconds) / 1000 / 1000)
+
+def fmt_duration(secs):
+	"""
+	Format a duration as :py:class:`waflib.Utils.Timer` does, for example '1m2.500s'
+
+	:param secs: duration in seconds
+	:type secs: float
+	:rtype: string
+	"""
+	days = int(secs // 86400)
+	secs -= days * 86400
+	hours = int(secs // 3600)
+	minutes = int((secs - hours * 3600) // 60)
+	seconds = secs - hours * 3600 - minutes * 60
+	result = ''
+	if days:
+		result += '%dd' % days
+	if days or hours:
+		result += '%dh' % hours
+	if days or hours or minutes:
+		result += '%dm' % minutes
+	return '%s%.3fs' % (result, seconds)
 
 if is_win32:
 	old = shutil.copy2
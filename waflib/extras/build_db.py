@@ -0,0 +1,531 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Store the build data in a compact binary file instead of pickling :py:const:`waflib.Build.SAVED_ATTRS`
+as a single object graph. The node names are interned in a string table, the nodes are
+referenced by integer ids, and the signatures are stored as fixed-width digests. The dependencies
+(bld.node_deps and bld.raw_deps) are decoded lazily, one task at a time, so that the builds of a few
+targets do not decode the dependencies of the other tasks::
+
+	def options(opt):
+		opt.load('build_db')
+
+The file format (see :py:const:`waflib.extras.build_db.VERSION`):
+
+* header: magic string, version, digest width, byte order, amount of sections
+* section table: name, offset and size for each section
+* strings: names of the nodes and of the unresolved dependencies, separated by null bytes
+* nodes: parent ids, name ids, flags and signatures, the parents are always before their children
+* task_sigs: task ids and signatures, for the task signatures and for the implicit dependencies
+* node_deps, raw_deps: task ids, offsets and arrays of node ids or string ids
+* attrs: the other attributes from :py:const:`waflib.Build.SAVED_ATTRS`, and the values that do
+  not fit in the tables above, pickled (the nodes are replaced by their ids)
+* node_sigs: the node signatures that do not fit in the node table, pickled
+
+The file is written next to the pickle file used by default, which is removed to avoid
+reading stale data.
+
+Only the dependencies are lazy: the whole file is read, and the node table and the task signatures
+(bld.task_sigs) are decoded on every restore. This is most of the loading time of the no-op builds,
+which are faster than with the pickle file because of the compact encoding, not because less data is decoded.
+"""
+
+import os, sys, struct, array
+try:
+	import cPickle
+except:
+	import pickle as cPickle
+try:
+	from io import BytesIO
+except ImportError:
+	from cStringIO import StringIO as BytesIO
+from waflib import Build, Context, Utils, Logs, Node
+
+VERSION = 1
+"""Version of the file format, increment when the format changes"""
+
+DBFILE = Context.DBFILE + '.bin'
+"""Name of the binary build data file in the build directory"""
+
+MAGIC = 'WAFBDB'
+HEADER = '<6sHHcI'
+SECTION = '<16sQQ'
+
+DIR = 1
+"""Node flag: the node is a folder (has the attribute *children*)"""
+SIG = 2
+"""Node flag: the node signature is stored in the signature table"""
+DETACHED = 4
+"""Node flag: the node is not in the children of its parent (removed during the build)"""
+
+if sys.hexversion > 0x3000000:
+	def to_bytes(x):
+		return x.encode('utf-8', 'surrogateescape')
+	def to_str(x):
+		return x.decode('utf-8', 'surrogateescape')
+else:
+	def to_bytes(x):
+		return x
+	def to_str(x):
+		return x
+
+def int_array(data=None):
+	"""Return an array of signed integers, filled from the bytes given"""
+	a = array.array('i')
+	if data:
+		try:
+			a.frombytes(data)
+		except AttributeError:
+			a.fromstring(data)
+	return a
+
+def array_bytes(a):
+	"""Return the contents of an array as bytes"""
+	try:
+		return a.tobytes()
+	except AttributeError:
+		return a.tostring()
+
+class lazy_dict(dict):
+	"""
+	Dict in which the values are decoded from the build data when accessed. All the values
+	are decoded when the dict is iterated over or copied.
+	"""
+	def __init__(self, index, decode):
+		dict.__init__(self)
+		self.index = index
+		"""Keys mapped to the positions of the values not decoded yet"""
+		self.decode = decode
+		"""Function decoding a value from its position"""
+
+	def fetch(self, k):
+		pos = self.index.pop(k)
+		v = self.decode(pos)
+		dict.__setitem__(self, k, v)
+		return v
+
+	def load_all(self):
+		for k in list(self.index.keys()):
+			self.fetch(k)
+
+	def __missing__(self, k):
+		try:
+			return self.fetch(k)
+		except KeyError:
+			raise KeyError(k)
+
+	def __contains__(self, k):
+		return k in self.index or dict.__contains__(self, k)
+	has_key = __contains__
+
+	def get(self, k, default=None):
+		try:
+			return self[k]
+		except KeyError:
+			return default
+
+	def __setitem__(self, k, v):
+		self.index.pop(k, None)
+		dict.__setitem__(self, k, v)
+
+	def __delitem__(self, k):
+		if self.index.pop(k, None) is None:
+			dict.__delitem__(self, k)
+		else:
+			dict.pop(self, k, None)
+
+	def pop(self, k, *default):
+		if k in self.index:
+			self.fetch(k)
+		return dict.pop(self, k, *default)
+
+	def setdefault(self, k, default=None):
+		if k in self.index:
+			return self.fetch(k)
+		return dict.setdefault(self, k, default)
+
+	def __len__(self):
+		return len(self.index) + dict.__len__(self)
+
+	def __iter__(self):
+		self.load_all()
+		return dict.__iter__(self)
+
+def wrap_method(name):
+	fun = getattr(dict, name, None)
+	if fun:
+		def f(self, *k, **kw):
+			self.load_all()
+			return fun(self, *k, **kw)
+		setattr(lazy_dict, name, f)
+for x in 'keys values items iterkeys itervalues iteritems copy update clear __repr__ __eq__ __ne__'.split():
+	wrap_method(x)
+
+class writer(object):
+	"""Encode the build data of a build context"""
+	def __init__(self, bld, width):
+		self.bld = bld
+		self.width = width
+		self.strings = []
+		self.string_ids = {}
+		self.nodes = []
+		self.node_ids = {}
+		self.extra = {}
+
+	def string_id(self, s):
+		try:
+			return self.string_ids[s]
+		except KeyError:
+			ret = self.string_ids[s] = len(self.strings)
+			self.strings.append(s)
+			return ret
+
+	def node_id(self, node):
+		try:
+			return self.node_ids[id(node)]
+		except KeyError:
+			# node removed from the tree, but still referenced
+			if node.parent:
+				self.node_id(node.parent)
+			ret = self.node_ids[id(node)] = len(self.nodes)
+			self.nodes.append(node)
+			return ret
+
+	def add_tree(self, root):
+		# the parents obtain lower ids than their children
+		lst = [root]
+		nodes = self.nodes
+		ids = self.node_ids
+		while lst:
+			node = lst.pop()
+			ids[id(node)] = len(nodes)
+			nodes.append(node)
+			try:
+				children = node.children
+			except AttributeError:
+				pass
+			else:
+				lst.extend(children.values())
+
+	def is_sig(self, v):
+		return isinstance(v, bytes) and len(v) == self.width
+
+	def pickle(self, obj):
+		out = BytesIO()
+		p = cPickle.Pickler(out, -1)
+		def persistent_id(obj):
+			if isinstance(obj, Node.Node):
+				return str(self.node_id(obj))
+			return None
+		p.persistent_id = persistent_id
+		p.dump(obj)
+		return out.getvalue()
+
+	def encode_task_sigs(self, sigs):
+		keys, values, ikeys, ivalues = [], [], [], []
+		extra = {}
+		for (k, v) in sigs.items():
+			if self.is_sig(k) and self.is_sig(v):
+				keys.append(k)
+				values.append(v)
+			elif isinstance(k, tuple) and len(k) == 2 and k[1] == 'imp' and self.is_sig(k[0]) and self.is_sig(v):
+				ikeys.append(k[0])
+				ivalues.append(v)
+			else:
+				extra[k] = v
+		self.extra['task_sigs'] = extra
+		return b''.join([struct.pack('<I', len(keys))] + keys + values + [struct.pack('<I', len(ikeys))] + ikeys + ivalues)
+
+	def encode_deps(self, deps, name, encode):
+		keys = []
+		offsets = int_array()
+		ids = int_array()
+		extra = {}
+		for (k, v) in deps.items():
+			if self.is_sig(k) and isinstance(v, list):
+				try:
+					lst = [encode(x) for x in v]
+				except (TypeError, ValueError):
+					pass
+				else:
+					keys.append(k)
+					offsets.append(len(ids))
+					ids.extend(lst)
+					continue
+			extra[k] = v
+		offsets.append(len(ids))
+		self.extra[name] = extra
+		return b''.join([struct.pack('<I', len(keys))] + keys + [array_bytes(offsets), array_bytes(ids)])
+
+	def encode_node(self, x):
+		if not isinstance(x, Node.Node):
+			raise TypeError('not a node')
+		return self.node_id(x)
+
+	def encode_string(self, x):
+		if not isinstance(x, str) or '\0' in x:
+			raise TypeError('not a string')
+		return self.string_id(x)
+
+	def encode_nodes(self):
+		parents = int_array()
+		names = int_array()
+		flags = array.array('B')
+		sigs = []
+		extra = {}
+		ids = self.node_ids
+		for (i, x) in enumerate(self.nodes):
+			p = x.parent
+			flag = 0
+			if p is None:
+				parents.append(-1)
+			else:
+				parents.append(ids[id(p)])
+				if p.children.get(x.name) is not x:
+					flag |= DETACHED
+			names.append(self.string_id(x.name))
+			if hasattr(x, 'children'):
+				flag |= DIR
+			sig = getattr(x, 'sig', None)
+			if sig is not None:
+				if self.is_sig(sig):
+					flag |= SIG
+					sigs.append(sig)
+				else:
+					extra[i] = sig
+			flags.append(flag)
+		self.node_sigs = extra
+		return b''.join([struct.pack('<I', len(self.nodes)), array_bytes(parents), array_bytes(names), array_bytes(flags)] + sigs)
+
+	def encode_strings(self):
+		return b''.join([struct.pack('<I', len(self.strings)), to_bytes('\0'.join(self.strings))])
+
+	def encode(self):
+		"""
+		:return: the contents of the build data file
+		:rtype: bytes
+		"""
+		bld = self.bld
+		self.add_tree(bld.root)
+
+		# the nodes referenced may be added to the node table, encode it last
+		sections = []
+		sections.append(('task_sigs', self.encode_task_sigs(bld.task_sigs)))
+		sections.append(('node_deps', self.encode_deps(bld.node_deps, 'node_deps', self.encode_node)))
+		sections.append(('raw_deps', self.encode_deps(bld.raw_deps, 'raw_deps', self.encode_string)))
+
+		attrs = {}
+		for x in Build.SAVED_ATTRS:
+			if not x in ('root', 'task_sigs', 'node_deps', 'raw_deps'):
+				attrs[x] = getattr(bld, x)
+		sections.append(('attrs', self.pickle((attrs, self.extra))))
+
+		sections.append(('nodes', self.encode_nodes()))
+		sections.append(('node_sigs', cPickle.dumps(self.node_sigs, -1)))
+		sections.append(('strings', self.encode_strings()))
+
+		offset = struct.calcsize(HEADER) + len(sections) * struct.calcsize(SECTION)
+		table = []
+		for (name, data) in sections:
+			table.append(struct.pack(SECTION, to_bytes(name), offset, len(data)))
+			offset += len(data)
+		header = struct.pack(HEADER, to_bytes(MAGIC), VERSION, self.width, to_bytes(sys.byteorder[0]), len(sections))
+		return b''.join([header] + table + [data for (name, data) in sections])
+
+class reader(object):
+	"""Decode the build data for a build context"""
+	def __init__(self, bld, data, width):
+		self.bld = bld
+		self.data = data
+		self.width = width
+
+		(magic, version, w, order, count) = struct.unpack_from(HEADER, data, 0)
+		if to_str(magic) != MAGIC or version != VERSION:
+			raise ValueError('unsupported build data format')
+		if w != width:
+			raise ValueError('the digest width has changed')
+		self.swap = to_str(order) != sys.byteorder[0]
+
+		self.sections = {}
+		pos = struct.calcsize(HEADER)
+		for i in range(count):
+			(name, offset, size) = struct.unpack_from(SECTION, data, pos)
+			self.sections[to_str(name).rstrip('\0')] = (offset, size)
+			pos += struct.calcsize(SECTION)
+
+	def section(self, name):
+		(offset, size) = self.sections[name]
+		return (offset, offset + size)
+
+	def ints(self, start, count):
+		a = int_array(self.data[start:start + 4 * count])
+		if self.swap:
+			a.byteswap()
+		return a
+
+	def load_attrs(self):
+		(start, end) = self.section('attrs')
+		p = cPickle.Unpickler(BytesIO(self.data[start:end]))
+		nodes = self.nodes
+		def persistent_load(pid):
+			return nodes[int(pid)]
+		p.persistent_load = persistent_load
+		return p.load()
+
+	def load_strings(self):
+		(start, end) = self.section('strings')
+		(count,) = struct.unpack_from('<I', self.data, start)
+		if not count:
+			return []
+		return to_str(self.data[start + 4:end]).split('\0')
+
+	def load_nodes(self, names):
+		(start, end) = self.section('nodes')
+		(count,) = struct.unpack_from('<I', self.data, start)
+		pos = start + 4
+		parents = self.ints(pos, count)
+		pos += 4 * count
+		name_ids = self.ints(pos, count)
+		pos += 4 * count
+		flags = array.array('B')
+		flags.extend(bytearray(self.data[pos:pos + count]))
+		pos += count
+
+		cls = self.bld.node_class
+		new = object.__new__
+		nodes = self.nodes = []
+		data = self.data
+		w = self.width
+		for i in range(count):
+			node = new(cls)
+			node.name = names[name_ids[i]]
+			flag = flags[i]
+			p = parents[i]
+			if p < 0:
+				node.parent = None
+			else:
+				parent = node.parent = nodes[p]
+				if not flag & DETACHED:
+					parent.children[node.name] = node
+			if flag & DIR:
+				node.children = {}
+			if flag & SIG:
+				node.sig = data[pos:pos + w]
+				pos += w
+			nodes.append(node)
+		return nodes
+
+	def load_task_sigs(self):
+		(start, end) = self.section('task_sigs')
+		data = self.data
+		w = self.width
+		ret = {}
+		(count,) = struct.unpack_from('<I', data, start)
+		pos = start + 4
+		for i in range(count):
+			ret[data[pos + i * w:pos + (i + 1) * w]] = data[pos + (count + i) * w:pos + (count + i + 1) * w]
+		pos += 2 * count * w
+		(count,) = struct.unpack_from('<I', data, pos)
+		pos += 4
+		for i in range(count):
+			ret[(data[pos + i * w:pos + (i + 1) * w], 'imp')] = data[pos + (count + i) * w:pos + (count + i + 1) * w]
+		return ret
+
+	def load_deps(self, name, values):
+		(start, end) = self.section(name)
+		data = self.data
+		w = self.width
+		(count,) = struct.unpack_from('<I', data, start)
+		pos = start + 4
+		index = {}
+		for i in range(count):
+			index[data[pos + i * w:pos + (i + 1) * w]] = i
+		pos += count * w
+		offsets = self.ints(pos, count + 1)
+		pos += 4 * (count + 1)
+		ids = self.ints(pos, offsets[-1])
+		def decode(i):
+			return [values[x] for x in ids[offsets[i]:offsets[i + 1]]]
+		return lazy_dict(index, decode)
+
+	def load(self):
+		"""Set the attributes from :py:const:`waflib.Build.SAVED_ATTRS` on the build context"""
+		bld = self.bld
+		strings = self.load_strings()
+		nodes = self.load_nodes(strings)
+		(attrs, extra) = self.load_attrs()
+		if attrs.get('hash_name', 'md5') != Utils.HASH:
+			raise ValueError('the hash algorithm has changed')
+
+		(start, end) = self.section('node_sigs')
+		for (k, v) in cPickle.loads(self.data[start:end]).items():
+			nodes[k].sig = v
+
+		task_sigs = self.load_task_sigs()
+		task_sigs.update(extra['task_sigs'])
+		node_deps = self.load_deps('node_deps', nodes)
+		raw_deps = self.load_deps('raw_deps', strings)
+		# do not call update(), it decodes all the values
+		for (k, v) in extra['node_deps'].items():
+			node_deps[k] = v
+		for (k, v) in extra['raw_deps'].items():
+			raw_deps[k] = v
+
+		bld.root = nodes[0]
+		bld.task_sigs = task_sigs
+		bld.node_deps = node_deps
+		bld.raw_deps = raw_deps
+		for x in Build.SAVED_ATTRS:
+			if x in attrs:
+				setattr(bld, x, attrs[x])
+
+def restore(self):
+	"""Load the build data from :py:const:`waflib.extras.build_db.DBFILE` (replaces :py:meth:`waflib.Build.BuildContext.restore`)"""
+	self.restore_pickle()
+	dbfn = os.path.join(self.variant_dir, DBFILE)
+	try:
+		data = Utils.readf(dbfn, 'rb')
+	except (IOError, OSError):
+		Logs.debug('build: could not load the build cache %s (missing)' % dbfn)
+		return
+	try:
+		reader(self, data, Utils.md5().digest_size).load()
+	except Exception as e:
+		Logs.debug('build: could not load the build cache %s: %r' % (dbfn, e))
+		# the data may have been loaded partially, start from scratch
+		for x in Build.SAVED_ATTRS:
+			setattr(self, x, {})
+		self.root = self.node_class('', None)
+		self.hash_name = Utils.HASH
+	self.init_dirs()
+Build.BuildContext.restore_pickle = Build.BuildContext.restore
+Build.BuildContext.restore = restore
+
+def store(self):
+	"""Write the build data to :py:const:`waflib.extras.build_db.DBFILE` (replaces :py:meth:`waflib.Build.BuildContext.store`)"""
+	data = writer(self, Utils.md5().digest_size).encode()
+	db = os.path.join(self.variant_dir, DBFILE)
+	f = None
+	try:
+		f = open(db + '.tmp', 'wb')
+		f.write(data)
+	finally:
+		if f:
+			f.close()
+
+	try:
+		st = os.stat(db)
+		os.unlink(db)
+		if not Utils.is_win32:
+			os.chown(db + '.tmp', st.st_uid, st.st_gid)
+	except (AttributeError, OSError):
+		pass
+	os.rename(db + '.tmp', db)
+
+	# the pickle file would be loaded by restore_pickle
+	try:
+		os.unlink(os.path.join(self.variant_dir, Context.DBFILE))
+	except OSError:
+		pass
+Build.BuildContext.store = store
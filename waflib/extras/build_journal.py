@@ -0,0 +1,259 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Append the results of the tasks to a journal file as the tasks complete, instead of
+rewriting the whole build data at the end of each build. The journal is replayed when the
+build data is loaded, and it is merged into the build data (compaction) when it becomes large
+compared to the amount of tasks. The builds that are interrupted keep the results of the tasks
+executed so far::
+
+	def options(opt):
+		opt.load('build_journal')
+
+To use it with the binary build data, load the tool after *build_db*::
+
+	def options(opt):
+		opt.load('build_db build_journal')
+
+Each record contains the task id, the task signature, the signature of the implicit dependencies,
+the dependencies found by the scanner, the output paths with their signatures, and the duration.
+A record removing the task signature is written before a task is executed, and the changes made to the
+file hashes (:py:attr:`waflib.Build.BuildContext.file_stats`) are written after the build. The other attributes from
+:py:const:`waflib.Build.SAVED_ATTRS` are only written when the journal is merged. The clean command
+and the other contexts that do not compile always write the full build data.
+"""
+
+import os
+try:
+	import cPickle
+except:
+	import pickle as cPickle
+from waflib import Build, Task, Context, Logs, Utils
+
+JOURNAL = Context.DBFILE + '.journal'
+"""Name of the journal file in the build directory"""
+
+MIN_RECORDS = 200
+"""Minimum amount of records before the journal is merged into the build data"""
+
+COMPACT_RATIO = 0.3
+"""Merge the journal into the build data when it contains more than COMPACT_RATIO * amount of task signatures records"""
+
+lock = Utils.threading.Lock()
+"""The records are written by the task consumers"""
+
+def journal_path(bld):
+	return os.path.join(bld.variant_dir, JOURNAL)
+
+def write_record(bld, rec):
+	"""Append a record to the journal and flush it"""
+	try:
+		data = cPickle.dumps(rec, -1)
+	except Exception:
+		# the raw dependencies may contain anything
+		bld.journal_compact = True
+		return
+
+	lock.acquire()
+	try:
+		f = getattr(bld, 'journal_file', None)
+		if f is None:
+			f = bld.journal_file = open(journal_path(bld), 'ab')
+			# the records that follow use this hash algorithm
+			f.write(cPickle.dumps((None, None, Utils.HASH), -1))
+		f.write(data)
+		f.flush()
+		bld.journal_records = getattr(bld, 'journal_records', 0) + 1
+	finally:
+		lock.release()
+
+def journal_task(self, tsk):
+	"""
+	Append the results of a task to the journal (called by the task consumers after :py:meth:`waflib.Task.Task.post_run`)
+
+	:param tsk: task executed successfully
+	:type tsk: :py:class:`waflib.Task.Task`
+	"""
+	uid = tsk.uid()
+	sig = self.task_sigs.get(uid)
+	if sig is None:
+		return
+
+	deps = self.node_deps.get(uid)
+	if deps is not None:
+		deps = [x.abspath() for x in deps]
+
+	outputs = []
+	for x in tsk.outputs:
+		path = x.abspath()
+		outputs.append((path, getattr(x, 'sig', None), self.task_sigs.get(path)))
+
+	# the tasks retrieved from the cache are not timed
+	duration = None
+	if not getattr(tsk, 'cached', None):
+		try:
+			duration = self.task_stats[uid][2]
+		except (KeyError, IndexError, TypeError):
+			pass
+
+	rec = (uid, sig, self.task_sigs.get((uid, 'imp')), deps, self.raw_deps.get(uid), outputs, duration)
+	write_record(self, rec)
+Build.BuildContext.journal_task = journal_task
+
+def replay(self):
+	"""Load the records from the journal, and remove the incomplete record at the end if any"""
+	path = journal_path(self)
+	try:
+		f = open(path, 'r+b')
+	except (IOError, OSError):
+		return
+
+	count = 0
+	root = self.root
+	valid = True
+	try:
+		pos = 0
+		while 1:
+			try:
+				rec = cPickle.load(f)
+			except EOFError:
+				break
+			except Exception:
+				Logs.debug('build: truncating the journal %s at %d' % (path, pos))
+				f.seek(pos)
+				f.truncate()
+				break
+			pos = f.tell()
+			count += 1
+
+			if rec[0] is None and len(rec) == 3:
+				valid = rec[2] == Utils.HASH
+				continue
+			if not valid:
+				continue
+
+			if rec[0] is None:
+				# changes to bld.file_stats
+				for (x, v) in rec[1]:
+					if v is None:
+						self.file_stats.pop(root.make_node(x), None)
+					else:
+						self.file_stats[root.make_node(x)] = v
+				continue
+
+			(uid, sig, imp, deps, raw, outputs, duration) = rec
+			if sig is None:
+				# the task was started, but it did not complete
+				self.task_sigs.pop(uid, None)
+				continue
+			self.task_sigs[uid] = sig
+			if imp is not None:
+				self.task_sigs[(uid, 'imp')] = imp
+			if deps is not None:
+				self.node_deps[uid] = [root.make_node(x) for x in deps]
+			if raw is not None:
+				self.raw_deps[uid] = raw
+			for (x, nsig, tsig) in outputs:
+				node = root.make_node(x)
+				if nsig is not None:
+					node.sig = nsig
+				if tsig is not None:
+					self.task_sigs[x] = tsig
+			if duration is not None:
+				self.add_duration(uid, duration)
+	finally:
+		f.close()
+	self.journal_records = count
+	self.journal_stats = dict(self.file_stats)
+	Logs.debug('build: replayed %d records from the journal %s' % (count, path))
+
+def restore(self):
+	self.restore_journal()
+	self.journal_stats = dict(self.file_stats)
+	replay(self)
+Build.BuildContext.restore_journal = Build.BuildContext.restore
+Build.BuildContext.restore = restore
+
+def close_journal(bld):
+	lock.acquire()
+	try:
+		f = getattr(bld, 'journal_file', None)
+		if f:
+			f.close()
+			bld.journal_file = None
+	finally:
+		lock.release()
+
+def write_stats(bld):
+	"""Append the changes made to :py:attr:`waflib.Build.BuildContext.file_stats` during the build"""
+	old = getattr(bld, 'journal_stats', {})
+	new = bld.file_stats
+	lst = []
+	for (k, v) in new.items():
+		if old.get(k) is not v:
+			lst.append((k.abspath(), v))
+	for k in old:
+		if not k in new:
+			lst.append((k.abspath(), None))
+	if lst:
+		write_record(bld, (None, lst))
+	bld.journal_stats = dict(new)
+
+def store(self):
+	close_journal(self)
+
+	count = getattr(self, 'journal_records', 0)
+	if getattr(self, 'journal_active', False) and not getattr(self, 'journal_compact', False):
+		if count < MIN_RECORDS or count < COMPACT_RATIO * len(self.task_sigs):
+			write_stats(self)
+			close_journal(self)
+			return
+
+	# write the full build data and remove the journal
+	self.store_journal()
+	try:
+		os.unlink(journal_path(self))
+	except OSError:
+		pass
+	self.journal_records = 0
+	self.journal_compact = False
+Build.BuildContext.store_journal = Build.BuildContext.store
+Build.BuildContext.store = store
+
+def compile(self):
+	self.journal_active = True
+	try:
+		self.compile_journal()
+	finally:
+		self.journal_active = False
+		close_journal(self)
+Build.BuildContext.compile_journal = Build.BuildContext.compile
+Build.BuildContext.compile = compile
+
+def process(self):
+	bld = self.generator.bld
+	if not isinstance(self, Task.Task) or self.master.stop or not getattr(bld, 'journal_active', False):
+		process_journal(self)
+		return
+
+	# the task signature is removed before the task is executed, so a task
+	# interrupted or failing will be executed again in the next build
+	write_record(bld, (self.uid(), None, None, None, None, (), None))
+
+	# the class methods post_run are wrapped by Task.cache_outputs, wrap the instance method
+	post_run = self.post_run
+	def post_run_journal():
+		ret = post_run()
+		bld.journal_task(self)
+		return ret
+	self.post_run = post_run_journal
+	try:
+		process_journal(self)
+	finally:
+		try:
+			del self.post_run
+		except AttributeError:
+			pass
+process_journal = Task.TaskBase.process
+Task.TaskBase.process = process
@@ -84,7 +84,7 @@ Task.TaskBase.classes = Task.classes
 def setitem(self, key, value):
 	if key.startswith('CCFLAGS'):
 		key = key[1:]
-	self.table[key] = value
+	self._set_table_value(key, value)
 ConfigSet.ConfigSet.__setitem__ = setitem
 
 @TaskGen.feature('d')
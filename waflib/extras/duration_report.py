@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Display reports on the task durations recorded in the build data
+(:py:attr:`waflib.Build.BuildContext.task_stats`) after the build::
+
+	def options(opt):
+		opt.load('duration_report')
+
+	$ waf --slowest=20     # the 20 tasks having the longest average duration
+	$ waf --regressions    # the tasks executed that were much slower than in the previous build
+
+Only the tasks of the current build are reported. The tasks retrieved from the
+cache (WAFCACHE) and the tasks executed only once have no previous duration, and
+they are not reported as regressions.
+"""
+
+from waflib import Build, Task, Logs, Options, Utils
+
+REGRESSION_RATIO = 1.5
+"""Report the tasks whose last duration exceeds the previous one by this ratio"""
+
+REGRESSION_MIN = 0.1
+"""and by this amount of seconds at least (the short tasks vary too much)"""
+
+def options(opt):
+	opt.add_option('--slowest', action='store', type='int', default=0, dest='slowest',
+		help='display the slowest tasks (average duration) after the build, e.g. "--slowest=20"')
+	opt.add_option('--regressions', action='store_true', default=False, dest='regressions',
+		help='display the tasks slower than in the previous build')
+
+def get_tasks(bld):
+	"""Return the tasks of the build having duration statistics, with their statistics"""
+	lst = []
+	for i in range(len(bld.groups)):
+		for tsk in bld.get_tasks_group(i):
+			try:
+				stats = bld.task_stats[tsk.uid()]
+			except (AttributeError, KeyError):
+				continue
+			lst.append((tsk, stats))
+	return lst
+
+def describe(tsk):
+	return str(tsk).strip()
+
+def report_slowest(bld, lst, num):
+	lst = sorted(lst, key=lambda x: x[1][1], reverse=True)[:num]
+	if not lst:
+		return
+	Logs.pprint('NORMAL', 'Slowest tasks (average, last, executions):')
+	for (tsk, (cnt, avg, last, prev)) in lst:
+		Logs.pprint('NORMAL', '%12s %12s %5d  %s' % (Utils.fmt_duration(avg), Utils.fmt_duration(last), cnt, describe(tsk)))
+
+def report_regressions(bld, lst):
+	reg = []
+	for (tsk, (cnt, avg, last, prev)) in lst:
+		if tsk.hasrun != Task.SUCCESS or getattr(tsk, 'cached', None) or cnt < 2:
+			continue
+		if last > prev * REGRESSION_RATIO and last - prev > REGRESSION_MIN:
+			reg.append((last - prev, tsk, last, prev))
+	if not reg:
+		return
+	reg.sort(key=lambda x: x[0], reverse=True)
+	Logs.pprint('YELLOW', 'Tasks slower than in the previous build (previous -> last):')
+	for (diff, tsk, last, prev) in reg:
+		Logs.pprint('YELLOW', '%12s -> %12s (+%d%%)  %s' % (Utils.fmt_duration(prev), Utils.fmt_duration(last),
+			int(100 * diff / max(prev, 0.001)), describe(tsk)))
+
+def compile(self):
+	try:
+		self.compile_report()
+	finally:
+		num = getattr(Options.options, 'slowest', 0)
+		regressions = getattr(Options.options, 'regressions', False)
+		if num or regressions:
+			lst = get_tasks(self)
+			if num:
+				report_slowest(self, lst, num)
+			if regressions:
+				report_regressions(self, lst)
+Build.BuildContext.compile_report = Build.BuildContext.compile
+Build.BuildContext.compile = compile
+
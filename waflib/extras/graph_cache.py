@@ -0,0 +1,530 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Skip the execution of the build scripts on the null builds by keeping the posted task graph between the runs::
+
+	def options(opt):
+		opt.load('graph_cache')
+
+After a build, the tasks returned by :py:meth:`waflib.Build.BuildContext.get_build_iterator` are written to the file
+.wafpickle-*_graph in the build directory, with their inputs, outputs, environments and constraints (run_after).
+The graph is valid as long as the following inputs remain the same:
+
+* the build scripts executed and the python modules imported from the project folders
+* the configuration files (c4che) and the command-line options
+* the results of the calls to :py:meth:`waflib.Node.Node.ant_glob`
+
+On the next build, when the inputs are unchanged, the tasks are re-created from the file and their signatures are
+computed as usual. If none of them has to be executed, the build ends without reading the build scripts. Else the
+scripts are executed, the task generators posted and the tasks executed normally.
+
+The scripts must not depend on anything else (os.environ, os.listdir, find_node...), and they must not
+declare manual dependencies (bld.add_manual_dependency) or pre/post build functions, else the graph is not kept.
+The tasks needing attributes of their task generators to determine their status (qt4, java, ...) always lead
+to a normal build. The install, uninstall and step commands are not affected.
+"""
+
+import os, sys
+try:
+	import cPickle
+except:
+	import pickle as cPickle
+from waflib import Build, ConfigSet, Context, Errors, Logs, Node, Options, Task, Utils
+
+CACHE_FILE = Context.DBFILE + '_graph'
+"""Name of the file holding the task graph in the build directory"""
+
+IGNORED_OPTIONS = ('jobs', 'progress_bar', 'verbose', 'zones', 'keep', 'trace', 'startup_report')
+"""Command-line options that do not have any effect on the task graph"""
+
+SIG_METHODS = ('uid', 'signature', 'sig_explicit_deps', 'sig_vars', 'sig_implicit_deps', 'compute_sig_implicit_deps', 'runnable_status')
+"""Methods used for computing the task status, a task class created by the scripts must use the default ones"""
+
+TASK_ATTRS = ('generator', 'env', 'inputs', 'outputs', 'dep_nodes', 'run_after', 'hasrun', 'uid_', 'cache_sig', 'm', 'position')
+"""Task attributes stored separately or recomputed"""
+
+GEN_ATTRS = ('bld', 'path', 'env', 'tasks', 'idx', 'posted')
+"""Task generator attributes not stored"""
+
+class graph_gen(object):
+	"""Stand-in for the task generators of the tasks read from the cache, with their plain attributes"""
+	def __init__(self, bld, path, attrs):
+		self.__dict__.update(attrs)
+		self.bld = bld
+		self.path = path
+
+	def __repr__(self):
+		return 'cached task generator %r in %s' % (getattr(self, 'name', ''), self.path.abspath())
+
+def get_func(meth):
+	return getattr(meth, '__func__', meth)
+
+def is_plain(v):
+	"""Return True if the value can be stored and compared safely"""
+	if v is None or isinstance(v, (str, int, float, bool)):
+		return True
+	if sys.hexversion < 0x3000000 and isinstance(v, (unicode, long)):
+		return True
+	if isinstance(v, (list, tuple)):
+		for x in v:
+			if not is_plain(x):
+				return False
+		return True
+	if isinstance(v, dict):
+		return is_plain(list(v.keys())) and is_plain(list(v.values()))
+	return False
+
+def plain_attrs(obj, skip):
+	"""Return the attributes of an object that can be stored"""
+	ret = {}
+	for (k, v) in obj.__dict__.items():
+		if not k in skip and is_plain(v):
+			ret[k] = v
+	return ret
+
+def get_node(bld, path):
+	"""Find a node in the tree restored from the build data (no filesystem access)"""
+	cur = bld.root
+	for x in path.split(os.sep):
+		if not x:
+			continue
+		try:
+			cur = cur.children[x]
+		except (AttributeError, KeyError):
+			return None
+	return cur
+
+def wrappers(cls):
+	"""
+	Return the decorators applied on the task class (:py:func:`waflib.Task.always_run`,
+	:py:func:`waflib.Task.update_outputs`) or None if a status method was redefined
+	"""
+	for x in SIG_METHODS[:-1]:
+		if get_func(getattr(cls, x)) is not get_func(getattr(Task.Task, x)):
+			return None
+
+	lst = []
+	std = get_func(Task.Task.runnable_status)
+	fun = get_func(cls.runnable_status)
+	while fun is not std:
+		if fun.__module__ != Task.__name__ or not fun.__name__ in ('always', 'runnable_status'):
+			return None
+		lst.append(fun.__name__ == 'always' and 'always_run' or 'update_outputs')
+		for cell in fun.__closure__ or ():
+			val = get_func(cell.cell_contents)
+			if hasattr(val, '__code__'):
+				fun = val
+				break
+		else:
+			return None
+	lst.reverse()
+	return lst
+
+def graph_key(bld, scripts, globs):
+	"""
+	Compute the data identifying a task graph
+
+	:param scripts: paths of the build scripts and project modules
+	:type scripts: list of string
+	:param globs: calls to ant_glob recorded (folder path, arguments, hash of the results)
+	:type globs: list of tuple
+	"""
+	opts = [(k, v) for (k, v) in vars(Options.options).items() if not k in IGNORED_OPTIONS]
+	opts.sort()
+
+	cfg = []
+	try:
+		lst = Utils.listdir(bld.cache_dir)
+	except OSError:
+		lst = []
+	lst.sort()
+	for x in lst:
+		cfg.append((x, Utils.h_file(os.path.join(bld.cache_dir, x))))
+
+	return {
+		'version': (Context.HEXVERSION, sys.hexversion),
+		'cmd': (bld.cmd, bld.variant, repr(opts)),
+		'config': cfg,
+		'scripts': [(x, Utils.h_file(x)) for x in scripts],
+		'globs': globs,
+	}
+
+def project_scripts(bld):
+	"""Return the build scripts executed and the modules imported from the project folders"""
+	lst = set([x.abspath() for x in bld.recurse_cache])
+	top = bld.srcnode.abspath() + os.sep
+	out = bld.bldnode.abspath() + os.sep
+	wafdir = os.path.abspath(Context.waf_dir) + os.sep
+	for mod in list(sys.modules.values()):
+		f = getattr(mod, '__file__', None)
+		if not f:
+			continue
+		f = os.path.abspath(f)
+		if f.endswith(('.pyc', '.pyo')):
+			f = f[:-1]
+		if f.startswith(top) and not f.startswith(out) and not f.startswith(wafdir):
+			lst.add(f)
+	lst = list(lst)
+	lst.sort()
+	return lst
+
+def glob_hash(nodes):
+	return Utils.h_list([x.abspath() for x in nodes])
+
+def ant_glob(self, *k, **kw):
+	ret = ant_glob_graph(self, *k, **kw)
+	lst = getattr(self.ctx, 'graph_globs', None)
+	if lst is not None:
+		if is_plain(k) and is_plain(list(kw.values())):
+			items = list(kw.items())
+			items.sort()
+			lst.append((self.abspath(), k, tuple(items), glob_hash(ret)))
+		else:
+			self.ctx.graph_skip = 'ant_glob called with %r %r' % (k, kw)
+	return ret
+ant_glob_graph = Node.Node.ant_glob
+Node.Node.ant_glob = ant_glob
+
+def valid(bld, data):
+	"""Return True if the graph stored matches the current build scripts, configuration, options and folders"""
+	try:
+		key = data['key']
+		if key['version'] != (Context.HEXVERSION, sys.hexversion):
+			return False
+		cur = graph_key(bld, [x for (x, h) in key['scripts']], key['globs'])
+	except (KeyError, TypeError, IOError, OSError):
+		return False
+	if cur != key:
+		return False
+
+	for (path, k, kw, h) in key['globs']:
+		node = get_node(bld, path)
+		if not node:
+			return False
+		if glob_hash(ant_glob_graph(node, *k, **dict(kw))) != h:
+			return False
+	return True
+
+def stand_in(rec):
+	"""Re-create a task class declared by the scripts, the tasks are not meant to be executed"""
+	(clsname, hcode, vars, deco, has_scan) = rec
+	def run(self):
+		raise Errors.WafError('task %r was read from the graph cache' % self)
+	def scan(self):
+		raise Errors.WafError('task %r was read from the graph cache' % self)
+
+	saved = dict(Task.classes)
+	try:
+		cls = type(Task.Task)(clsname, (Task.Task,), {'hcode': hcode, 'vars': vars, 'run': run, 'nocache': True, 'scan': has_scan and scan or None})
+	finally:
+		Task.classes.clear()
+		Task.classes.update(saved)
+	for x in deco:
+		getattr(Task, x)(cls)
+	return cls
+
+def load_graph(bld, data):
+	"""Re-create the task groups from the data stored, return None if a task class or a node is missing"""
+	classes = {}
+	for (name, rec) in data['classes'].items():
+		cls = Task.classes.get(name)
+		if cls:
+			# the classes declared by the tools must be the same
+			if cls.__name__ != rec[0] or cls.hcode != rec[1] or cls.vars != rec[2]:
+				Logs.debug('graph: task class %r has changed' % name)
+				return None
+		elif rec[3] is None:
+			Logs.debug('graph: task class %r is not available' % name)
+			return None
+		else:
+			cls = stand_in(rec)
+		classes[name] = cls
+
+	envs = []
+	for rec in data['envs']:
+		if rec[0] == 'all':
+			try:
+				env = bld.all_envs[rec[1]]
+			except KeyError:
+				return None
+		else:
+			env = ConfigSet.ConfigSet()
+			env.table = rec[1]
+			if rec[2] is not None:
+				env.parent = envs[rec[2]]
+		envs.append(env)
+
+	cache = {}
+	def nodes(lst):
+		ret = []
+		for x in lst:
+			try:
+				nd = cache[x]
+			except KeyError:
+				nd = cache[x] = get_node(bld, x)
+				if nd is None:
+					Logs.debug('graph: no node for %r' % x)
+					raise ValueError(x)
+			ret.append(nd)
+		return ret
+
+	tasks = []
+	try:
+		gens = [graph_gen(bld, nodes([path])[0], attrs) for (path, attrs) in data['gens']]
+		for (name, gen, env, inputs, outputs, dep_nodes, attrs) in data['tasks']:
+			tg = gens[gen]
+			cls = classes[name]
+			tsk = cls.__new__(cls)
+			tsk.__dict__.update(attrs)
+			tsk.hasrun = Task.NOT_RUN
+			tsk.generator = tg
+			tsk.env = envs[env]
+			tsk.inputs = nodes(inputs)
+			tsk.outputs = nodes(outputs)
+			tsk.dep_nodes = nodes(dep_nodes)
+			tsk.run_after = set([])
+			tasks.append(tsk)
+	except ValueError:
+		return None
+
+	for (tsk, lst) in zip(tasks, data['run_after']):
+		tsk.run_after.update([tasks[x] for x in lst])
+	return [[tasks[x] for x in grp] for grp in data['groups']]
+
+def null_build(bld, groups):
+	"""Return True if none of the tasks has to be executed (the tasks are given in a topological order)"""
+	try:
+		for (i, tasks) in enumerate(groups):
+			bld.cur = i
+			bld.cur_tasks = tasks
+			for tsk in tasks:
+				# like Node.find_or_declare when the scripts are executed
+				for x in tsk.outputs:
+					if not os.path.isfile(x.abspath()):
+						Logs.debug('graph: %r must be created' % x)
+						return False
+				try:
+					st = tsk.runnable_status()
+				except Exception:
+					Logs.debug('graph: cannot get the status of %r: %r' % (tsk, sys.exc_info()[1]))
+					return False
+				if st != Task.SKIP_ME:
+					Logs.debug('graph: %r must be executed' % tsk)
+					return False
+				tsk.hasrun = Task.SKIPPED
+		return True
+	finally:
+		# the build order computed from the implicit dependencies refers to these tasks
+		try:
+			del bld.dct_implicit_nodes
+		except AttributeError:
+			pass
+		bld.cur = 0
+		bld.cur_tasks = []
+
+def read_graph(bld):
+	try:
+		f = open(os.path.join(bld.variant_dir, CACHE_FILE), 'rb')
+		try:
+			return cPickle.load(f)
+		finally:
+			f.close()
+	except Exception:
+		return None
+
+def write_graph(bld, data):
+	db = os.path.join(bld.variant_dir, CACHE_FILE)
+	f = None
+	try:
+		try:
+			f = open(db + '.tmp', 'wb')
+			cPickle.dump(data, f, -1)
+		finally:
+			if f:
+				f.close()
+		if Utils.is_win32 and os.path.exists(db):
+			os.unlink(db)
+		os.rename(db + '.tmp', db)
+	except Exception:
+		Logs.debug('graph: could not write the task graph: %r' % sys.exc_info()[1])
+		try:
+			os.unlink(db + '.tmp')
+		except OSError:
+			pass
+
+class recorder(object):
+	"""Store the tasks returned by the build iterator in a form that can be pickled"""
+	def __init__(self, bld):
+		self.bld = bld
+		self.index = {}
+		self.tasks = []
+		self.run_after = []
+		self.groups = []
+		self.classes = {}
+		self.envs = []
+		self.env_index = {}
+		self.gens = []
+		self.gen_index = {}
+		self.shared = dict([(id(v), k) for (k, v) in bld.all_envs.items()])
+
+	def add_env(self, env):
+		try:
+			return self.env_index[id(env)]
+		except KeyError:
+			pass
+		if id(env) in self.shared:
+			rec = ('all', self.shared[id(env)], None)
+		else:
+			parent = getattr(env, 'parent', None)
+			if parent is not None:
+				parent = self.add_env(parent)
+			rec = ('set', env.table, parent)
+		self.env_index[id(env)] = len(self.envs)
+		self.envs.append(rec)
+		return self.env_index[id(env)]
+
+	def add_gen(self, gen):
+		try:
+			return self.gen_index[id(gen)]
+		except KeyError:
+			pass
+		if gen is None or not getattr(gen, 'path', None):
+			raise ValueError('%r has no task generator' % gen)
+		self.gen_index[id(gen)] = len(self.gens)
+		self.gens.append((gen.path.abspath(), plain_attrs(gen, GEN_ATTRS)))
+		return self.gen_index[id(gen)]
+
+	def add_class(self, cls):
+		name = cls.__name__
+		if name.endswith('_task'):
+			name = name.replace('_task', '')
+		if not name in self.classes:
+			if Task.classes.get(name) is not cls:
+				raise ValueError('task class %r is not registered' % name)
+			self.classes[name] = (cls.__name__, cls.hcode, list(cls.vars), wrappers(cls), bool(cls.scan))
+		return name
+
+	def add_group(self, tasks):
+		pos = len(self.tasks)
+		for tsk in tasks:
+			if not isinstance(tsk, Task.Task):
+				raise ValueError('%r is not a Task' % tsk)
+			self.index[id(tsk)] = pos
+			pos += 1
+		self.tasks.extend([None] * len(tasks))
+		self.run_after.extend([None] * len(tasks))
+
+		# predecessors first
+		order = []
+		seen = set([])
+		for tsk in tasks:
+			stack = [(tsk, False)]
+			while stack:
+				(cur, done) = stack.pop()
+				if done:
+					order.append(cur)
+				elif not id(cur) in seen:
+					seen.add(id(cur))
+					stack.append((cur, True))
+					for x in cur.run_after:
+						if not id(x) in seen and self.index.get(id(x), -1) >= self.index[id(tasks[0])]:
+							stack.append((x, False))
+
+		grp = []
+		for tsk in order:
+			if tsk.generator is tsk:
+				raise ValueError('%r has no task generator' % tsk)
+			try:
+				run_after = [self.index[id(x)] for x in tsk.run_after]
+			except KeyError:
+				raise ValueError('%r runs after a task outside of the graph' % tsk)
+			pos = self.index[id(tsk)]
+			self.tasks[pos] = (self.add_class(tsk.__class__),
+				self.add_gen(tsk.generator),
+				self.add_env(tsk.env),
+				[x.abspath() for x in tsk.inputs],
+				[x.abspath() for x in tsk.outputs],
+				[x.abspath() for x in tsk.dep_nodes],
+				plain_attrs(tsk, TASK_ATTRS))
+			self.run_after[pos] = run_after
+			grp.append(pos)
+		self.groups.append(grp)
+
+def get_build_iterator(self):
+	rec = getattr(self, 'graph_recorder', None)
+	for tasks in self.get_build_iterator_graph():
+		if tasks and rec and not getattr(self, 'graph_skip', None):
+			try:
+				rec.add_group(tasks)
+			except ValueError:
+				self.graph_skip = str(sys.exc_info()[1])
+		yield tasks
+Build.BuildContext.get_build_iterator_graph = Build.BuildContext.get_build_iterator
+Build.BuildContext.get_build_iterator = get_build_iterator
+
+def execute_build(self):
+	self.graph_recorder = None
+	if self.is_install or isinstance(self, Build.StepContext):
+		return self.execute_build_graph()
+
+	data = read_graph(self)
+	if data and not valid(self, data):
+		Logs.debug('graph: the scripts, the configuration, the options or the folders have changed')
+	elif data:
+		try:
+			groups = load_graph(self, data)
+		except Exception:
+			# incompatible data
+			groups = None
+		if groups is None:
+			Logs.debug('graph: the task graph stored cannot be used')
+			data = None
+		elif null_build(self, groups):
+			Logs.debug('graph: no task to execute, the build scripts were not read')
+			Logs.info("Waf: Entering directory `%s'" % self.variant_dir)
+			Logs.info("Waf: Leaving directory `%s'" % self.variant_dir)
+			return
+		else:
+			Logs.debug('graph: the task graph stored has tasks to execute')
+
+	self.graph_data = data
+	self.graph_skip = None
+	self.graph_globs = []
+	self.graph_recorder = recorder(self)
+	try:
+		self.execute_build_graph()
+	finally:
+		self.graph_recorder = self.graph_globs = self.graph_data = None
+Build.BuildContext.execute_build_graph = Build.BuildContext.execute_build
+Build.BuildContext.execute_build = execute_build
+
+def pre_build(self):
+	# called after the scripts are executed
+	if getattr(self, 'graph_recorder', None):
+		if getattr(self, 'pre_funs', None) or getattr(self, 'post_funs', None) or self.deps_man:
+			self.graph_skip = 'pre/post build functions or manual dependencies'
+	self.pre_build_graph()
+Build.BuildContext.pre_build_graph = Build.BuildContext.pre_build
+Build.BuildContext.pre_build = pre_build
+
+def post_build(self):
+	# called after a successful build
+	rec = getattr(self, 'graph_recorder', None)
+	if rec:
+		(globs, self.graph_globs) = (self.graph_globs, None)
+		if self.graph_skip:
+			Logs.debug('graph: the task graph is not kept: %s' % self.graph_skip)
+		else:
+			try:
+				key = graph_key(self, project_scripts(self), globs)
+			except (IOError, OSError):
+				key = None
+			data = self.graph_data
+			if key and not (data and data.get('key') == key):
+				write_graph(self, {'key': key, 'classes': rec.classes, 'envs': rec.envs, 'gens': rec.gens,
+					'tasks': rec.tasks, 'run_after': rec.run_after, 'groups': rec.groups})
+	self.post_build_graph()
+Build.BuildContext.post_build_graph = Build.BuildContext.post_build
+Build.BuildContext.post_build = post_build
+
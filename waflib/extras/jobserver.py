@@ -0,0 +1,239 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Share the job slots with GNU make through the jobserver protocol (POSIX only)::
+
+	def options(opt):
+		opt.load('jobserver')
+
+When waf is executed from a makefile with a parallel make (the rule must start with '+' or use $(MAKE)),
+the file descriptors given in MAKEFLAGS (--jobserver-fds or --jobserver-auth) are used: a token is read
+from the pipe before a task is given to the task consumers, and it is written back when the task completes.
+Like a sub-make, waf uses one implicit job slot for which no token is needed.
+
+Otherwise waf creates the jobserver: a pipe holding one token per job (-j) minus the implicit one,
+shared by the tasks and by the processes started through :py:meth:`waflib.Context.Context.exec_command`
+(MAKEFLAGS is set in the environment and the file descriptors are passed to the child processes).
+The sub-makes (playground/extern_makefile, extras/make.py) then execute their jobs in the slots
+not used by waf instead of adding their own -j slots.
+
+The processes started through the tool process_pool do not receive the file descriptors.
+
+The tokens are read without blocking, so that a token taken by another process between the select
+and the read does not block the scheduler. On Linux the pipe is opened again through /proc/self/fd
+with O_NONBLOCK, and the other processes keep their blocking descriptors. Elsewhere the read end of
+the pipe itself is made non-blocking, which GNU make (>= 4.0) supports.
+"""
+
+import os, re, sys, errno, select
+from waflib import Build, Context, Logs, Runner, Task, Utils
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+POLL = 0.05
+"""Interval in seconds for checking if the implicit job slot is available while waiting for a token"""
+
+IMPLICIT = 'implicit'
+"""Token value representing the implicit job slot"""
+
+re_fds = re.compile(r'--jobserver-(?:fds|auth)=(\d+),(\d+)')
+re_fifo = re.compile(r'--jobserver-auth=fifo:(\S+)')
+
+class jobserver(object):
+	"""
+	Job slots obtained from a pipe
+
+	:param rfd: file descriptor to read the tokens from
+	:type rfd: int
+	:param wfd: file descriptor to write the tokens to
+	:type wfd: int
+	:param owner: True if the pipe was created by this process
+	:type owner: bool
+	"""
+	def __init__(self, rfd, wfd, owner=False):
+		self.rfd = rfd
+		self.wfd = wfd
+		self.owner = owner
+		self.read_fd = nonblocking(rfd)
+		"""Descriptor from which the tokens are read, in non-blocking mode"""
+		self.implicit = True
+		self.lock = Utils.threading.Lock()
+
+	def makeflags(self, jobs):
+		"""Return the value of MAKEFLAGS for the child processes"""
+		return ' -j%d --jobserver-fds=%d,%d --jobserver-auth=%d,%d' % (jobs, self.rfd, self.wfd, self.rfd, self.wfd)
+
+	def take_implicit(self):
+		self.lock.acquire()
+		try:
+			ret = self.implicit
+			self.implicit = False
+			return ret
+		finally:
+			self.lock.release()
+
+	def acquire(self):
+		"""
+		Wait for a job slot (called from the main thread)
+
+		:return: the token read, or :py:const:`waflib.extras.jobserver.IMPLICIT`
+		"""
+		while 1:
+			if self.take_implicit():
+				return IMPLICIT
+			try:
+				lst = select.select([self.read_fd], [], [], POLL)[0]
+			except select.error:
+				e = sys.exc_info()[1]
+				if e.args[0] == errno.EINTR:
+					continue
+				raise
+			if not lst:
+				continue
+			try:
+				c = os.read(self.read_fd, 1)
+			except OSError:
+				e = sys.exc_info()[1]
+				if e.errno in (errno.EAGAIN, errno.EINTR):
+					# another process took the token
+					continue
+				raise
+			if c:
+				return c
+			# the parent closed the pipe, run on the implicit slot only
+			Logs.warn('The jobserver pipe was closed')
+			while not self.take_implicit():
+				select.select([], [], [], POLL)
+			return IMPLICIT
+
+	def release(self, token):
+		"""Return a token obtained from :py:meth:`waflib.extras.jobserver.jobserver.acquire` (called from any thread)"""
+		if token == IMPLICIT:
+			self.lock.acquire()
+			self.implicit = True
+			self.lock.release()
+		else:
+			os.write(self.wfd, token)
+
+	def close(self):
+		if self.read_fd != self.rfd:
+			os.close(self.read_fd)
+		if self.owner:
+			os.close(self.rfd)
+			os.close(self.wfd)
+
+def nonblocking(fd):
+	"""
+	Return a descriptor reading from the same pipe as fd in non-blocking mode: the pipe is opened
+	again through /proc/self/fd when possible, else O_NONBLOCK is set on fd
+
+	:param fd: file descriptor
+	:type fd: int
+	:rtype: int
+	"""
+	try:
+		return os.open('/proc/self/fd/%d' % fd, os.O_RDONLY | os.O_NONBLOCK)
+	except OSError:
+		pass
+	fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+	return fd
+
+def valid_fd(fd):
+	try:
+		os.fstat(fd)
+	except OSError:
+		return False
+	return True
+
+def get_client():
+	"""Return a :py:class:`waflib.extras.jobserver.jobserver` for the pipe given by a parent make, if any"""
+	flags = os.environ.get('MAKEFLAGS', '')
+	m = re_fifo.search(flags)
+	if m:
+		try:
+			fd = os.open(m.group(1), os.O_RDWR)
+		except OSError:
+			Logs.warn('Could not open the jobserver fifo %r' % m.group(1))
+			return None
+		return jobserver(fd, fd, True)
+	m = re_fds.search(flags)
+	if m:
+		(r, w) = (int(m.group(1)), int(m.group(2)))
+		if valid_fd(r) and valid_fd(w):
+			return jobserver(r, w)
+		Logs.warn('The jobserver is not available, prefix the make rule with "+"')
+	return None
+
+def get_server(jobs):
+	"""Create a pipe holding jobs - 1 tokens, and export it in MAKEFLAGS"""
+	(r, w) = os.pipe()
+	os.write(w, ('+' * (jobs - 1)).encode())
+	js = jobserver(r, w, True)
+	js.old_makeflags = os.environ.get('MAKEFLAGS')
+	os.environ['MAKEFLAGS'] = js.makeflags(jobs)
+	return js
+
+def execute_build(self):
+	js = None
+	if Utils.is_win32:
+		pass
+	elif os.environ.get('MAKEFLAGS', '').find('--jobserver-') >= 0:
+		js = get_client()
+	elif self.jobs > 1:
+		js = get_server(self.jobs)
+	self.jobserver = js
+	try:
+		self.execute_build_jobserver()
+	finally:
+		self.jobserver = None
+		if js:
+			js.close()
+			if js.owner and hasattr(js, 'old_makeflags'):
+				if js.old_makeflags is None:
+					del os.environ['MAKEFLAGS']
+				else:
+					os.environ['MAKEFLAGS'] = js.old_makeflags
+Build.BuildContext.execute_build_jobserver = Build.BuildContext.execute_build
+Build.BuildContext.execute_build = execute_build
+
+def add_task(self, tsk):
+	js = getattr(self.bld, 'jobserver', None)
+	if js:
+		tsk.jobserver_token = (js, js.acquire())
+	self.add_task_jobserver(tsk)
+Runner.Parallel.add_task_jobserver = Runner.Parallel.add_task
+Runner.Parallel.add_task = add_task
+
+def process(self):
+	try:
+		process_jobserver(self)
+	finally:
+		try:
+			(js, token) = self.jobserver_token
+		except AttributeError:
+			pass
+		else:
+			del self.jobserver_token
+			js.release(token)
+process_jobserver = Task.TaskBase.process
+Task.TaskBase.process = process
+
+def exec_command(self, cmd, **kw):
+	js = getattr(self, 'jobserver', None)
+	if js:
+		env = kw.get('env')
+		if env is not None and not 'MAKEFLAGS' in env:
+			env = dict(env)
+			env['MAKEFLAGS'] = os.environ.get('MAKEFLAGS', '')
+			kw['env'] = env
+		if sys.hexversion >= 0x3020000:
+			kw['pass_fds'] = tuple(set(kw.get('pass_fds', ())) | set([js.rfd, js.wfd]))
+		else:
+			kw['close_fds'] = False
+	return self.exec_command_jobserver(cmd, **kw)
+Context.Context.exec_command_jobserver = Context.Context.exec_command
+Context.Context.exec_command = exec_command
+
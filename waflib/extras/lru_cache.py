@@ -2,8 +2,8 @@
 # encoding: utf-8
 # Thomas Nagy 2011
 
-import os, shutil, re
-from waflib import Options, Build, Logs
+import os, shutil, re, time
+from waflib import Options, Build, Logs, Task, Utils
 
 """
 Apply a least recently used policy to the Waf cache.
@@ -14,6 +14,25 @@ We assume that the the folders are written atomically
 
 Do export WAFCACHE=/tmp/foo-xyz where xyz represents the cache size in megabytes
 If missing, the default cache size will be set to 10GB
+
+The sizes and the access times of the cache entries are kept in an index in the cache
+folder, which is updated by :py:meth:`waflib.Task.Task.put_files_cache` and
+:py:meth:`waflib.Task.Task.can_retrieve_cache` instead of listing the cache after each build:
+
+* lru.log: records appended after each build (entry stored, entry used, entry removed), in the order of the accesses
+* lru.state: total size, access time of the first record, amount of entries and of records, offset of the first record
+* lru.lock: the builders sharing the cache acquire a lock on this file while updating the index
+
+The entries are removed from the head of the log, and the offset of the first record not processed is kept
+in lru.state: a trim only reads the records of the entries removed, and the older records of the entries
+used again since (the index file of an entry is touched when it is used). The log is rewritten when it
+contains more than COMPACT records per entry. The index is created from the cache contents if lru.state
+is missing (remove it to rebuild the index).
+
+The size and the age limits may also be given in the environment, for example::
+
+	export WAFCACHE_MAX_SIZE=50000000000 # bytes
+	export WAFCACHE_MAX_AGE=2592000 # seconds, the entries not used for 30 days are removed
 """
 
 re_num = re.compile('[a-zA-Z_]+(\d+)')
@@ -22,12 +41,23 @@ CACHESIZE = 10*1024*1024*1024 # in bytes
 CLEANRATIO = 0.8
 DIRSIZE = 4096
 
+MAXAGE = 0
+"""Remove the entries not used for MAXAGE seconds (0 to disable)"""
+
+COMPACT = 4
+"""Rewrite the log when it contains more than COMPACT records per entry"""
+
+LOGFILE = 'lru.log'
+STATEFILE = 'lru.state'
+LOCKFILE = 'lru.lock'
+
 def compile(self):
 	if Options.cache_global and not Options.options.nocache:
 		try:
 			os.makedirs(Options.cache_global)
 		except:
 			pass
+	self.lru_records = []
 
 	try:
 		self.raw_compile()
@@ -35,62 +65,305 @@ def compile(self):
 		if Options.cache_global and not Options.options.nocache:
 			self.sweep()
 
-def sweep(self):
-	global CACHESIZE
-	CACHEDIR = Options.cache_global
+def entry_key(tsk):
+	"""Return the path of the cache entry of a task relative to the cache folder"""
+	return os.sep.join(tsk.cache_path().split(os.sep)[-2:])
+
+def entry_size(path):
+	"""Return the size of a cache entry by reading its index file, or None if the entry does not exist"""
+	try:
+		lines = Utils.readf(os.path.join(path, Task.CACHE_INDEX)).splitlines()
+	except (OSError, IOError):
+		return None
+	cnt = DIRSIZE # each entry takes 4kB
+	for x in lines:
+		cnt += int(x.split(' ', 1)[0].split(':')[0])
+	return cnt
+
+def can_retrieve_cache(self):
+	ret = self.lru_can_retrieve_cache()
+	if ret:
+		lst = getattr(self.generator.bld, 'lru_records', None)
+		if lst is not None:
+			lst.append(('h', entry_key(self), int(time.time())))
+	return ret
+Task.Task.lru_can_retrieve_cache = Task.Task.can_retrieve_cache
+Task.Task.can_retrieve_cache = can_retrieve_cache
+
+def put_files_cache(self):
+	lst = getattr(self.generator.bld, 'lru_records', None)
+	if lst is None or getattr(self, 'cached', None) or not getattr(self, 'outputs', None):
+		return self.lru_put_files_cache()
+
+	dname = self.cache_path()
+	old = entry_size(dname)
+	ret = self.lru_put_files_cache()
+	new = entry_size(dname)
+	if new is None:
+		if old is not None:
+			lst.append(('d', entry_key(self), old))
+	else:
+		lst.append(('p', entry_key(self), int(time.time()), new, old or 0))
+	return ret
+Task.Task.lru_put_files_cache = Task.Task.put_files_cache
+Task.Task.put_files_cache = put_files_cache
+
+def lock(path):
+	"""Acquire an exclusive lock on the index, return the file to pass to :py:func:`unlock`"""
+	f = open(os.path.join(path, LOCKFILE), 'a')
+	if Utils.fcntl:
+		Utils.fcntl.flock(f.fileno(), Utils.fcntl.LOCK_EX)
+	return f
+
+def unlock(f):
+	if Utils.fcntl:
+		Utils.fcntl.flock(f.fileno(), Utils.fcntl.LOCK_UN)
+	f.close()
+
+def read_state(path):
+	"""Return the list [total size, oldest access time, entries, records, offset] or None if the index does not exist"""
+	try:
+		state = [int(x) for x in Utils.readf(os.path.join(path, STATEFILE)).split()]
+	except (OSError, IOError, ValueError):
+		return None
+	if len(state) != 5:
+		return None
+	return state
+
+def write_state(path, state):
+	tmp = os.path.join(path, STATEFILE + '.tmp')
+	f = open(tmp, 'w')
+	try:
+		f.write(' '.join([str(x) for x in state]))
+	finally:
+		f.close()
+	os.rename(tmp, os.path.join(path, STATEFILE))
+
+def write_log(path, entries):
+	"""Replace the log by the records of the entries given, in the order of the accesses"""
+	lst = list(entries.items())
+	lst.sort(key=lambda x: x[1][0])
+	tmp = os.path.join(path, LOGFILE + '.tmp')
+	f = open(tmp, 'w')
+	try:
+		for (k, v) in lst:
+			f.write('p %s %d %d\n' % (k, v[0], v[1]))
+	finally:
+		f.close()
+	os.rename(tmp, os.path.join(path, LOGFILE))
+
+def parse(line):
+	"""Return the kind, the entry, the access time and the size from a record of the log (time and size may be None)"""
+	if not isinstance(line, str):
+		line = line.decode('utf-8')
+	lst = line.split()
+	if lst[0] == 'p':
+		return ('p', lst[1], int(lst[2]), int(lst[3]))
+	elif lst[0] == 'h':
+		return ('h', lst[1], int(lst[2]), None)
+	elif lst[0] == 'd':
+		return ('d', lst[1], None, None)
+	raise ValueError('invalid record %r' % line)
+
+def read_log(path, offset=0):
+	"""Return a dict mapping the entries to [access time, size] from the records after the offset given (the size may be None)"""
+	entries = {}
+	try:
+		f = open(os.path.join(path, LOGFILE), 'rb')
+	except (OSError, IOError):
+		return entries
+	try:
+		f.seek(offset)
+		for line in f:
+			try:
+				(kind, k, t, s) = parse(line)
+			except (IndexError, ValueError):
+				# incomplete record
+				continue
+			if kind == 'p':
+				entries[k] = [t, s]
+			elif kind == 'h':
+				try:
+					entries[k][0] = t
+				except KeyError:
+					# stored before the offset
+					entries[k] = [t, None]
+			else:
+				entries.pop(k, None)
+	finally:
+		f.close()
+	return entries
 
+def remove(path):
+	"""Remove a cache entry"""
+	v = path + '.del'
+	try:
+		os.rename(path, v)
+	except:
+		# someone already did it
+		pass
+	else:
+		try:
+			shutil.rmtree(v)
+		except:
+			# this should not happen, but who knows?
+			Logs.warn('If you ever see this message, report it (%r)' % v)
+
+def trim(path, state, size, limit):
+	"""
+	Remove the least recently used entries by reading the log from the offset kept in the state, until the
+	total size is below the size limit and until the entries are more recent than the time limit. The records
+	of the entries used again later are skipped. The state is updated.
+	"""
+	try:
+		f = open(os.path.join(path, LOGFILE), 'rb')
+	except (OSError, IOError):
+		return
+	try:
+		f.seek(state[4])
+		state[1] = 0
+		while 1:
+			line = f.readline()
+			if not line.endswith(b'\n'):
+				# end of the log, or record being written
+				break
+			try:
+				(kind, k, t, s) = parse(line)
+			except (IndexError, ValueError):
+				kind = 'd'
+			if kind != 'd' and state[0] < size * CLEANRATIO and not t < limit:
+				state[1] = t
+				break
+			state[4] += len(line)
+			if kind == 'd':
+				continue
+
+			p = os.path.join(path, k)
+			try:
+				if int(os.stat(os.path.join(p, Task.CACHE_INDEX)).st_mtime) > t:
+					# used again, there is a more recent record
+					continue
+			except OSError:
+				# already removed
+				continue
+			s = entry_size(p)
+			remove(p)
+			if s is not None:
+				state[0] -= s
+				state[2] -= 1
+	finally:
+		f.close()
+
+def compact(path, state):
+	"""Rewrite the log with one record per entry, the records before the offset are dropped"""
+	entries = read_log(path, state[4])
+	for (k, v) in list(entries.items()):
+		if v[1] is None:
+			v[1] = entry_size(os.path.join(path, k))
+			if v[1] is None:
+				del entries[k]
+	write_log(path, entries)
+	state[:] = [sum([v[1] for v in entries.values()]), min([v[0] for v in entries.values()] or [0]), len(entries), len(entries), 0]
+
+def scan(path):
+	"""Create the index from the contents of the cache (slow)"""
+	entries = {}
+	for y in Utils.listdir(path):
+		k = os.path.join(path, y)
+		if len(y) != 2 or not os.path.isdir(k):
+			continue
+		for x in Utils.listdir(k):
+			j = os.path.join(k, x)
+			if x.endswith('.del') or not os.path.isdir(j): # see Task.cache_path
+				continue
+			# the index file is touched when the entry is used
+			try:
+				t = int(os.stat(os.path.join(j, Task.CACHE_INDEX)).st_mtime)
+			except OSError:
+				continue
+			s = entry_size(j)
+			if s is not None:
+				entries[os.path.join(y, x)] = [t, s]
+	return entries
+
+def get_limits():
+	"""Return the maximum size of the cache and the maximum age of the entries"""
+	size = CACHESIZE
 	# get the cache max size from the WAFCACHE filename
-	re_num = re.compile('[a-zA-Z_]+(\d+)')
 	val = re_num.sub('\\1', os.path.basename(Options.cache_global))
 	try:
-		CACHESIZE = int(val)
+		size = int(val)
 	except:
 		pass
+	try:
+		size = int(os.environ['WAFCACHE_MAX_SIZE'])
+	except (KeyError, ValueError):
+		pass
+	try:
+		age = int(os.environ['WAFCACHE_MAX_AGE'])
+	except (KeyError, ValueError):
+		age = MAXAGE
+	return (size, age)
 
-	# map folder names to timestamps
-	flist = {}
-	for x in os.listdir(CACHEDIR):
-		j = os.path.join(CACHEDIR, x)
-		if os.path.isdir(j) and len(x) == 64: # dir names are md5 hexdigests
-			flist[x] = [os.stat(j).st_mtime, 0]
-
-	for (x, v) in flist.items():
-		cnt = DIRSIZE # each entry takes 4kB
-		d = os.path.join(CACHEDIR, x)
-		for k in os.listdir(d):
-			cnt += os.stat(os.path.join(d, k)).st_size
-		flist[x][1] = cnt
-
-	total = sum([x[1] for x in flist.values()])
-	Logs.debug('lru: Cache size is %r' % total)
-
-	if total >= CACHESIZE:
-		Logs.debug('lru: Trimming the cache since %r > %r' % (total, CACHESIZE))
-
-		# make a list to sort the folders by timestamp
-		lst = [(p, v[0], v[1]) for (p, v) in flist.items()]
-		lst.sort(key=lambda x: x[1]) # sort by timestamp
-		lst.reverse()
-
-		while total >= CACHESIZE * CLEANRATIO:
-			(k, t, s) = lst.pop()
-			p = os.path.join(CACHEDIR, k)
-			v = p + '.del'
-			try:
-				os.rename(p, v)
-			except:
-				# someone already did it
-				pass
+def update(path, records):
+	"""Append the records of the build to the log and return the new state (the index must be locked)"""
+	state = read_state(path)
+	if state is None:
+		entries = scan(path)
+		write_log(path, entries)
+		state = [sum([v[1] for v in entries.values()]), min([v[0] for v in entries.values()] or [0]), len(entries), len(entries), 0]
+		Logs.debug('lru: Created the index for %r entries' % len(entries))
+		# the entries are already accounted for
+		records = [x for x in records if x[0] == 'h']
+
+	if records:
+		lst = []
+		for x in records:
+			if x[0] == 'p':
+				lst.append('p %s %d %d\n' % x[1:4])
+				state[0] += x[3] - x[4]
+				if not x[4]:
+					state[2] += 1
+			elif x[0] == 'h':
+				lst.append('h %s %d\n' % x[1:])
 			else:
-				try:
-					shutil.rmtree(v)
-				except:
-					# this should not happen, but who knows?
-					Logs.warn('If you ever see this message, report it (%r)' % v)
-			total -= s
-			del flist[k]
-
-	Logs.debug('lru: Total at the end %r' % total)
+				lst.append('d %s\n' % x[1])
+				state[0] -= x[2]
+				state[2] -= 1
+			if not state[1] and x[0] != 'd':
+				state[1] = x[2]
+		f = open(os.path.join(path, LOGFILE), 'a')
+		try:
+			f.write(''.join(lst))
+		finally:
+			f.close()
+		state[3] += len(lst)
+	return state
+
+def sweep(self):
+	CACHEDIR = Options.cache_global
+	records = getattr(self, 'lru_records', [])
+	self.lru_records = []
+	(size, age) = get_limits()
+
+	fl = lock(CACHEDIR)
+	try:
+		state = update(CACHEDIR, records)
+		(total, oldest, count, lines, offset) = state
+		Logs.debug('lru: Cache size is %r' % total)
+
+		limit = age and time.time() - age or 0
+		if total >= size or (limit and oldest and oldest < limit):
+			Logs.debug('lru: Trimming the cache since %r > %r' % (total, size))
+			trim(CACHEDIR, state, size, limit)
+		if state[3] > COMPACT * (state[2] + 100):
+			compact(CACHEDIR, state)
+
+		write_state(CACHEDIR, state)
+	finally:
+		unlock(fl)
+
+	Logs.debug('lru: Total at the end %r' % state[0])
 
 Build.BuildContext.raw_compile = Build.BuildContext.compile
 Build.BuildContext.compile = compile
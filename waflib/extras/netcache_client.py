@@ -22,10 +22,21 @@ The cache can be enabled for the build only:
 		opt.load('netcache_client', funs=[])
 	def build(bld):
 		bld.setup_netcache('localhost', 51200, 'PUSH_PULL')
+
+When a group of tasks is about to be executed, the server is asked about the
+cache entries of all the tasks which are ready and which must run in a single request,
+so that the cache misses do not cost a round trip each. The requests for the files of
+a task are pipelined (all the requests are sent before the answers are read), and the
+consumers transfer files concurrently over the connections from active_connections.
+Set BATCH to False to disable the batched requests (servers not supporting BAT).
+
+The task identifiers and the hashes of the configuration variables are computed
+from relative paths by the tool relocatable_cache.py, which is loaded when the
+cache is enabled: both tools may be loaded in any order.
 """
 
 import os, socket, time, atexit
-from waflib import Task, Logs, Utils, Build, Options, Runner
+from waflib import Task, Logs, Utils, Options, Runner
 from waflib.Configure import conf
 
 BUF = 8192 * 16
@@ -36,10 +47,17 @@ STALE_TIME = 30 # seconds
 GET = 'GET'
 PUT = 'PUT'
 LST = 'LST'
+BAT = 'BAT'
 BYE = 'BYE'
 
+BATCH = True
+"""Ask about the cache entries of the tasks ready in a group in a single request"""
+
 all_sigs_in_cache = (0.0, [])
 
+known_entries = {}
+"""Amount of files in the cache entries obtained from the batched requests"""
+
 active_connections = Runner.Queue(0)
 def get_connection():
 	# return a new connection... do not forget to release it!
@@ -47,6 +65,8 @@ def get_connection():
 		ret = active_connections.get(block=False)
 	except Exception:
 		ret = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		# the headers are small, do not wait for the acknowledgements
+		ret.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 		ret.connect(Task.net_cache[:2])
 	return ret
 
@@ -88,6 +108,21 @@ def read_header(conn):
 		cnt += len(data)
 	return ''.join(buf)
 
+def read_data(conn, size, f=None):
+	"""Read *size* bytes from the connection, write them to the file *f* if given, else return them"""
+	buf = []
+	cnt = 0
+	while cnt < size:
+		data = conn.recv(min(BUF, size-cnt))
+		if not data:
+			raise ValueError('connection ended %r %r' % (cnt, size))
+		if f:
+			f.write(data)
+		else:
+			buf.append(data)
+		cnt += len(data)
+	return ''.join(buf)
+
 def check_cache(conn, ssig):
 	"""
 	List the files on the server, this is an optimization because it assumes that
@@ -105,46 +140,67 @@ def check_cache(conn, ssig):
 		ret = read_header(conn)
 		size = int(ret.split(',')[0])
 
-		buf = []
-		cnt = 0
-		while cnt < size:
-			data = conn.recv(min(BUF, size-cnt))
-			if not data:
-				raise ValueError('connection ended %r %r' % (cnt, size))
-			buf.append(data)
-			cnt += len(data)
-		all_sigs_in_cache = (time.time(), ''.join(buf).split('\n'))
+		all_sigs_in_cache = (time.time(), read_data(conn, size).split('\n'))
 		Logs.debug('netcache: server cache has %r entries' % len(all_sigs_in_cache[1]))
 
 	if not ssig in all_sigs_in_cache[1]:
 		raise ValueError('no file %s in cache' % ssig)
 
-class MissingFile(Exception):
-	pass
-
-def recv_file(conn, ssig, count, p):
-	check_cache(conn, ssig)
+def query_entries(conn, lst):
+	"""
+	Ask the server about several cache entries at once
 
-	params = (GET, ssig, str(count))
+	:param lst: cache keys
+	:type lst: list of string
+	:return: amount of files in the cache entries
+	:rtype: list of int
+	"""
+	data = '\n'.join(lst)
+	params = (BAT, str(len(data)))
 	conn.send(','.join(params).ljust(HEADER_SIZE))
-	data = read_header(conn)
-
-	size = int(data.split(',')[0])
+	conn.sendall(data)
+
+	ret = read_header(conn)
+	size = int(ret.split(',')[0])
+	if size < 0:
+		raise ValueError('batched requests are not supported')
+	ret = [int(x) for x in read_data(conn, size).split('\n')]
+	if len(ret) != len(lst):
+		raise ValueError('invalid response %r' % ret)
+	return ret
 
-	if size == -1:
-		raise MissingFile('no file %s - %s in cache' % (ssig, count))
+class MissingFile(Exception):
+	pass
 
-	# get the file, writing immediately
-	# TODO a tmp file would be better
-	f = open(p, 'wb')
-	cnt = 0
-	while cnt < size:
-		data = conn.recv(min(BUF, size-cnt))
-		if not data:
-			raise ValueError('connection ended %r %r' % (cnt, size))
-		f.write(data)
-		cnt += len(data)
-	f.close()
+def recv_files(conn, ssig, paths):
+	"""
+	Send the requests for all the files of a cache entry, then read the files.
+	All the answers are read so that the connection remains usable.
+	"""
+	data = []
+	for (count, p) in enumerate(paths):
+		params = (GET, ssig, str(count))
+		data.append(','.join(params).ljust(HEADER_SIZE))
+	conn.sendall(''.join(data))
+
+	missing = None
+	for (count, p) in enumerate(paths):
+		data = read_header(conn)
+		size = int(data.split(',')[0])
+
+		if size == -1:
+			missing = MissingFile('no file %s - %s in cache' % (ssig, count))
+			continue
+
+		# get the file, writing immediately
+		# TODO a tmp file would be better
+		f = open(p, 'wb')
+		try:
+			read_data(conn, size, f)
+		finally:
+			f.close()
+	if missing:
+		raise missing
 
 def put_data(conn, ssig, cnt, p):
 	#print "pushing %r %r %r" % (ssig, cnt, p)
@@ -152,15 +208,16 @@ def put_data(conn, ssig, cnt, p):
 	params = (PUT, ssig, str(cnt), str(size))
 	conn.send(','.join(params).ljust(HEADER_SIZE))
 	f = open(p, 'rb')
-	cnt = 0
-	while cnt < size:
-		r = f.read(min(BUF, size-cnt))
-		while r:
-			k = conn.send(r)
-			if not k:
-				raise ValueError('connection ended')
-			cnt += k
-			r = r[k:]
+	try:
+		cnt = 0
+		while cnt < size:
+			r = f.read(min(BUF, size-cnt))
+			if not r:
+				raise ValueError('file %r changed' % p)
+			conn.sendall(r)
+			cnt += len(r)
+	finally:
+		f.close()
 
 #def put_data(conn, ssig, cnt, p):
 #	size = os.stat(p).st_size
@@ -179,19 +236,22 @@ def can_retrieve_cache(self):
 		return
 	self.cached = False
 
-	cnt = 0
 	sig = self.signature()
-	ssig = self.uid().encode('hex') + sig.encode('hex')
+	ssig = task_key(self)
+
+	count = known_entries.get(ssig)
+	if count is not None and count < len(self.outputs):
+		# the server was asked already
+		return False
 
 	conn = None
 	err = False
 	try:
 		try:
 			conn = get_connection()
-			for node in self.outputs:
-				p = node.abspath()
-				recv_file(conn, ssig, cnt, p)
-				cnt += 1
+			if count is None:
+				check_cache(conn, ssig)
+			recv_files(conn, ssig, [node.abspath() for node in self.outputs])
 		except MissingFile as e:
 			Logs.debug('netcache: file is not in the cache %r' % e)
 			err = True
@@ -229,8 +289,7 @@ def put_files_cache(self):
 
 	#print "called put_files_cache", id(self)
 	bld = self.generator.bld
-	sig = self.signature()
-	ssig = self.uid().encode('hex') + sig.encode('hex')
+	ssig = task_key(self)
 
 	conn = None
 	cnt = 0
@@ -255,47 +314,73 @@ def put_files_cache(self):
 
 	bld.task_sigs[self.uid()] = self.cache_sig
 
-def hash_env_vars(self, env, vars_lst):
-	if not env.table:
-		env = env.parent
-		if not env:
-			return Utils.SIG_NIL
+def task_key(tsk):
+	"""Return the key of the cache entry for a task"""
+	return tsk.uid().encode('hex') + tsk.signature().encode('hex')
 
-	idx = str(id(env)) + str(vars_lst)
+def batch_query(bld, tasks):
+	"""
+	Ask the server about the tasks of a group which are ready to be executed and
+	which are not up-to-date, the results are stored in :py:const:`known_entries`
+	"""
+	global BATCH
+	lst = []
+	for tsk in tasks:
+		if not getattr(tsk, 'outputs', None) or tsk.hasrun:
+			continue
+		for x in tsk.run_after:
+			if not x.hasrun:
+				break
+		else:
+			cached = hasattr(tsk, 'uid_')
+			try:
+				try:
+					ssig = task_key(tsk)
+					if bld.task_sigs.get(tsk.uid()) != tsk.cache_sig:
+						lst.append(ssig)
+				except Exception:
+					pass
+			finally:
+				# the inputs and the signature may change in runnable_status
+				try:
+					del tsk.cache_sig
+				except AttributeError:
+					pass
+				if not cached:
+					try:
+						del tsk.uid_
+					except AttributeError:
+						pass
+	if not lst:
+		return
+
+	conn = None
 	try:
-		cache = self.cache_env
-	except AttributeError:
-		cache = self.cache_env = {}
-	else:
 		try:
-			return self.cache_env[idx]
-		except KeyError:
-			pass
-
-	v = str([env[a] for a in vars_lst])
-	v = v.replace(self.srcnode.abspath(), '') # here
-	m = Utils.md5()
-	m.update(v.encode())
-	ret = m.digest()
-
-	Logs.debug('envhash: %r %r', ret, v)
-
-	cache[idx] = ret
+			conn = get_connection()
+			for (k, v) in zip(lst, query_entries(conn, lst)):
+				known_entries[k] = v
+		except Exception as e:
+			Logs.debug('netcache: disabling the batched requests %r' % e)
+			BATCH = False
+			close_connection(conn)
+			conn = None
+	finally:
+		release_connection(conn)
+	Logs.debug('netcache: asked about %r cache entries' % len(lst))
 
-	return ret
+def build_iterator(bld, biter):
+	"""Ask the server about the tasks of each group before the tasks are scheduled"""
+	for tasks in biter:
+		if BATCH and Task.net_cache and Task.net_cache[-1] != 'PUSH':
+			batch_query(bld, tasks)
+		yield tasks
 
-def uid(self):
-	try:
-		return self.uid_
-	except AttributeError:
-		m = Utils.md5()
-		src = self.generator.bld.srcnode
-		up = m.update
-		up(self.__class__.__name__.encode())
-		for x in self.inputs + self.outputs:
-			up(x.path_from(src).encode())
-		self.uid_ = m.digest()
-		return self.uid_
+def start(self):
+	known_entries.clear()
+	if self.biter is not None:
+		self.biter = build_iterator(self.bld, self.biter)
+	self.netcache_start()
 
 @conf
 def setup_netcache(ctx, host, port, mode):
@@ -303,8 +388,11 @@ def setup_netcache(ctx, host, port, mode):
 	Task.net_cache = (host, port, mode)
 	Task.Task.can_retrieve_cache = can_retrieve_cache
 	Task.Task.put_files_cache = put_files_cache
-	Task.Task.uid = uid
-	Build.BuildContext.hash_env_vars = hash_env_vars
+	# the task identifiers and the env hashes must not depend on the project location
+	from waflib.extras import relocatable_cache
+	if not hasattr(Runner.Parallel, 'netcache_start'):
+		Runner.Parallel.netcache_start = Runner.Parallel.start
+		Runner.Parallel.start = start
 	ctx.cache_global = Options.cache_global = True
 
 def options(opt):
@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Execute the python functions of the tasks in a pool of processes instead of the
+consumer threads. The tasks written in python (substitutions, code generators, etc)
+are otherwise serialized by the global interpreter lock. Only the tasks having the
+class attribute *process_pool* set to True are affected, the functions and the parameters
+must be picklable (see :py:meth:`waflib.Task.TaskBase.exec_function`)::
+
+	def options(opt):
+		opt.load('process_pool')
+	def build(bld):
+		bld(features='subst', source='foo.pc.in', target='foo.pc')
+
+The amount of processes defaults to the amount of jobs (waf --process-pool=4 to change it,
+or --process-pool=0 to disable the pool)
+"""
+
+import atexit
+from waflib import Task, Runner, Options, Logs
+
+try:
+	import multiprocessing
+except ImportError:
+	multiprocessing = None
+
+pool = None
+"""Pool of processes, created at the beginning of the build"""
+
+def options(opt):
+	opt.add_option('--process-pool', action='store', type='int', default=-1, dest='process_pool',
+		help='amount of processes for executing the python tasks [Default: the amount of jobs]')
+
+def get_pool():
+	"""
+	Create the pool of processes if necessary. This must happen before the consumer threads
+	are started since the processes are forked.
+	"""
+	global pool
+	if pool is None and multiprocessing:
+		n = getattr(Options.options, 'process_pool', -1)
+		if n < 0:
+			n = Options.options.jobs
+		if n > 1:
+			try:
+				pool = multiprocessing.Pool(n)
+			except Exception as e:
+				Logs.warn('Could not create the process pool: %r' % e)
+				pool = False
+			else:
+				atexit.register(close_pool)
+	return pool
+
+def close_pool():
+	global pool
+	if pool:
+		pool.close()
+		pool.join()
+	pool = None
+
+def exec_function(self, fun, *k):
+	if self.process_pool and pool:
+		return pool.apply_async(fun, k).get()
+	return fun(*k)
+Task.TaskBase.exec_function = exec_function
+
+old_start = Runner.Parallel.start
+def start(self):
+	get_pool()
+	old_start(self)
+Runner.Parallel.start = start
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Compute the task identifiers and the task signatures from paths relative to the source
+and to the build directories, so that the cache entries (WAFCACHE or the network cache)
+may be shared by several checkouts of a project, by branches and by variants::
+
+	def options(opt):
+		opt.load('relocatable_cache')
+
+The task identifiers (:py:meth:`waflib.Task.Task.uid`) hash the paths of the inputs and of the outputs
+relative to bld.srcnode or bld.bldnode, and the absolute paths of these two folders are removed from the
+values of the configuration variables (INCPATHS, LIBPATH, etc) before they are hashed
+(:py:meth:`waflib.Build.BuildContext.hash_env_vars`).
+
+The outputs may still contain absolute paths (debugging information, rpath, ...), and
+the tasks are not executed again when the project is moved to another folder. To detect
+the project moves, see the tool relocation.py.
+
+This tool is also loaded by netcache_client.py when the network cache is enabled, so
+the two tools use the same task identifiers whatever the order in which they are loaded.
+The methods are replaced when the module is first imported only, so a tool redefining
+Task.uid or BuildContext.hash_env_vars must be loaded after this one.
+"""
+
+from waflib import Build, Task, Utils, Logs
+
+def node_path(bld, node):
+	"""Return the path of a node relative to the build directory or to the source directory"""
+	if node.is_child_of(bld.bldnode):
+		return '${BLD}/' + node.path_from(bld.bldnode)
+	if node.is_child_of(bld.srcnode):
+		return '${SRC}/' + node.path_from(bld.srcnode)
+	return node.abspath()
+
+def uid(self):
+	try:
+		return self.uid_
+	except AttributeError:
+		m = Utils.md5()
+		up = m.update
+		up(self.__class__.__name__.encode())
+		bld = self.generator.bld
+		for x in self.inputs + self.outputs:
+			up(node_path(bld, x).encode())
+		self.uid_ = m.digest()
+		return self.uid_
+Task.Task.uid = uid
+
+def hash_env_vars(self, env, vars_lst):
+	if not env.table:
+		env = env.parent
+		if not env:
+			return Utils.SIG_NIL
+
+	idx = str(id(env)) + str(vars_lst)
+	try:
+		cache = self.cache_env
+	except AttributeError:
+		cache = self.cache_env = {}
+	else:
+		try:
+			return self.cache_env[idx]
+		except KeyError:
+			pass
+
+	v = str([env[a] for a in vars_lst])
+	# the build directory is usually in the source directory
+	v = v.replace(self.bldnode.abspath(), '${BLD}')
+	v = v.replace(self.srcnode.abspath(), '${SRC}')
+	m = Utils.md5()
+	m.update(v.encode())
+	ret = m.digest()
+
+	Logs.debug('envhash: %s %r', Utils.to_hex(ret), v)
+
+	cache[idx] = ret
+
+	return ret
+Build.BuildContext.hash_env_vars = hash_env_vars
+